@@ -1,65 +1,405 @@
-from aux_methods import tokenize_and_preprocess
-import json
+from aux_methods import default_tokenizer, tokenize_and_preprocess
+from index_storage import ForwardIndex, PositionalIndex, forward_path, load_index, positions_path, stems_path
+from phrase_query import matching_documents, parse_query
+from relevance_feedback import expand_query
+from dynamic_pruning import max_score_top_k, pruning_pays_off, select_top_k
+from query_cache import query_key
+import profiling
 from collections import Counter
-import numpy as np
+import xml.etree.ElementTree as ET
+import json
+import math
+import os
 
 
-def answer_query(index_path, query, out_path):
+class QueryEngine:
     """
-    :param out_path: the path+filename where the results will be saved
-    :param index_path: the path where the index is stored
-    :param query: user query to answer
-    :return: a list of relevant documents sorted in descending order by their cosine similarity
-    to the query.
+    Keeps an index loaded in memory and answers any number of queries against it.
     """
+    index_path: str  # the path where the index is stored
+    index: object  # the index reader returned by index_storage.load_index
+    cache: object  # a query_cache.QueryResultCache of the rankings, or None
+    positional_index: object  # the index_storage.PositionalIndex of phrase queries, opened by the first one
+    feedback: int  # the number of top documents that expand every query (see relevance_feedback), 0 or None for none
+    forward_index: object  # the index_storage.ForwardIndex of relevance feedback, opened by the first query
+
+    def __init__(self, index_path: str, cache=None):
+        self.index_path = index_path
+        with profiling.span("index.load"):
+            self.index = load_index(index_path)
+        # the stems of the corpus spare importing nltk for the queries whose words all appear in it
+        if os.path.exists(stems_path(index_path)):
+            with profiling.span("index.stems_load"):
+                default_tokenizer.load_stems(stems_path(index_path))
+        self.cache = cache
+        self.positional_index = None
+        self.feedback = None
+        self.forward_index = None
+
+    def query_weights(self, query):
+        """
+        :param query: user query
+        :return: (weights, query_length) - weights is a list of (token, token_weight, idf) in the order the tokens
+        appear in the query (repeated tokens appear more than once), and query_length is the norm of the query vector.
+        """
+        tokens_without_stopwords = tokenize_and_preprocess(query)
+        if len(tokens_without_stopwords) == 0:
+            return [], 0.0
+
+        counter_tokens = Counter(tokens_without_stopwords)
+
+        max_occurrences = max(counter_tokens.values())
+
+        for token in counter_tokens:
+            counter_tokens[token] /= max_occurrences
+
+        weights = []
+        query_length = 0
+        for token in tokens_without_stopwords:
+            tf_in_query = counter_tokens[token]
+            idf_token = self.index.idf(token)  # idf = 0 if token is not in the corpus
+            token_weight = tf_in_query * idf_token
+            query_length += token_weight ** 2
+            weights.append((token, token_weight, idf_token))
+
+        return weights, math.sqrt(query_length)
+
+    def score(self, query):
+        """
+        :param query: user query
+        :return: a map between a doc id and its cosine similarity to the query, for every document that shares a
+        token with the query.
+        """
+        return self.score_weights(*self.query_weights(query))
+
+    def score_weights(self, weights, query_length):
+        """
+        :param weights: the query weights returned by query_weights
+        :param query_length: the norm of the query vector returned by query_weights
+        :return: see score.
+        """
+        if query_length == 0:
+            return dict()
+
+        cosine_similarity_dict = dict()  # map between doc_id and its cosine similarity with the query
+        postings_scanned = 0
+
+        for token, token_weight, idf_token in weights:
+            doc_ids, tfs = self.index.postings(token)
+            postings_scanned += len(doc_ids)
+
+            for doc_id, tf in zip(doc_ids, tfs):
+                # calculate inner product between the query and doc_id
+                if doc_id not in cosine_similarity_dict:
+                    cosine_similarity_dict[doc_id] = 0.0
+
+                cosine_similarity_dict[doc_id] += token_weight * idf_token * tf
+
+        # normalize by the lengths of the query and the document
+        for doc_id in cosine_similarity_dict:
+            cosine_similarity_dict[doc_id] /= query_length * self.index.document_length(doc_id)
+
+        if profiling.profiler is not None:
+            profiling.profiler.count("postings_scanned", postings_scanned)
+            profiling.profiler.count("candidates_scored", len(cosine_similarity_dict))
+        return cosine_similarity_dict
+
+    def rank(self, query, top_k=None):
+        """
+        :param query: user query
+        :param top_k: if given, only the top_k best documents are retrieved, see top_k_scores
+        :return: the ids of the relevant documents sorted in descending order by their cosine similarity to the
+        query. A document is relevant if its score is at least 0.2 of the best score. With a cache, queries that
+        reduce to the same query weights are only ranked once per index version. Queries with phrases or NEAR/k
+        (see phrase_query) and queries with feedback are not cached.
+        """
+        text, constraints = parse_query(query)
+        if self.feedback or constraints:
+            return [doc_id for doc_id, _ in self.rank_scored(query, top_k)]
+
+        with profiling.span("query.tokenize"):
+            weights, query_length = self.query_weights(text)
+        if self.cache is None:
+            return self.rank_weights(weights, query_length, top_k)
+
+        key = query_key(weights, top_k)
+        ranked_documents = self.cache.get(self.index.index_version, key)
+        if ranked_documents is None:
+            ranked_documents = self.rank_weights(weights, query_length, top_k)
+            self.cache.put(self.index.index_version, key, ranked_documents)
+        return ranked_documents
+
+    def rank_weights(self, weights, query_length, top_k=None):
+        """
+        :param weights: the query weights returned by query_weights
+        :param query_length: the norm of the query vector returned by query_weights
+        :param top_k: see rank
+        :return: see rank.
+        """
+        if top_k is not None:
+            return [doc_id for doc_id, _ in self.rank_top_k_scored(weights, query_length, top_k)]
+
+        with profiling.span("query.score"):
+            cosine_similarity_dict = self.score_weights(weights, query_length)
+        with profiling.span("query.rank"):
+            return self.rank_scores(cosine_similarity_dict)
+
+    def rank_scores(self, cosine_similarity_dict):
+        """
+        :param cosine_similarity_dict: the scores returned by score
+        :return: see rank.
+        """
+        if len(cosine_similarity_dict) == 0:
+            return []
+
+        # get the maximum score in absolute value and leave only the top 4/5 scores.
+        best_score = max(abs(value) for value in cosine_similarity_dict.values())
+        most_similar = {doc_id: score for doc_id, score in cosine_similarity_dict.items()
+                        if abs(score) >= 0.2 * best_score}
+
+        return sorted(most_similar, key=most_similar.get, reverse=True)
 
-    tokens_without_stopwords = tokenize_and_preprocess(query)
+    def top_k_scores(self, weights, query_length, top_k):
+        """
+        :param weights: the query weights returned by query_weights
+        :param query_length: the norm of the query vector returned by query_weights
+        :param top_k: the maximal number of documents to return, at least 1
+        :return: a list of (doc_id, score) of the top_k best documents, in descending order of score. Documents with
+            equal scores are ordered by doc id. They are retrieved with MaxScore pruning when it pays off (see
+            dynamic_pruning.pruning_pays_off), and otherwise by scoring every document.
+        """
+        check_top_k(top_k)
+        if pruning_pays_off(self.index, weights, top_k):
+            with profiling.span("query.max_score"):
+                return max_score_top_k(self.index, weights, query_length, top_k)
+        with profiling.span("query.score"):
+            cosine_similarity_dict = self.score_weights(weights, query_length)
+        with profiling.span("query.rank"):
+            return select_top_k(cosine_similarity_dict, top_k)
 
-    counter_tokens = Counter(tokens_without_stopwords)
+    def rank_top_k_scored(self, weights, query_length, top_k):
+        """
+        :return: the ranked (doc_id, score) pairs of rank_scored_weights with top_k: the top_k best documents, with
+            the 0.2 x best score cutoff of rank.
+        """
+        top_documents = self.top_k_scores(weights, query_length, top_k)
+        if len(top_documents) == 0:
+            return []
 
-    max_occurrences = max(counter_tokens.values())
+        best_score = abs(top_documents[0][1])
+        return [(doc_id, score) for doc_id, score in top_documents if abs(score) >= 0.2 * best_score]
 
-    for token in counter_tokens:
-        counter_tokens[token] /= max_occurrences
+    def rank_scored(self, query, top_k=None):
+        """
+        :param query: user query
+        :param top_k: see rank
+        :return: the documents of rank(query, top_k) as (doc_id, score) pairs, where score is the cosine similarity
+        of the document and the query. The cache only holds doc ids, so it is not used.
+        """
+        text, constraints = parse_query(query)
+        weights, query_length = self.query_weights(text)
+        if self.feedback:
+            return self.rank_feedback(weights, query_length, constraints, top_k)
+        if constraints:
+            return self.rank_matching(weights, query_length, constraints, top_k)
+        return self.rank_scored_weights(weights, query_length, top_k)
 
-    with open(index_path, 'r') as file_json:
-        json_index_data = json.load(file_json)
+    def rank_scored_weights(self, weights, query_length, top_k=None):
+        """
+        :return: see rank_scored, for the query weights returned by query_weights.
+        """
+        if top_k is not None:
+            return self.rank_top_k_scored(weights, query_length, top_k)
 
-    query_length = 0
-    cosine_similarity_dict = dict()  # map between doc_id and its cosine similarity with the query
+        cosine_similarity_dict = self.score_weights(weights, query_length)
+        return [(doc_id, cosine_similarity_dict[doc_id]) for doc_id in self.rank_scores(cosine_similarity_dict)]
 
-    for token in tokens_without_stopwords:
-        tf_in_query = counter_tokens[token]
-        idf_token = float(json_index_data["idf"].get(token, 0))  # idf = 0 if token is not in the corpus
-        token_weight = tf_in_query * idf_token
-        query_length += token_weight ** 2
-        tf_map = json_index_data["tf"].get(token, dict())
+    def matching_documents(self, constraints):
+        """
+        :param constraints: the constraints returned by phrase_query.parse_query
+        :return: the set of doc ids that satisfy every constraint, from the positions saved next to the index.
+        """
+        if self.positional_index is None:
+            self.positional_index = self._open_sidecar(positions_path(self.index_path), PositionalIndex,
+                                                       "positions for phrase and NEAR/k queries", "--positions")
 
-        for doc_id, tf in tf_map.items():
-            # calculate inner product between the query and doc_id
-            if doc_id not in cosine_similarity_dict:
-                cosine_similarity_dict[doc_id] = 0.0
+        with profiling.span("query.match_positions"):
+            return matching_documents(self.positional_index, constraints)
 
-            cosine_similarity_dict[doc_id] += token_weight * idf_token * tf
+    def _open_sidecar(self, path, reader_class, description, option):
+        """
+        :return: reader_class(path), for a file that create_index saves next to the index with option.
+        """
+        if not os.path.exists(path):
+            raise ValueError(f"{self.index_path} has no {description}, create it with {option}")
+        reader = reader_class(path)
+        if reader.index_version != self.index.index_version:
+            reader.close()
+            raise ValueError(f"{path} does not match the current version of {self.index_path}, create it again "
+                             f"with {option}")
+        return reader
 
-    query_length = np.sqrt(query_length)
+    def rank_matching(self, weights, query_length, constraints, top_k=None):
+        """
+        :param weights: the query weights of the query text returned by phrase_query.parse_query
+        :param query_length: the norm of the query vector
+        :param constraints: the constraints of the query
+        :param top_k: see rank
+        :return: the ranked (doc_id, score) pairs of rank_scored, among the documents that satisfy the constraints.
+        """
+        documents = self.matching_documents(constraints)
+        with profiling.span("query.score"):
+            scores = {doc_id: score for doc_id, score in self.score_weights(weights, query_length).items()
+                      if doc_id in documents}
+        if top_k is None:
+            return [(doc_id, scores[doc_id]) for doc_id in self.rank_scores(scores)]
 
-    most_similar = dict()
+        check_top_k(top_k)
+        top_documents = select_top_k(scores, top_k)
+        if len(top_documents) == 0:
+            return []
+        best_score = abs(top_documents[0][1])
+        return [(doc_id, score) for doc_id, score in top_documents if abs(score) >= 0.2 * best_score]
 
-    # normalize by the lengths of the query and the document
-    for doc_id in cosine_similarity_dict:
-        cosine_similarity_dict[doc_id] /= query_length * float(json_index_data["documents_length"][doc_id])
+    def feedback_weights(self, weights, query_length, doc_ids):
+        """
+        :param weights: the query weights returned by query_weights
+        :param query_length: the norm of the query vector
+        :param doc_ids: the feedback documents
+        :return: (weights, query_length) of the query expanded with the vectors of the feedback documents, read from
+            the forward index saved next to the index, see relevance_feedback.expand_query.
+        """
+        if self.forward_index is None:
+            self.forward_index = self._open_sidecar(forward_path(self.index_path), ForwardIndex,
+                                                    "forward index for relevance feedback", "--forward")
+        vectors = []
+        for doc_id in doc_ids:
+            term_ids, term_weights = self.forward_index.document_vector(doc_id)
+            vectors.append({self.forward_index.term(term_id): weight
+                            for term_id, weight in zip(term_ids, term_weights)})
+        return expand_query(weights, query_length, vectors, self.index.idf)
 
-    # get the maximum score in absolute value and leave only the top 4/5 scores.
-    absolute_scores = {key: abs(value) for key, value in cosine_similarity_dict.items()}
-    best_score = max(absolute_scores.values())
-    for doc_id in cosine_similarity_dict:
-        if np.abs(cosine_similarity_dict[doc_id]) >= 0.2 * best_score:
-            most_similar[doc_id] = cosine_similarity_dict[doc_id]
+    def rank_feedback(self, weights, query_length, constraints=(), top_k=None):
+        """
+        :param weights: the query weights returned by query_weights
+        :param query_length: the norm of the query vector
+        :param constraints: the phrase and NEAR/k constraints of the query, see phrase_query
+        :param top_k: see rank
+        :return: the ranked (doc_id, score) pairs of rank_scored with pseudo relevance feedback: the query is expanded
+            with the vectors of its self.feedback best documents and ranked again. Documents are scored against the
+            expanded query.
+        """
+        with profiling.span("query.feedback"):
+            if constraints:
+                feedback_documents = self.rank_matching(weights, query_length, constraints, self.feedback)
+            else:
+                feedback_documents = self.rank_scored_weights(weights, query_length, self.feedback)
+            weights, query_length = self.feedback_weights(weights, query_length,
+                                                          [doc_id for doc_id, _ in feedback_documents])
+        if constraints:
+            return self.rank_matching(weights, query_length, constraints, top_k)
+        return self.rank_scored_weights(weights, query_length, top_k)
+
+    def rank_many(self, queries, top_k=None):
+        """
+        :param queries: a list of (query_id, query) pairs
+        :param top_k: see rank
+        :return: a map between a query id and the ranked doc ids of that query.
+        """
+        return {query_id: self.rank(query, top_k) for query_id, query in queries}
+
+    def rank_scored_many(self, queries, top_k=None):
+        """
+        :param queries: a list of user queries
+        :param top_k: see rank
+        :return: the ranked (doc_id, score) pairs of every query, see rank_scored. Engines that score a batch of
+            queries at once override it, see query_server.score_batch.
+        """
+        return [self.rank_scored(query, top_k) for query in queries]
+
+    def close(self):
+        for sidecar in (self.positional_index, self.forward_index):
+            if sidecar is not None:
+                sidecar.close()
+        self.index.close()
+
+
+def check_top_k(top_k):
+    """
+    :param top_k: the top_k of a ranking, None for every relevant document
+    :return: raises a ValueError if top_k is less than 1, which no ranking can return.
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be at least 1, got {top_k}")
+
+
+def read_queries(queries_path):
+    """
+    :param queries_path: either an xml file in the format of cfquery.xml or a text file with one query per line
+    :return: a list of (query_id, query) pairs. Queries in a text file are numbered from 1 by line, skipping empty
+    lines.
+    """
+    if os.path.splitext(queries_path)[1].lower() == ".xml":
+        root = ET.parse(queries_path).getroot()
+        return [(str(int(query.findall("./QueryNumber")[0].text.strip())),
+                 " ".join(query.findall("./QueryText")[0].text.split()))
+                for query in root.findall("./QUERY")]
+
+    with open(queries_path, "r") as queries_file:
+        lines = [line.strip() for line in queries_file.readlines()]
+    return [(str(line_number), line) for line_number, line in enumerate(lines, start=1) if line != ""]
+
+
+def answer_query(index_path, query, out_path, top_k=None, cache=None, engine_class=QueryEngine, feedback=None):
+    """
+    :param out_path: the path+filename where the results will be saved
+    :param index_path: the path where the index is stored, either the json or the binary format
+    :param query: user query to answer
+    :param top_k: if given, only the top_k best documents are returned
+    :param cache: a query_cache.QueryResultCache, or None
+    :param engine_class: QueryEngine or a subclass of it, e.g. sharded_engine.ShardedQueryEngine
+    :param feedback: if given, the query is expanded with its top feedback documents and ranked again, see
+    QueryEngine.rank_feedback
+    :return: a list of relevant documents sorted in descending order by their cosine similarity
+    to the query.
+    """
+    engine = engine_class(index_path, cache)
+    try:
+        engine.feedback = feedback
+        ranked_documents = engine.rank(query, top_k)
+    finally:
+        engine.close()
+
+    with open(out_path, "w") as out:
+        out.writelines("\n".join(str(doc_id) for doc_id in ranked_documents))
+
+    return ranked_documents
+
+
+def answer_queries(index_path, queries_path, out_path, top_k=None, engine_class=QueryEngine, cache=None,
+                   feedback=None):
+    """
+    :param index_path: the path where the index is stored, either the json or the binary format
+    :param queries_path: the queries to answer, see read_queries
+    :param top_k: if given, only the top_k best documents of every query are saved
+    :param engine_class: QueryEngine or a subclass of it, e.g. sparse_engine.SparseQueryEngine
+    :param cache: a query_cache.QueryResultCache, or None
+    :param feedback: see answer_query
+    :param out_path: the path+filename of the json file where a map between a query id and its ranked doc ids
+    will be saved
+    :return: the saved map.
+    """
+    engine = engine_class(index_path, cache)
+    try:
+        engine.feedback = feedback
+        results = engine.rank_many(read_queries(queries_path), top_k)
+    finally:
+        engine.close()
 
     with open(out_path, "w") as out:
-        # out.writelines("\n".join(sorted(cosine_similarity_dict, key=cosine_similarity_dict.get, reverse=True)[:40]))
-        out.writelines("\n".join(sorted(most_similar, key=most_similar.get, reverse=True)))
+        json.dump(results, out, indent=4)
+
+    return results
 
 
 # if __name__ == "__main__":
@@ -1,5 +1,8 @@
-from nltk.stem import PorterStemmer
+from collections import OrderedDict
+import json
+import profiling
 import re
+import time
 
 # define punctuation
 punctuation = '''!()-[]{};:'"\,<>./?@#$%^&*_~+='''
@@ -32,24 +35,157 @@ def remove_punctuation(s):
     return s.strip()
 
 
+class Tokenizer:
+    """
+    Turns text into tokens exactly like the original tokenize_and_preprocess did, but fast enough for the hot path of
+    indexing and querying: punctuation is removed in a single str.translate pass, and the outcome for every word
+    (its stem, or None if the word is filtered out) is kept in a bounded LRU cache, so the stopword, digit and
+    punctuation checks and the Porter stemmer only run once per distinct word. Word frequencies are Zipfian, so most
+    words hit the cache. nltk takes more than a second to import, so the stemmer is only created for the first word
+    that needs it, and words whose stem was saved by save_stems (the builders save the stems of the corpus next to
+    the index, see index_storage.stems_path) are not stemmed again once load_stems read them: a query made of such
+    words and stopwords never imports nltk.
+    """
+    cache_size: int  # the maximal number of words kept in the cache
+    hits: int  # the number of words found in the cache
+    misses: int  # the number of words that were stemmed
+    evictions: int  # the number of words dropped from the cache
+    texts: int  # the number of texts tokenized
+    tokens: int  # the number of tokens returned
+    seconds: float  # the time spent tokenizing
+
+    def __init__(self, cache_size: int = 65536):
+        self.cache_size = cache_size
+        self.stemmer = None  # the nltk PorterStemmer, created by the first stem
+        self.translation = str.maketrans({char: " " for char in punctuation})
+        self.cache = OrderedDict()  # map between a word and its stem, or None if the word is filtered out
+        self.stems = dict()  # map between a word and its stem, read by load_stems, looked up before the stemmer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.texts = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def normalize(self, text):
+        """
+        :param text: text to normalize
+        :return: the words of the text, lower case and without punctuation.
+        """
+        return text.translate(self.translation).lower().split()
+
+    def load_stemmer(self):
+        """
+        :return: creates the stemmer now instead of on the first word to stem. Processes that keep an index loaded for
+            many queries call it while they start, so that their first query does not pay for importing nltk.
+        """
+        if self.stemmer is None:
+            from nltk.stem import PorterStemmer
+            self.stemmer = PorterStemmer()
+
+    def stem_table(self):
+        """
+        :return: a map between a word and its stem, for every stemmed word in the cache and every word read by
+            load_stems.
+        """
+        table = dict(self.stems)
+        table.update((word, token) for word, token in self.cache.items() if token is not None)
+        return table
+
+    def save_stems(self, path):
+        """
+        :param path: the file to save the stems to
+        :return: saves stem_table as json.
+        """
+        with open(path, 'w') as stems_file:
+            json.dump(self.stem_table(), stems_file, sort_keys=True)
+
+    def load_stems(self, path):
+        """
+        :param path: a file saved by save_stems
+        :return: adds its stems to self.stems. A word has the same stem in every index, so stems saved for another
+            index or corpus are still right, they only miss the words that the stemmer is then run on.
+        """
+        with open(path, 'r') as stems_file:
+            self.stems.update(json.load(stems_file))
+
+    def stem(self, word):
+        """
+        :param word: a normalized word
+        :return: the stem of the word, or None if it is a stopword, a number or punctuation.
+        """
+        cache = self.cache
+        if word in cache:
+            self.hits += 1
+            cache.move_to_end(word)
+            return cache[word]
+
+        self.misses += 1
+        if word not in stopwords_set and word != "" and not has_numbers(word) and not word.isspace() \
+                and word not in punctuation:
+            token = self.stems.get(word)
+            if token is None:
+                if self.stemmer is None:
+                    self.load_stemmer()
+                token = self.stemmer.stem(word)
+        else:
+            token = None
+        cache[word] = token
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+        return token
+
+    def tokenize(self, text):
+        """
+        :param text: text to tokenize and preprocess
+        :return: list of tokens.
+        """
+        start = time.perf_counter()
+        stem = self.stem
+        tokens = [token for token in map(stem, self.normalize(text)) if token is not None]
+        end = time.perf_counter()
+        self.texts += 1
+        self.tokens += len(tokens)
+        self.seconds += end - start
+        # a build tokenizes every text of the corpus, so the profiler only gets totals instead of a span per text
+        if profiling.profiler is not None:
+            profiling.profiler.count("texts_tokenized")
+            profiling.profiler.count("tokens_emitted", len(tokens))
+            profiling.profiler.count("tokenize_seconds", end - start)
+        return tokens
+
+    def tokenize_many(self, texts):
+        """
+        :param texts: an iterable of texts
+        :return: a generator of the list of tokens of every text.
+        """
+        for text in texts:
+            yield self.tokenize(text)
+
+    def stats(self):
+        """
+        :return: the cache hit rate and the throughput of the tokenizer so far.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "cache_entries": len(self.cache),
+                "texts": self.texts,
+                "tokens": self.tokens,
+                "seconds": self.seconds,
+                "tokens_per_second": self.tokens / self.seconds if self.seconds > 0 else 0.0}
+
+
+# shared by tokenize_and_preprocess, so the stem cache is reused across calls
+default_tokenizer = Tokenizer()
+
+
 def tokenize_and_preprocess(text):
     """
     :param text: text to tokenize and preprocess
     :return: list of tokens.
     """
-    # remove punctuation
-    text = remove_punctuation(text).lower()
-
-    # tokenize
-    list_words = text.split()
-
-    # to use stemming:
-    # 1. from nltk.stem import PorterStemmer
-    # 2. ps = PorterStemmer()
-    # 3. replace word with ps.stem(word)
-    ps = PorterStemmer()
-    tokens_without_stopwords = [ps.stem(word) for word in list_words
-                                if word not in stopwords_set and word != "" and not has_numbers(word)
-                                and not word.isspace() and word not in punctuation]
-
-    return tokens_without_stopwords
+    return default_tokenizer.tokenize(text)
@@ -0,0 +1,103 @@
+"""
+Checks the startup cost of every vsm_ir.py action. Every action is timed importing the modules it needs in a fresh
+interpreter, against a budget in milliseconds, and the modules that the action must not pull in (numpy, scipy and
+nltk take more than a second together) are checked for. The query command is also run for real: its budget is the
+end to end latency of a single query, which stays far below the second that the original implementation took
+because the words of the query are stemmed with the stems saved next to the index, without importing nltk (see
+aux_methods.Tokenizer.load_stems). Run it from the repository root:
+
+    python -m benchmarks.import_budget
+
+The exit code is 1 if an action is over its budget or imports a module it should not. tests/test_import_budget.py
+runs the same checks with pytest, and VSM_BUDGET_SCALE multiplies the budgets there, for slow machines.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# map between an action and (the modules it imports, the budget in milliseconds, the modules it must not import)
+ACTIONS = {"cli": (["vsm_ir"], 30, ["numpy", "scipy", "nltk", "asyncio", "answer_query", "inverted_index"]),
+           "create_index": (["vsm_ir", "inverted_index", "streaming_index"], 100, ["numpy", "scipy", "nltk",
+                                                                                   "answer_query"]),
+           "query": (["vsm_ir", "answer_query"], 80, ["numpy", "scipy", "nltk", "inverted_index"]),
+           "update_index": (["vsm_ir", "incremental_index"], 100, ["numpy", "scipy", "nltk", "answer_query"]),
+           "serve": (["vsm_ir", "query_server"], 150, ["numpy", "scipy", "nltk", "inverted_index"])}
+
+# map between a command and (its vsm_ir.py arguments, the budget in milliseconds). The commands run in a temporary
+# directory, for the files they write, against the index that ships with the repository and its stems.
+COMMANDS = {"query": (["query", os.path.join(REPOSITORY, "vsm_inverted_index.json"), "cystic fibrosis"], 300)}
+
+# imports the modules and prints the import time in seconds and the modules that were loaded
+MEASURE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))
+"""
+
+
+def measure(modules, repeats):
+    """
+    :return: (the median import time of the modules in milliseconds, the names of the loaded modules).
+    """
+    timings = []
+    loaded = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", MEASURE] + modules, capture_output=True, text=True,
+                                check=True).stdout
+        seconds, loaded = json.loads(output)
+        timings.append(seconds * 1000)
+    return sorted(timings)[len(timings) // 2], loaded
+
+
+def measure_command(arguments, repeats):
+    """
+    :return: the median wall time in milliseconds of running vsm_ir.py with the arguments in a fresh interpreter.
+    """
+    timings = []
+    with tempfile.TemporaryDirectory(prefix="vsm_budget_") as directory:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(REPOSITORY, "vsm_ir.py")] + arguments, cwd=directory,
+                           capture_output=True, check=True)
+            timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of every vsm_ir.py action.")
+    parser.add_argument("--repeats", type=int, default=5, help="how many times every action is timed")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every budget, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    for action, (modules, budget, forbidden) in ACTIONS.items():
+        milliseconds, loaded = measure(modules, args.repeats)
+        leaked = [module for module in forbidden if module in loaded]
+        over_budget = milliseconds > budget * args.scale
+        failed = failed or over_budget or len(leaked) > 0
+        print(f"{action:<16}{milliseconds:>8.1f}ms of {budget * args.scale:.0f}ms"
+              + (" OVER BUDGET" if over_budget else "")
+              + (f" imports {', '.join(leaked)}" if leaked else ""))
+
+    for command, (arguments, budget) in COMMANDS.items():
+        milliseconds = measure_command(arguments, args.repeats)
+        over_budget = milliseconds > budget * args.scale
+        failed = failed or over_budget
+        print(f"{command + ' (run)':<16}{milliseconds:>8.1f}ms of {budget * args.scale:.0f}ms"
+              + (" OVER BUDGET" if over_budget else ""))
+
+    if failed:
+        sys.exit(1)
+    print("All actions within budget")
+
+
+if __name__ == "__main__":
+    main()
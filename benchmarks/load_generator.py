@@ -0,0 +1,92 @@
+"""
+Load test of a running query server (vsm_ir.py serve). Start the server, then run from the repository root:
+
+    python vsm_ir.py serve vsm_inverted_index.json --workers 2
+    python -m benchmarks.load_generator --concurrency 32 --requests 2000
+
+Every one of --concurrency clients keeps a single query in flight on its own connection, cycling through the queries
+of --queries, until --requests queries have been answered. The throughput and the latency percentiles are printed,
+and saved to --out if it is given. With --check the served rankings are compared to those of a local QueryEngine.
+"""
+from answer_query import QueryEngine, read_queries
+from query_client import QueryClient
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import numpy as np
+
+
+async def run_client(host, port, requests, top_k, latencies, responses):
+    """
+    :param requests: an iterator of the (query_id, query) pairs to send, shared by all the clients
+    :param latencies: the latency in seconds of every answered query is appended to it
+    :param responses: a map between a query id and its ranked doc ids, filled with the responses
+    """
+    client = await QueryClient.connect(host, port)
+    try:
+        for query_id, query in requests:
+            start = time.perf_counter()
+            ranked = await client.query(query, top_k)
+            latencies.append(time.perf_counter() - start)
+            responses[query_id] = [doc_id for doc_id, _ in ranked]
+    finally:
+        await client.close()
+
+
+async def generate_load(host, port, queries, num_requests, concurrency, top_k):
+    """
+    :return: (results, responses) - the throughput and latency percentiles, and the last ranked doc ids of every
+        query id.
+    """
+    requests = itertools.islice(itertools.cycle(queries), num_requests)
+    latencies = []
+    responses = dict()
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, requests, top_k, latencies, responses)
+                           for _ in range(concurrency)])
+    total_seconds = time.perf_counter() - start
+    results = {"requests": len(latencies),
+               "concurrency": concurrency,
+               "queries_per_second": len(latencies) / total_seconds,
+               "p50_seconds": float(np.percentile(latencies, 50)),
+               "p95_seconds": float(np.percentile(latencies, 95)),
+               "p99_seconds": float(np.percentile(latencies, 99))}
+    return results, responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send concurrent queries to a query server and time them.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queries", default="cfc-xml/cfquery.xml", help="the queries to send")
+    parser.add_argument("--requests", type=int, default=1000, help="the total number of queries to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="the number of concurrent clients")
+    parser.add_argument("--top-k", type=int, help="ask for the top k documents only")
+    parser.add_argument("--out", help="where to save the results")
+    parser.add_argument("--check", metavar="INDEX_PATH", help="compare the rankings with a local engine")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    results, responses = asyncio.run(generate_load(args.host, args.port, queries, args.requests,
+                                                   args.concurrency, args.top_k))
+    print(f"{results['requests']} queries, {results['concurrency']} clients: "
+          f"{results['queries_per_second']:.0f} queries/s, p50 {results['p50_seconds'] * 1000:.2f}ms, "
+          f"p95 {results['p95_seconds'] * 1000:.2f}ms, p99 {results['p99_seconds'] * 1000:.2f}ms")
+
+    if args.check is not None:
+        engine = QueryEngine(args.check)
+        queries = dict(queries)
+        mismatches = [query_id for query_id, ranked in responses.items()
+                      if ranked != engine.rank(queries[query_id], args.top_k)]
+        results["mismatches"] = len(mismatches)
+        print(f"{len(responses) - len(mismatches)} of {len(responses)} rankings match the local engine")
+
+    if args.out is not None:
+        with open(args.out, "w") as out_file:
+            json.dump(results, out_file, sort_keys=True, indent=4)
+
+
+if __name__ == "__main__":
+    main()
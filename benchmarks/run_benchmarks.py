@@ -0,0 +1,203 @@
+"""
+Measures the speed of the search engine: index build time and peak RSS, index load time, and cold and warm query
+latency over cfquery.xml, for growing synthetic copies of the corpus. Run it from the repository root:
+
+    python -m benchmarks.run_benchmarks --scales 1,2,4 --out benchmark_results.json
+    python -m benchmarks.run_benchmarks --baseline benchmark_results.json
+
+Every build and query benchmark runs --runs times and keeps the best value of every metric, and with --baseline the
+new results are compared to a saved run: the exit code is 1 if a metric regressed by more than --tolerance and by
+more than its noise floor.
+"""
+from answer_query import QueryEngine, read_queries
+from benchmarks.synthetic_corpus import replicate_corpus
+from inverted_index import InvertedIndex
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+# metrics where a higher value is better, every other metric is a duration or a size
+HIGHER_IS_BETTER = ("queries_per_second",)
+
+# map between a metric suffix and the absolute change below which the metric is not considered to have regressed,
+# however large the relative change: a few milliseconds of load time are noise on any machine
+NOISE_FLOORS = {"seconds": 0.005, "_mb": 1.0}
+
+
+def peak_rss_mb():
+    """
+    :return: the peak resident set size of the current process in megabytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 2 ** 20 if sys.platform == "darwin" else peak_rss / 2 ** 10
+
+
+def build_index(corpus_directory, filenames, index_path, result_queue):
+    start = time.perf_counter()
+    InvertedIndex(corpus_directory, filenames, index_path).build_inverted_index()
+    result_queue.put({"seconds": time.perf_counter() - start,
+                      "peak_rss_mb": peak_rss_mb(),
+                      "index_size_mb": os.path.getsize(index_path) / 2 ** 20})
+
+
+def query_index(index_path, queries, repeats, result_queue):
+    start = time.perf_counter()
+    engine = QueryEngine(index_path)
+    load_seconds = time.perf_counter() - start
+
+    # the first query pays for the caches and page faults of a freshly loaded index
+    start = time.perf_counter()
+    engine.rank(queries[0])
+    cold_query_seconds = time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            query_start = time.perf_counter()
+            engine.rank(query)
+            latencies.append(time.perf_counter() - query_start)
+    total_seconds = time.perf_counter() - start
+
+    result_queue.put({"load_seconds": load_seconds,
+                      "cold_query_seconds": cold_query_seconds,
+                      "p50_seconds": float(np.percentile(latencies, 50)),
+                      "p95_seconds": float(np.percentile(latencies, 95)),
+                      "p99_seconds": float(np.percentile(latencies, 99)),
+                      "queries_per_second": len(latencies) / total_seconds,
+                      "peak_rss_mb": peak_rss_mb()})
+
+
+def run_isolated(target, *args):
+    """
+    :return: runs target(*args, result_queue) in a fresh interpreter, so that its timings and peak RSS are not
+        affected by what ran before it, and returns what it put in the queue.
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=args + (result_queue,))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def run_best_of(runs, target, *args):
+    """
+    :return: runs target with run_isolated runs times, and returns the best value of every metric: the highest for
+        HIGHER_IS_BETTER and the lowest for the others, so that a run slowed down by the machine does not count.
+    """
+    results = [run_isolated(target, *args) for _ in range(runs)]
+    return {metric: (max if metric.endswith(HIGHER_IS_BETTER) else min)(result[metric] for result in results)
+            for metric in results[0]}
+
+
+def run_benchmarks(corpus_directory, queries_path, scales, formats, repeats, work_directory, runs=3):
+    """
+    :return: the benchmark results of every scale and index format, the best of runs runs, see run_best_of.
+    """
+    queries = [query for _, query in read_queries(queries_path)]
+    results = {"environment": {"python": platform.python_version(),
+                               "platform": platform.platform(),
+                               "cpus": os.cpu_count()},
+               "scales": dict()}
+
+    for scale in scales:
+        scale_directory = os.path.join(work_directory, f"scale_{scale}")
+        filenames = replicate_corpus(corpus_directory, scale_directory, scale)
+        scale_results = results["scales"][str(scale)] = dict()
+        for index_format in formats:
+            index_path = os.path.join(scale_directory, f"index.{index_format}")
+            build = run_best_of(runs, build_index, scale_directory, filenames, index_path)
+            query = run_best_of(runs, query_index, index_path, queries, repeats)
+            scale_results[index_format] = {"build": build, "query": query}
+            print(f"scale {scale} {index_format}: build {build['seconds']:.2f}s, "
+                  f"peak RSS {build['peak_rss_mb']:.0f}MB, load {query['load_seconds']:.3f}s, "
+                  f"p50 {query['p50_seconds'] * 1000:.2f}ms, p99 {query['p99_seconds'] * 1000:.2f}ms, "
+                  f"{query['queries_per_second']:.0f} queries/s")
+        shutil.rmtree(scale_directory)
+
+    return results
+
+
+def flatten(results, prefix=""):
+    """
+    :return: a map between the dotted path of every numeric metric in results and its value.
+    """
+    metrics = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and key != "cpus":
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def compare(results, baseline, tolerance, noise_floors=NOISE_FLOORS):
+    """
+    :param results: the results of this run
+    :param baseline: the results of a saved run
+    :param tolerance: the relative change that is not considered a regression
+    :param noise_floors: see NOISE_FLOORS
+    :return: a list of (metric, baseline value, new value) of the metrics that regressed, by more than tolerance and
+        by more than the noise floor of the metric.
+    """
+    new_metrics = flatten(results["scales"])
+    base_metrics = flatten(baseline["scales"])
+    regressions = []
+    for metric in sorted(new_metrics.keys() & base_metrics.keys()):
+        new_value, base_value = new_metrics[metric], base_metrics[metric]
+        noise_floor = max((floor for suffix, floor in noise_floors.items() if metric.endswith(suffix)), default=0.0)
+        if metric.endswith(HIGHER_IS_BETTER):
+            regressed = new_value < base_value * (1 - tolerance) and base_value - new_value > noise_floor
+        else:
+            regressed = new_value > base_value * (1 + tolerance) and new_value - base_value > noise_floor
+        if regressed:
+            regressions.append((metric, base_value, new_value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index build, index load and query latency.")
+    parser.add_argument("--corpus", default="cfc-xml", help="the directory of cf74.xml to cf79.xml")
+    parser.add_argument("--queries", default="cfc-xml/cfquery.xml", help="the queries to time")
+    parser.add_argument("--scales", default="1,2,4", help="comma separated numbers of copies of the corpus")
+    parser.add_argument("--formats", default="json,bin,cbin", help="comma separated index formats")
+    parser.add_argument("--repeats", type=int, default=3, help="how many times every query is timed warm")
+    parser.add_argument("--runs", type=int, default=3, help="how many times every benchmark runs, the best one counts")
+    parser.add_argument("--out", default="benchmark_results.json", help="where to save the results")
+    parser.add_argument("--baseline", help="saved results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix="vsm_benchmarks_")
+    try:
+        results = run_benchmarks(args.corpus, args.queries, [int(scale) for scale in args.scales.split(",")],
+                                 args.formats.split(","), args.repeats, work_directory, args.runs)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    with open(args.out, "w") as out_file:
+        json.dump(results, out_file, sort_keys=True, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for metric, base_value, new_value in regressions:
+            print(f"REGRESSION {metric}: {base_value:.6g} -> {new_value:.6g}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
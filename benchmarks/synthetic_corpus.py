@@ -0,0 +1,38 @@
+import os
+import re
+import shutil
+
+CORPUS_FILENAMES = [f"cf{num}.xml" for num in range(74, 80)]
+
+# every copy of the corpus gets its own range of record numbers
+RECORD_NUMBER_STRIDE = 100000
+
+RECORDNUM_PATTERN = re.compile(r"<RECORDNUM>\s*(\d+)\s*</RECORDNUM>")
+
+
+def replicate_corpus(corpus_directory, out_directory, copies):
+    """
+    :param corpus_directory: the directory of cf74.xml to cf79.xml
+    :param out_directory: the directory to write the synthetic corpus to
+    :param copies: the number of times the corpus is repeated
+    :return: the filenames of the synthetic corpus in out_directory. Copy i of a file has its record numbers shifted
+        by i * RECORD_NUMBER_STRIDE, so it adds new documents with the same text and the index grows linearly.
+    """
+    os.makedirs(out_directory, exist_ok=True)
+    dtd_path = os.path.join(corpus_directory, "cfc.dtd")
+    if os.path.exists(dtd_path):
+        shutil.copy(dtd_path, out_directory)
+
+    filenames = []
+    for filename in CORPUS_FILENAMES:
+        with open(os.path.join(corpus_directory, filename), "r") as corpus_file:
+            content = corpus_file.read()
+        for copy in range(copies):
+            def shift(match):
+                return f"<RECORDNUM>{int(match.group(1)) + copy * RECORD_NUMBER_STRIDE:05d} </RECORDNUM>"
+
+            copy_filename = f"{os.path.splitext(filename)[0]}_{copy}.xml"
+            with open(os.path.join(out_directory, copy_filename), "w") as copy_file:
+                copy_file.write(RECORDNUM_PATTERN.sub(shift, content))
+            filenames.append(copy_filename)
+    return filenames
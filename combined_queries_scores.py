@@ -1,13 +1,60 @@
+from answer_query import QueryEngine
+from aux_methods import default_tokenizer
+from concurrent.futures import ProcessPoolExecutor
 import json
 import math
-import os
 import re
 import sys
+import time
 import xml.etree.ElementTree as ET
+import numpy as np
 
+_engine = None  # the QueryEngine of the current process, see load_engine
 
-def calculate_scores(queries_path, index_path):
+
+def load_engine(index_path):
+    """
+    :param index_path: the path where the index is stored
+    :return: loads the index and the stemmer once for all the queries that run in this process, so that the latency
+        of the first query does not include importing nltk.
+    """
+    global _engine
+    _engine = QueryEngine(index_path)
+    default_tokenizer.load_stemmer()
+
+
+def run_query(query_text):
+    """
+    :param query_text: the query to run against the engine loaded by load_engine
+    :return: (results, latency) - the ranked doc ids, and the seconds spent in each stage of the query.
+    """
+    start = time.perf_counter()
+    weights, query_length = _engine.query_weights(query_text)
+    tokenized = time.perf_counter()
+    cosine_similarity_dict = _engine.score_weights(weights, query_length)
+    scored = time.perf_counter()
+    results = _engine.rank_scores(cosine_similarity_dict)
+    ranked = time.perf_counter()
+    latency = {
+        'tokenize': tokenized - start,
+        'score': scored - tokenized,
+        'rank': ranked - scored,
+        'total': ranked - start
+    }
+    return results, latency
+
+
+def calculate_scores(queries_path, index_path, workers=1):
+    """
+    :param queries_path: the path of cfquery.xml
+    :param index_path: the path where the index is stored
+    :param workers: the number of processes that run the queries. Each of them loads the index once.
+    :return: evaluates every query and saves the scores to combined_queries_scores.json and the latency of every
+        query to query_latencies.json.
+    """
+    start = time.perf_counter()
     queries = list()
+    queries_scores = list()
     combined_cumulative_gain = 0
     combined_recall = 0
     combined_precision = 0
@@ -29,9 +76,20 @@ def calculate_scores(queries_path, index_path):
         query['text'] = re.sub('\n', ' ', query['text']).strip()
         query['text'] = re.sub(' +', ' ', query['text'])
         queries.append(query)
-        # run query
-        os.system(f'python vsm_ir.py query "{index_path}" "{query["text"]}"')
-        results = get_results()
+        queries_scores.append(scores_dict)
+
+    query_texts = [query['text'] for query in queries]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_engine, initargs=(index_path,)) as executor:
+            runs = list(executor.map(run_query, query_texts))
+    else:
+        load_engine(index_path)
+        runs = [run_query(query_text) for query_text in query_texts]
+    total_seconds = time.perf_counter() - start
+
+    latencies = list()
+    for query, scores_dict, (results, latency) in zip(queries, queries_scores, runs):
+        latencies.append(dict(latency, num=query['num']))
         if len(results) == 0:
             print("len is 0")
             print(f"query_num = {query['num']}")
@@ -56,6 +114,18 @@ def calculate_scores(queries_path, index_path):
     with open('combined_queries_scores.json', 'w') as outfile:
         json.dump(output_dict, outfile, sort_keys=True, indent=4)
 
+    total_latencies = np.array([latency['total'] for latency in latencies])
+    latency_dict = {
+        'Workers': workers,
+        'Total Seconds': total_seconds,
+        'Queries Per Second': len(queries) / total_seconds,
+        'Latency Percentiles': {f'p{percentile}': float(np.percentile(total_latencies, percentile))
+                                for percentile in (50, 95, 99)},
+        'Queries': latencies
+    }
+    with open('query_latencies.json', 'w') as outfile:
+        json.dump(latency_dict, outfile, sort_keys=True, indent=4)
+
 
 def calculate_score_from_str(str):
     total_score = 0
@@ -98,16 +168,9 @@ def evaluate_results(results, query_scores):
     }
 
 
-def get_results():
-    with open('ranked_query_docs.txt') as ranked_results_file:
-        lines = ranked_results_file.readlines()
-        doc_nums = [int(x.strip()) for x in lines]
-    return doc_nums
-
-
 if __name__ == '__main__':
-    # queries_path = sys.argv[1]
-    # index_path = sys.argv[2]
-    queries_path = "cfc-xml/cfquery.xml"
-    index_path = "./vsm_inverted_index.json"
-    calculate_scores(queries_path, index_path)
+    # usage: combined_queries_scores.py [queries_path] [index_path] [workers]
+    queries_path = sys.argv[1] if len(sys.argv) > 1 else "cfc-xml/cfquery.xml"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else "./vsm_inverted_index.json"
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    calculate_scores(queries_path, index_path, workers)
@@ -0,0 +1,86 @@
+from answer_query import QueryEngine, check_top_k
+import numpy as np
+import profiling
+
+
+class DenseQueryEngine(QueryEngine):
+    """
+    A QueryEngine for a binary index built with dense postings (create_index --weights). Every posting also holds the
+    position of its document in the doc ids of the index and its tf score as a float64, so scoring a query term is a
+    single vectorized multiply-add of token_weight * idf * tf into a dense float array with a slot per document,
+    without decoding the postings or looking their doc ids up. The inner products are then divided by the query
+    length times the document lengths at once.
+
+    Every score is computed with the operations of QueryEngine.score_weights, in the same order, so the scores equal
+    the exhaustive ones to the last bit and so do the rankings, near ties included. Documents with equal scores are
+    ordered like QueryEngine.rank orders them, by the first query token whose postings hold them and then by doc id.
+    """
+    doc_ids: np.ndarray  # the doc id of every slot of the dense array, sorted
+    documents_length: np.ndarray  # the length of the document of every slot
+
+    def __init__(self, index_path: str, cache=None):
+        super().__init__(index_path, cache)
+        if not getattr(self.index, "weighted", False):
+            raise ValueError(f"{index_path} has no dense postings, create it as .bin or .cbin with --weights")
+        self.doc_ids = np.asarray(self.index.document_ids(), dtype=np.int64)
+        self.documents_length = np.array([self.index.document_length(doc_id) for doc_id in self.doc_ids.tolist()])
+
+    def accumulate(self, weights):
+        """
+        :param weights: the query weights returned by query_weights
+        :return: (inner_products, first_positions) - dense arrays with a slot per document: the inner product of the
+            query with every document, summed in query order like QueryEngine.score_weights sums it, and the position
+            of the first query token whose postings hold the document (len(weights) for the documents that share no
+            token with the query).
+        """
+        inner_products = np.zeros(len(self.doc_ids))
+        first_positions = np.full(len(self.doc_ids), len(weights), dtype=np.int64)
+        postings_scanned = 0
+        for position, (token, token_weight, idf_token) in enumerate(weights):
+            doc_positions, tfs = self.index.weighted_postings(token)
+            if len(doc_positions) == 0:
+                continue
+            doc_positions = np.asarray(doc_positions)
+            # the documents of a term are distinct, so the fancy indexed add does not lose any update
+            inner_products[doc_positions] += token_weight * idf_token * np.asarray(tfs)
+            first_positions[doc_positions] = np.minimum(first_positions[doc_positions], position)
+            postings_scanned += len(doc_positions)
+
+        if profiling.profiler is not None:
+            profiling.profiler.count("postings_scanned", postings_scanned)
+        return inner_products, first_positions
+
+    def rank_weights(self, weights, query_length, top_k=None):
+        """
+        :return: see QueryEngine.rank. With top_k documents with equal scores are ordered by doc id, like
+            QueryEngine.top_k_scores.
+        """
+        return [doc_id for doc_id, _ in self.rank_scored_weights(weights, query_length, top_k)]
+
+    def rank_scored_weights(self, weights, query_length, top_k=None):
+        """
+        :return: see QueryEngine.rank_scored.
+        """
+        check_top_k(top_k)
+        if query_length == 0:
+            return []
+
+        with profiling.span("query.dense_score"):
+            inner_products, first_positions = self.accumulate(weights)
+            # like QueryEngine.score_weights, every document that shares a token with the query is a candidate
+            candidates = np.flatnonzero(first_positions < len(weights))
+            candidate_scores = inner_products[candidates] / (query_length * self.documents_length[candidates])
+        profiling.count("candidates_scored", len(candidates))
+        if len(candidates) == 0:
+            return []
+
+        with profiling.span("query.rank"):
+            if top_k is not None:
+                # positions follow the order of the doc ids
+                order = np.lexsort((candidates, -candidate_scores))[:top_k]
+                best_score = abs(candidate_scores[order[0]])
+            else:
+                order = np.lexsort((candidates, first_positions[candidates], -candidate_scores))
+                best_score = np.abs(candidate_scores).max()
+            order = order[np.abs(candidate_scores[order]) >= 0.2 * best_score]
+            return list(zip(self.doc_ids[candidates[order]].tolist(), candidate_scores[order].tolist()))
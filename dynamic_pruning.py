@@ -0,0 +1,139 @@
+import bisect
+import heapq
+import profiling
+
+# the bounds are compared with scores computed in a different order, so they are widened by a relative margin to
+# make sure rounding never prunes a document that belongs in the top k
+BOUND_MARGIN = 1e-9
+
+# pruning only pays off when the longest postings list of the query is this many times longer than k: otherwise the
+# k-th best score is too low to close the candidates before most of the postings are read anyway
+PRUNING_RATIO = 16
+
+# once the candidates are closed, the postings of a term are searched for every candidate with a binary search
+# instead of being scanned, if that costs fewer steps. A binary search costs about this many scanned postings.
+LOOKUP_COST = 4
+
+
+def select_top_k(scores, k):
+    """
+    :param scores: a map between a doc id and its score
+    :param k: the number of documents to return
+    :return: a list of (doc_id, score) of the k best documents, in descending order of score. Documents with equal
+        scores are ordered by doc id. Only the documents that reach the k-th best score are sorted.
+    """
+    if len(scores) > k:
+        kth_score = heapq.nlargest(k, scores.values())[-1]
+        top_documents = [(doc_id, score) for doc_id, score in scores.items() if score >= kth_score]
+    else:
+        top_documents = list(scores.items())
+    top_documents.sort(key=lambda item: (-item[1], item[0]))
+    return top_documents[:k]
+
+
+def pruning_pays_off(index, weights, k):
+    """
+    :param index: an index reader returned by index_storage.load_index
+    :param weights: the query weights returned by QueryEngine.query_weights
+    :param k: the number of documents to return
+    :return: whether max_score_top_k is expected to be faster than scoring every document, see PRUNING_RATIO.
+    """
+    longest = max((len(index.postings(token)[0]) for token, _, _ in weights), default=0)
+    return k * PRUNING_RATIO < longest
+
+
+def _add_postings(accumulators, doc_ids, tfs, weight, candidates=None):
+    """
+    :param accumulators: a map between a doc id and its partial inner product with the query
+    :param doc_ids: the postings of a query term
+    :param tfs: the tf scores of the postings
+    :param weight: token_weight * idf_token of the term
+    :param candidates: if given, only these documents are updated, and they must all be in accumulators
+    :return: adds weight * tf to the accumulator of every document of the postings.
+    """
+    if candidates is None:
+        get = accumulators.get
+        for doc_id, tf in zip(doc_ids, tfs):
+            accumulators[doc_id] = get(doc_id, 0.0) + weight * tf
+    elif len(candidates) * LOOKUP_COST < len(doc_ids):
+        for doc_id in candidates:
+            position = bisect.bisect_left(doc_ids, doc_id)
+            if position < len(doc_ids) and doc_ids[position] == doc_id:
+                accumulators[doc_id] += weight * tfs[position]
+    else:
+        for doc_id, tf in zip(doc_ids, tfs):
+            if doc_id in candidates:
+                accumulators[doc_id] += weight * tf
+
+
+def max_score_top_k(index, weights, query_length, k):
+    """
+    Term-at-a-time top-k retrieval with MaxScore pruning. Every query term gets an upper bound on its contribution to
+    the cosine similarity of any document, from the max weight precomputed by the index. The terms are read from the
+    highest bound to the lowest, adding their contributions to an accumulator per document. Once the bounds of the
+    remaining terms add up to less than the k-th best partial score, no new document can make it to the top k: the
+    candidates are closed, the ones that cannot reach the k-th best score are dropped, and the remaining terms only
+    update the candidates, with a binary search per candidate when their postings are much longer. The candidates
+    that can still be among the top k are then scored again in query order, exactly like QueryEngine.score_weights
+    scores them, so the result matches exhaustive scoring. See pruning_pays_off for when this is faster than
+    exhaustive scoring.
+
+    :param index: an index reader returned by index_storage.load_index
+    :param weights: the query weights returned by QueryEngine.query_weights
+    :param query_length: the norm of the query vector, returned by QueryEngine.query_weights
+    :param k: the number of documents to return
+    :return: a list of (doc_id, score) of the k best documents, see select_top_k.
+    """
+    if query_length == 0:
+        return []
+
+    # a query token may repeat, every occurrence adds its contribution
+    terms = dict()  # map between a token and [token_weight * idf_token summed over its occurrences, bound]
+    for token, token_weight, idf_token in weights:
+        bound = abs(token_weight) * index.max_weight(token) / query_length * (1 + BOUND_MARGIN)
+        if token in terms:
+            terms[token][0] += token_weight * idf_token
+            terms[token][1] += bound
+        else:
+            terms[token] = [token_weight * idf_token, bound]
+
+    remaining = sum(bound for _, bound in terms.values())  # bounds the score a document gets from the unread terms
+    read = 0.0  # bounds the score a document gets from the read terms
+    accumulators = dict()  # map between a doc id and its partial inner product with the query
+    closed = False
+    postings_scanned = 0
+    for token in sorted(terms, key=lambda term: -terms[term][1]):
+        doc_ids, tfs = index.postings(token)
+        weight, bound = terms[token]
+        remaining -= bound
+        read += bound
+        postings_scanned += len(doc_ids) if not closed else min(len(doc_ids), len(accumulators) * LOOKUP_COST)
+        _add_postings(accumulators, doc_ids, tfs, weight, accumulators if closed else None)
+
+        # while the read terms bound less than the unread ones, the k-th best partial score cannot exceed remaining
+        if len(accumulators) >= k and remaining < read:
+            partial_scores = [partial / (query_length * index.document_length(doc_id))
+                              for doc_id, partial in accumulators.items()]
+            kth_score = heapq.nlargest(k, partial_scores)[-1] * (1 - BOUND_MARGIN)
+            if remaining < kth_score:
+                closed = True
+                accumulators = {doc_id: partial for (doc_id, partial), score in zip(accumulators.items(),
+                                                                                      partial_scores)
+                                if score >= kth_score - remaining}
+
+    # the partial scores were summed in another order, so the documents near the k-th best one are scored again
+    scores = {doc_id: partial / (query_length * index.document_length(doc_id))
+              for doc_id, partial in accumulators.items()}
+    candidates = dict.fromkeys(scores, 0.0)
+    if len(scores) > k:
+        kth_score = heapq.nlargest(k, scores.values())[-1] * (1 - BOUND_MARGIN)
+        candidates = {doc_id: 0.0 for doc_id, score in scores.items() if score >= kth_score}
+    for token, token_weight, idf_token in weights:
+        doc_ids, tfs = index.postings(token)
+        _add_postings(candidates, doc_ids, tfs, token_weight * idf_token, candidates)
+
+    if profiling.profiler is not None:
+        profiling.profiler.count("postings_scanned", postings_scanned)
+        profiling.profiler.count("candidates_scored", len(candidates))
+    return select_top_k({doc_id: inner_product / (query_length * index.document_length(doc_id))
+                         for doc_id, inner_product in candidates.items()}, k)
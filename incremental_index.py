@@ -0,0 +1,216 @@
+from index_storage import JsonIndex, delta_directory, load_index_file, shard_directory, term_table_path
+from inverted_index import InvertedIndex, TokenInfo
+import profiling
+import json
+import os
+import shutil
+
+# update_index compacts the index once it has more delta segments than this
+MAX_SEGMENTS = 8
+
+
+class IncrementalIndex:
+    """
+    Updates an index without rebuilding it from the whole corpus, in the manner of an LSM tree. The index file built
+    by create_index is the main index, and every update is written as a delta segment to the directory
+    index_storage.delta_directory(index_path). A segment holds the raw token counts of the documents it adds or
+    replaces, and the ids of the documents it deletes (tombstones). Segments are applied in the order they were
+    written, so a later segment overrides an earlier one or the main index for the same RECORDNUM.
+
+    Since idf and the documents length depend on the whole corpus, they are not updated with the segments. They are
+    recomputed lazily, the first time the index is loaded after an update (see load_merged), and compact() merges the
+    segments back into the main index file.
+    """
+    index_path: str  # the path of the main index file
+    delta_directory: str  # the directory of the delta segments
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.delta_directory = delta_directory(index_path)
+
+    def segment_paths(self):
+        """
+        :return: the paths of the delta segments in the order they were written.
+        """
+        if not os.path.isdir(self.delta_directory):
+            return []
+        return [os.path.join(self.delta_directory, filename) for filename in sorted(os.listdir(self.delta_directory))
+                if filename.startswith("segment_") and filename.endswith(".json")]
+
+    def check_main_index(self):
+        """
+        :return: raises a ValueError if the main index cannot be updated: it is sharded, or it lacks max_occurrences,
+            which the raw counts of its documents are restored from (see merged_index), like the json indexes built
+            before it was saved.
+        """
+        if os.path.isdir(shard_directory(self.index_path)):
+            raise ValueError("A sharded index cannot be updated, create it again with create_index")
+        main = load_index_file(self.index_path)
+        try:
+            if isinstance(main, JsonIndex) and main.max_occurrences is None:
+                raise ValueError(f"{self.index_path} was built without max_occurrences and cannot be updated, "
+                                 f"rebuild it with create_index")
+        finally:
+            main.close()
+
+    def write_segment(self, documents: dict, deleted: list):
+        """
+        :param documents: a map between a doc id and a map between a token and its number of occurrences in the
+            document, for the documents to add or replace
+        :param deleted: the ids of the documents to delete
+        :return: writes a new delta segment, after check_main_index.
+        """
+        self.check_main_index()
+        os.makedirs(self.delta_directory, exist_ok=True)
+        segment_paths = self.segment_paths()
+        number = int(os.path.basename(segment_paths[-1])[len("segment_"):-len(".json")]) + 1 if segment_paths else 0
+        segment_path = os.path.join(self.delta_directory, f"segment_{number:06d}.json")
+        with open(segment_path + ".tmp", "w") as segment_file:
+            json.dump({"documents": documents, "deleted": deleted}, segment_file, sort_keys=True)
+        os.replace(segment_path + ".tmp", segment_path)  # a segment becomes visible only once it is complete
+
+    def add_files(self, paths: list):
+        """
+        :param paths: corpus files in the format of cf74.xml
+        :return: adds their records to the index, replacing the documents that have the same RECORDNUM.
+        """
+        documents = dict()
+        for path in paths:
+            partial = InvertedIndex(os.path.dirname(path), [os.path.basename(path)], None)
+            partial.index_file(os.path.basename(path))
+            for doc_id in partial.documents_length.keys():
+                documents[doc_id] = dict()
+            for token, token_info in partial.index_term_hash.items():
+                for doc_id, occurrences in token_info.tf_map.items():
+                    documents[doc_id][token] = occurrences
+        self.write_segment(documents, [])
+
+    def delete_documents(self, doc_ids: list):
+        """
+        :param doc_ids: the ids of the documents to delete
+        :return: removes the documents from the index.
+        """
+        self.write_segment(dict(), [str(int(doc_id)) for doc_id in doc_ids])
+
+    def merged_index(self):
+        """
+        :return: an InvertedIndex of the main index with every segment applied, with idf and documents length
+            computed over the documents that are left. The raw counts of the main index are restored from its tf
+            scores and max_occurrences.
+        """
+        segments = []
+        for segment_path in self.segment_paths():
+            with open(segment_path, "r") as segment_file:
+                segments.append(json.load(segment_file))
+
+        # the segment that holds the current version of every document that was updated, None if it was deleted
+        latest = dict()
+        for segment in segments:
+            for doc_id in segment["deleted"]:
+                latest[doc_id] = None
+            for doc_id in segment["documents"]:
+                latest[doc_id] = segment
+
+        main = load_index_file(self.index_path)
+        # compact() keeps the dense postings of an index that was built with them
+        merged = InvertedIndex(None, [], self.index_path, store_weights=getattr(main, "weighted", False))
+        try:
+            for doc_id in main.document_ids():
+                if str(doc_id) not in latest:
+                    merged.documents_length[str(doc_id)] = 0
+
+            for token in main.terms():
+                doc_ids, tfs = main.postings(token)
+                for doc_id, tf in zip(doc_ids, tfs):
+                    if str(doc_id) in latest:
+                        continue
+                    occurrences = round(tf * main.max_occurrence(doc_id))
+                    _add_occurrences(merged, token, str(doc_id), occurrences)
+        finally:
+            main.close()
+
+        for doc_id, segment in latest.items():
+            if segment is None:
+                continue
+            merged.documents_length[doc_id] = 0
+            for token, occurrences in segment["documents"][doc_id].items():
+                _add_occurrences(merged, token, doc_id, occurrences)
+
+        merged.num_documents = len(merged.documents_length)
+        merged.compute_idf()
+        merged.compute_documents_length()
+        return merged
+
+    def merged_path(self):
+        """
+        :return: the file the merged index is saved to in the delta directory, in the format of the main index, or
+            None if there are no segments. It is named after the last segment, so a new segment gets a new file.
+        """
+        segment_paths = self.segment_paths()
+        if len(segment_paths) == 0:
+            return None
+        number = os.path.basename(segment_paths[-1])[len("segment_"):-len(".json")]
+        return os.path.join(self.delta_directory, f"merged_{number}{os.path.splitext(self.index_path)[1]}")
+
+    def save_merged(self):
+        """
+        :return: saves merged_index to merged_path, with its term table for a json index, and removes the merged
+            index of the previous segments. Readers only see the file once it is complete.
+        """
+        merged_path = self.merged_path()
+        temporary_path = merged_path + ".tmp" + os.path.splitext(merged_path)[1]
+        merged = self.merged_index()
+        merged.index_filename = temporary_path
+        merged.save_index()
+        _replace_index(temporary_path, merged_path)
+        for filename in os.listdir(self.delta_directory):
+            path = os.path.join(self.delta_directory, filename)
+            if filename.startswith("merged_") and path not in (merged_path, term_table_path(merged_path)):
+                os.remove(path)
+
+    def load_merged(self):
+        """
+        :return: an index reader (see index_storage.load_index_file) of the main index with every segment applied.
+            The merged index is computed and saved with save_merged by the first load after an update, and the
+            next loads read the saved file, lazily like the main index, until a new segment is written.
+        """
+        merged_path = self.merged_path()
+        if merged_path is None:
+            return load_index_file(self.index_path)
+        if not os.path.exists(merged_path):
+            with profiling.span("index.merge_segments"):
+                self.save_merged()
+        return load_index_file(merged_path)
+
+    def compact(self):
+        """
+        :return: rewrites the main index with every segment applied and removes the segments.
+        """
+        merged_path = self.merged_path()
+        if merged_path is None:
+            return
+        if not os.path.exists(merged_path):
+            self.save_merged()
+        _replace_index(merged_path, self.index_path)
+        shutil.rmtree(self.delta_directory)
+
+
+def _replace_index(source, destination):
+    """
+    :return: moves the index file source, and its term table if it has one, to destination.
+    """
+    os.replace(source, destination)
+    if os.path.exists(term_table_path(source)):
+        os.replace(term_table_path(source), term_table_path(destination))
+
+
+def _add_occurrences(index, token, doc_id, occurrences):
+    """
+    :return: adds occurrences of token in doc_id to index, like calling TokenInfo.update_token_info for each of them.
+    """
+    token_info = index.index_term_hash.get(token)
+    if token_info is None:
+        token_info = index.index_term_hash[token] = TokenInfo(token)
+    token_info.df_score += occurrences
+    token_info.tf_map[doc_id] = token_info.tf_map.get(doc_id, 0) + occurrences
+    index.max_occurrences[doc_id] = max(index.max_occurrences.get(doc_id, 0), token_info.tf_map[doc_id])
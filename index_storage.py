@@ -0,0 +1,1217 @@
+from collections import OrderedDict
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import postings_codec
+import profiling
+
+BINARY_MAGIC = b"VSMI"
+BINARY_VERSION = 6
+
+# magic, version, flags, num_documents, num_terms, num_docs, then the byte offsets of the sections that follow the
+# postings: term string offsets, term strings, postings offsets, postings counts, idf, max weights, doc ids,
+# documents length, max occurrences, weight offsets, doc positions and weights (0 without FLAG_DENSE_POSTINGS),
+# and last the index version (see IndexVersion).
+HEADER_FORMAT = "<4sIIIII12Q16s"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# the postings are delta and variable-byte encoded raw counts (see postings_codec) instead of int32 doc ids and
+# float32 tf scores
+FLAG_COMPRESSED_POSTINGS = 1
+# every posting also has its tf score as a float64, with its document interned as its position in the doc ids section,
+# see BinaryIndex.weighted_postings
+FLAG_DENSE_POSTINGS = 2
+
+POSITIONS_MAGIC = b"VSMP"
+POSITIONS_VERSION = 1
+
+# magic, version, num_terms, the byte offsets of the term string offsets, term strings, postings offsets and postings
+# counts sections that follow the postings, and the version of the index the positions belong to
+POSITIONS_HEADER_FORMAT = "<4sII4Q16s"
+POSITIONS_HEADER_SIZE = struct.calcsize(POSITIONS_HEADER_FORMAT)
+
+FORWARD_MAGIC = b"VSMF"
+FORWARD_VERSION = 1
+
+# magic, version, num_terms, num_docs, the byte offsets of the term string offsets, term strings, doc ids, entry
+# offsets, term id offsets, term ids and weights sections, and the version of the index the vectors belong to
+FORWARD_HEADER_FORMAT = "<4sIII7Q16s"
+FORWARD_HEADER_SIZE = struct.calcsize(FORWARD_HEADER_FORMAT)
+
+# the number of terms whose postings a reader keeps decoded, see PostingsCache
+POSTINGS_CACHE_SIZE = 1024
+
+JSON_EXTENSIONS = (".json",)
+BINARY_EXTENSIONS = (".bin", ".vsmi")
+COMPRESSED_EXTENSIONS = (".cbin",)
+
+
+def index_format(path):
+    """
+    :param path: the path of an index file
+    :return: "json", "binary" or "compressed" (binary with compressed postings), according to the extension of path.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in JSON_EXTENSIONS:
+        return "json"
+    if extension in BINARY_EXTENSIONS:
+        return "binary"
+    if extension in COMPRESSED_EXTENSIONS:
+        return "compressed"
+    raise ValueError(f"Unknown index format for {path}, expected one of "
+                     f"{JSON_EXTENSIONS + BINARY_EXTENSIONS + COMPRESSED_EXTENSIONS}")
+
+
+def load_index(path):
+    """
+    :param path: the path of an index file created by InvertedIndex
+    :return: an index reader (JsonIndex or BinaryIndex) chosen by the extension of path. If documents were added or
+    deleted with incremental_index.IncrementalIndex since the index was built, the reader is the one of the index
+    merged with these updates (see IncrementalIndex.load_merged), and if the index was saved in shards it is a
+    ShardedIndex.
+    """
+    if os.path.isdir(delta_directory(path)):
+        from incremental_index import IncrementalIndex  # incremental_index builds on this module
+        return IncrementalIndex(path).load_merged()
+    if os.path.isdir(shard_directory(path)):
+        return ShardedIndex(path)
+    return load_index_file(path)
+
+
+def load_index_file(path):
+    """
+    :param path: the path of an index file created by InvertedIndex
+    :return: an index reader (JsonIndex, LazyJsonIndex or BinaryIndex) of the file itself, without the updates of
+    incremental_index. A json file is read lazily through its term table if it has an up to date one.
+    """
+    if index_format(path) == "json":
+        if LazyJsonIndex.has_term_table(path):
+            return LazyJsonIndex(path)
+        return JsonIndex(path)
+    return BinaryIndex(path)
+
+
+def index_writer(path, max_occurrences, weights=False):
+    """
+    :param path: the path of the index file to write
+    :param max_occurrences: a map between a doc id and its maximal number of occurrences of a token, which restores
+    the raw counts that compressed postings store
+    :param weights: whether to also store the dense postings of every term (see BinaryIndex.weighted_postings),
+        binary formats only
+    :return: a streaming writer (JsonIndexWriter or BinaryIndexWriter) chosen by the extension of path.
+    """
+    file_format = index_format(path)
+    if file_format == "json":
+        if weights:
+            raise ValueError("Dense postings can only be stored in the binary formats")
+        return JsonIndexWriter(path)
+    flags = FLAG_DENSE_POSTINGS if weights else 0
+    if file_format == "compressed":
+        return BinaryIndexWriter(path, flags | FLAG_COMPRESSED_POSTINGS, max_occurrences)
+    return BinaryIndexWriter(path, flags)
+
+
+def delta_directory(path):
+    """
+    :return: the directory that holds the updates of the index file path, see incremental_index.
+    """
+    return path + ".delta"
+
+
+def term_table_path(path):
+    """
+    :return: the file that holds the term table of the json index file path, see LazyJsonIndex.
+    """
+    return path + ".terms"
+
+
+def shard_directory(path):
+    """
+    :return: the directory that holds the shards of the index path, see InvertedIndex.save_shards.
+    """
+    return path + ".shards"
+
+
+def shard_manifest_path(path):
+    """
+    :return: the file that describes the shards of the index path, see ShardedIndex.
+    """
+    return os.path.join(shard_directory(path), "manifest.json")
+
+
+def positions_path(path):
+    """
+    :return: the file that holds the token positions of the index path, see PositionalIndex.
+    """
+    return path + ".positions"
+
+
+def forward_path(path):
+    """
+    :return: the file that holds the document vectors of the index path, see ForwardIndex.
+    """
+    return path + ".forward"
+
+
+def stems_path(path):
+    """
+    :return: the file that holds the stems of the words of the corpus of the index path, see
+        aux_methods.Tokenizer.save_stems.
+    """
+    return path + ".stems"
+
+
+def remove_index(path):
+    """
+    :param path: the path of an index that is about to be written
+    :return: removes the index saved at path before and every file saved next to it: its term table, shards, delta
+        segments, positions, document vectors and stems. Every writer of a new index calls it first, since load_index
+        and the engines would otherwise read the stale files instead of the new index, or along with it.
+    """
+    for file_path in (path, term_table_path(path), positions_path(path), forward_path(path), stems_path(path)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    for directory in (shard_directory(path), delta_directory(path)):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+
+def _max_weight(idf, doc_ids, tfs, documents_length):
+    """
+    :return: the maximal absolute weight idf * tf / documents_length[doc_id] over the given postings, 0 if there are
+    none. It bounds the contribution of a term to the cosine similarity of any document, see dynamic_pruning.
+    """
+    return max((abs(idf * tf / documents_length[doc_id]) for doc_id, tf in zip(doc_ids, tfs)
+                if documents_length[doc_id] > 0), default=0.0)
+
+
+def _file_version(path):
+    """
+    :return: a version for an index file saved without an index version, from its size and modification time.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+class IndexVersion:
+    """
+    Hashes the content of an index while it is written: the postings and idf of every term, in sorted term order,
+    then the documents length. Building the same corpus again gives the same version, in any format, and any change
+    to the index changes it, so the version tells readers such as query_cache.QueryResultCache that their results
+    are stale.
+    """
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    def add_term(self, term, idf, doc_ids, tfs):
+        """
+        :param doc_ids: the int doc ids of the term, sorted
+        :param tfs: the tf scores of the term, aligned with doc_ids
+        """
+        count = len(doc_ids)
+        self._hash.update(term.encode("utf-8") + b"\0")
+        self._hash.update(struct.pack(f"<dI{count}i{count}d", idf, count, *doc_ids, *tfs))
+
+    def digest(self, documents_length: dict, num_documents: int):
+        """
+        :return: the 16 bytes version of the index.
+        """
+        lengths = sorted((int(doc_id), length) for doc_id, length in documents_length.items())
+        self._hash.update(struct.pack("<I", num_documents))
+        for doc_id, length in lengths:
+            self._hash.update(struct.pack("<id", doc_id, length))
+        return self._hash.digest()
+
+
+def _search_terms(term, num_terms, token):
+    """
+    :param term: returns the encoded term of a term id, the terms being sorted
+    :param num_terms: the number of terms
+    :return: the term id of token, or -1 if token is not one of the terms.
+    """
+    key = token.encode("utf-8")
+    low, high = 0, num_terms
+    while low < high:
+        middle = (low + high) // 2
+        if term(middle) < key:
+            low = middle + 1
+        else:
+            high = middle
+    if low < num_terms and term(low) == key:
+        return low
+    return -1
+
+
+def _pad(file, alignment=8):
+    remainder = file.tell() % alignment
+    if remainder:
+        file.write(b"\0" * (alignment - remainder))
+
+
+class PostingsCache:
+    """
+    The postings of the most recently used terms, up to capacity terms. Evicts the least recently used term.
+    """
+    capacity: int  # the maximal number of terms
+
+    def __init__(self, capacity: int = POSTINGS_CACHE_SIZE):
+        self.capacity = capacity
+        self._postings = OrderedDict()  # map between a token and its (doc_ids, tfs), least recently used first
+
+    def get(self, token):
+        """
+        :return: the cached (doc_ids, tfs) of token, or None.
+        """
+        postings = self._postings.get(token)
+        if postings is not None:
+            self._postings.move_to_end(token)
+        return postings
+
+    def put(self, token, postings):
+        self._postings[token] = postings
+        if len(self._postings) > self.capacity:
+            self._postings.popitem(last=False)
+
+
+class JsonIndex:
+    """
+    Reader for the json export written by JsonIndexWriter. It exposes the same interface as BinaryIndex:
+    doc ids are ints and postings are returned as two parallel lists sorted by doc id.
+    """
+    num_documents: int  # the number of documents in the corpus
+    idf_scores: dict  # map between a token and its idf score
+    documents_length: dict  # map between a doc id (int) and its length as a vector
+    max_occurrences: dict  # map between a doc id (int) and its maximal number of occurrences of a token, or None
+    index_version: str  # changes whenever the index is rebuilt with a different content, see IndexVersion
+
+    def __init__(self, path: str = None, json_index_data: dict = None):
+        """
+        :param path: the path of the json file to load
+        :param json_index_data: the content of such a file, instead of path
+        """
+        if json_index_data is None:
+            with open(path, 'r') as file_json, profiling.span("index.json_load"):
+                json_index_data = json.load(file_json)
+
+        self.num_documents = json_index_data["num_documents"]
+        self.idf_scores = json_index_data["idf"]
+        self.documents_length = {int(doc_id): length
+                                 for doc_id, length in json_index_data["documents_length"].items()}
+        # indexes built before max_occurrences was saved cannot be updated incrementally
+        self.max_occurrences = None
+        if "max_occurrences" in json_index_data:
+            self.max_occurrences = {int(doc_id): occurrences
+                                    for doc_id, occurrences in json_index_data["max_occurrences"].items()}
+        # indexes built before the version was saved fall back to the size and modification time of their file
+        self.index_version = json_index_data.get("index_version")
+        if self.index_version is None and path is not None:
+            self.index_version = _file_version(path)
+        self._tf = json_index_data["tf"]
+        self._postings_cache = dict()
+        self._max_weights = dict()
+
+    def __contains__(self, token):
+        return token in self._tf
+
+    def terms(self):
+        return sorted(self._tf)
+
+    def document_ids(self):
+        return sorted(self.documents_length)
+
+    def idf(self, token):
+        return float(self.idf_scores.get(token, 0))  # idf = 0 if token is not in the corpus
+
+    def document_length(self, doc_id):
+        return self.documents_length[doc_id]
+
+    def max_weight(self, token):
+        """
+        :return: the maximal absolute weight idf * tf / document_length of token over the documents it appears in.
+        The json reader has every posting in memory anyway, so it is computed on first use. 0 if token is not in
+        the corpus.
+        """
+        if token not in self._max_weights:
+            doc_ids, tfs = self.postings(token)
+            self._max_weights[token] = _max_weight(self.idf(token), doc_ids, tfs, self.documents_length)
+        return self._max_weights[token]
+
+    def max_occurrence(self, doc_id):
+        if self.max_occurrences is None:
+            raise ValueError("The index was built without max_occurrences, rebuild it with create_index")
+        return self.max_occurrences[doc_id]
+
+    def postings(self, token):
+        """
+        :return: (doc_ids, tfs) - the postings of token sorted by doc id. Empty lists if token is not in the corpus.
+        """
+        if token not in self._postings_cache:
+            tf_map = sorted((int(doc_id), tf) for doc_id, tf in self._tf.get(token, dict()).items())
+            self._postings_cache[token] = ([doc_id for doc_id, _ in tf_map], [tf for _, tf in tf_map])
+        return self._postings_cache[token]
+
+    def close(self):
+        pass
+
+
+class LazyJsonIndex(JsonIndex):
+    """
+    Reader for a json index file that only loads its term table (see JsonIndexWriter), which holds the small parts of
+    the index: idf, documents length, max occurrences, and the byte offset and length of the tf map of every term in
+    the json file. The postings of a term are read from the json file the first time they are needed, and the
+    postings of the hot terms stay in a PostingsCache, so answering a query reads the postings of its terms only.
+    """
+    path: str  # the path of the json index file
+
+    def __init__(self, path: str, cache_size: int = POSTINGS_CACHE_SIZE):
+        with open(term_table_path(path), 'r') as table_file, profiling.span("index.term_table_load"):
+            table_file.readline()  # the index file the table belongs to, see has_term_table
+            table = json.load(table_file)
+        self.path = path
+        self.num_documents = table["num_documents"]
+        self.idf_scores = table["idf"]
+        self.index_version = table["index_version"]
+        self.documents_length = {int(doc_id): length for doc_id, length in table["documents_length"].items()}
+        self.max_occurrences = {int(doc_id): occurrences for doc_id, occurrences in table["max_occurrences"].items()}
+        self._offsets = table["offsets"]  # map between a token and the (offset, length) of its tf map
+        self._file = open(path, 'rb')
+        self._postings_cache = PostingsCache(cache_size)
+        self._max_weights = dict()
+
+    @staticmethod
+    def has_term_table(path):
+        """
+        :return: whether the json index file path has a term table that was written together with it. A file that
+            was rewritten without its table afterwards has a different size or modification time.
+        """
+        if not os.path.exists(term_table_path(path)):
+            return False
+        with open(term_table_path(path), 'r') as table_file:
+            # the table starts with the size and modification time of the index file, see JsonIndexWriter
+            header = json.loads(table_file.readline())
+        stat = os.stat(path)
+        return header == {"index_size": stat.st_size, "index_mtime_ns": stat.st_mtime_ns}
+
+    def __contains__(self, token):
+        return token in self._offsets
+
+    def terms(self):
+        return sorted(self._offsets)
+
+    def postings(self, token):
+        """
+        :return: (doc_ids, tfs) - the postings of token sorted by doc id. Empty lists if token is not in the corpus.
+        """
+        postings = self._postings_cache.get(token)
+        if postings is None:
+            if token not in self._offsets:
+                return [], []
+            offset, length = self._offsets[token]
+            profiling.count("postings_read")
+            self._file.seek(offset)
+            tf_map = sorted((int(doc_id), tf) for doc_id, tf in json.loads(self._file.read(length)).items())
+            postings = ([doc_id for doc_id, _ in tf_map], [tf for _, tf in tf_map])
+            self._postings_cache.put(token, postings)
+        return postings
+
+    def close(self):
+        self._file.close()
+
+
+class BinaryIndex:
+    """
+    Reader for the binary format written by BinaryIndexWriter. The file is memory-mapped and every section is exposed
+    as a typed memoryview over the mapping, so nothing is parsed up front: looking a term up is a binary search over
+    the sorted term dictionary and its postings are two slices (int32 doc ids, float32 tf) of the mapped file.
+    Compressed postings are decoded block by block when they are read, and their tf scores are restored from the raw
+    counts and max_occurrences exactly as InvertedIndex.compute_documents_length computes them. The decoded postings
+    of the hot terms are kept in a PostingsCache.
+    """
+    num_documents: int  # the number of documents in the corpus
+    num_terms: int  # the size of the vocabulary
+    flags: int  # format flags, see BinaryIndexWriter
+    compressed: bool  # whether the postings are compressed
+    weighted: bool  # whether the dense postings of every term are stored, see weighted_postings
+    index_version: str  # changes whenever the index is rebuilt with a different content, see IndexVersion
+
+    def __init__(self, path: str, cache_size: int = POSTINGS_CACHE_SIZE):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        (magic, version, self.flags, self.num_documents, self.num_terms, num_docs,
+         term_offsets_start, term_strings_start, postings_offsets_start, postings_counts_start,
+         idf_start, max_weights_start, doc_ids_start, documents_length_start,
+         max_occurrences_start, weight_offsets_start, doc_positions_start, weights_start,
+         index_version) = struct.unpack_from(HEADER_FORMAT, self._buffer)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary index")
+        if version != BINARY_VERSION:
+            raise ValueError(f"{path} has binary index version {version}, expected {BINARY_VERSION}")
+
+        num_terms = self.num_terms
+        self._term_offsets = self._section(term_offsets_start, num_terms + 1, "Q")
+        self._term_strings = self._buffer[term_strings_start:postings_offsets_start]
+        self._postings_offsets = self._section(postings_offsets_start, num_terms, "Q")
+        self._postings_counts = self._section(postings_counts_start, num_terms, "I")
+        self._idf = self._section(idf_start, num_terms, "d")
+        self._max_weights = self._section(max_weights_start, num_terms, "d")
+        self._doc_ids = self._section(doc_ids_start, num_docs, "i")
+        self._documents_length = self._section(documents_length_start, num_docs, "d")
+        self._max_occurrences = self._section(max_occurrences_start, num_docs, "i")
+        self.compressed = bool(self.flags & FLAG_COMPRESSED_POSTINGS)
+        self.weighted = bool(self.flags & FLAG_DENSE_POSTINGS)
+        self._weight_offsets = self._doc_positions = self._weights = None
+        if self.weighted:
+            self._weight_offsets = self._section(weight_offsets_start, num_terms + 1, "Q")
+            num_postings = self._weight_offsets[num_terms]
+            self._doc_positions = self._section(doc_positions_start, num_postings, "i")
+            self._weights = self._section(weights_start, num_postings, "d")
+        self.index_version = index_version.hex()
+        self._postings_cache = PostingsCache(cache_size)
+        self._document_positions = None  # map between a doc id and its position in the document sections
+        self._lengths = None  # map between a doc id and its document length
+
+    def _section(self, start, count, type_code):
+        size = struct.calcsize(type_code)
+        return self._buffer[start:start + count * size].cast(type_code)
+
+    def _term(self, term_id):
+        return bytes(self._term_strings[self._term_offsets[term_id]:self._term_offsets[term_id + 1]])
+
+    def term_id(self, token):
+        """
+        :return: the position of token in the sorted term dictionary, or -1 if token is not in the corpus.
+        """
+        return _search_terms(self._term, self.num_terms, token)
+
+    def __contains__(self, token):
+        return self.term_id(token) >= 0
+
+    def terms(self):
+        return [self._term(term_id).decode("utf-8") for term_id in range(self.num_terms)]
+
+    def document_ids(self):
+        return self._doc_ids
+
+    def idf(self, token):
+        term_id = self.term_id(token)
+        return self._idf[term_id] if term_id >= 0 else 0.0  # idf = 0 if token is not in the corpus
+
+    def max_weight(self, token):
+        """
+        :return: the maximal absolute weight idf * tf / document_length of token over the documents it appears in,
+        precomputed by BinaryIndexWriter. 0 if token is not in the corpus.
+        """
+        term_id = self.term_id(token)
+        return self._max_weights[term_id] if term_id >= 0 else 0.0
+
+    def _positions(self):
+        """
+        :return: a map between a doc id and its position in the document sections, built on first use, so that the
+        documents of the postings are found with a single lookup instead of a binary search each.
+        """
+        if self._document_positions is None:
+            self._document_positions = {doc_id: position for position, doc_id in enumerate(self._doc_ids)}
+        return self._document_positions
+
+    def document_length(self, doc_id):
+        # score_weights asks for the length of every candidate, so the lengths are kept in a map on first use
+        if self._lengths is None:
+            self._lengths = dict(zip(self._doc_ids, self._documents_length))
+        return self._lengths[doc_id]
+
+    def max_occurrence(self, doc_id):
+        return self._max_occurrences[self._positions()[doc_id]]
+
+    def postings(self, token):
+        """
+        :return: (doc_ids, tfs) - memoryviews over the postings of token sorted by doc id. Empty if token is not in
+        the corpus.
+        """
+        term_id = self.term_id(token)
+        if term_id < 0:
+            return (), ()
+        start = self._postings_offsets[term_id]
+        count = self._postings_counts[term_id]
+        if self.compressed:
+            # uncompressed postings are views of the mapped file, only decoded postings are worth caching
+            postings = self._postings_cache.get(token)
+            if postings is None:
+                profiling.count("postings_decoded")
+                doc_ids, counts = postings_codec.decode_postings(self._buffer[start:], count)
+                postings = (doc_ids, self._tfs(doc_ids, counts))
+                self._postings_cache.put(token, postings)
+            return postings
+        doc_ids = self._section(start, count, "i")
+        tfs = self._section(start + 4 * count, count, "f")
+        return doc_ids, tfs
+
+    def weighted_postings(self, token):
+        """
+        :return: (doc_positions, weights) - memoryviews over the dense postings of token, for an index built with
+        weights: the position of every document in document_ids(), and its tf score as a float64, exactly the value
+        postings returns for it. Empty if token is not in the corpus.
+        """
+        if not self.weighted:
+            raise ValueError("The index was built without dense postings, rebuild it with --weights")
+        term_id = self.term_id(token)
+        if term_id < 0:
+            return (), ()
+        start = self._weight_offsets[term_id]
+        end = self._weight_offsets[term_id + 1]
+        return self._doc_positions[start:end], self._weights[start:end]
+
+    def _tfs(self, doc_ids, counts):
+        """
+        :return: the tf scores of raw counts, normalized by the max occurrences of their documents.
+        """
+        positions = self._positions()
+        max_occurrences = self._max_occurrences
+        return [occurrences / max_occurrences[positions[doc_id]] for doc_id, occurrences in zip(doc_ids, counts)]
+
+    def close(self):
+        for view in (self._term_offsets, self._term_strings, self._postings_offsets, self._postings_counts, self._idf,
+                     self._max_weights, self._doc_ids, self._documents_length, self._max_occurrences,
+                     self._weight_offsets, self._doc_positions, self._weights, self._buffer):
+            if view is not None:
+                view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # postings handed out to a caller are still alive, the mapping is closed when they are collected
+        self._file.close()
+
+
+class PositionalIndex:
+    """
+    Reader for the token positions written by PositionsWriter next to an index (create_index --positions). The file
+    is memory-mapped like BinaryIndex, and the positional postings of a term are read through a PositionsCursor,
+    which uses the block table of postings_codec as skip pointers: a cursor only decodes the blocks that may hold
+    the documents it is asked about.
+    """
+    num_terms: int  # the size of the vocabulary
+    index_version: str  # the version of the index the positions were recorded for, see IndexVersion
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        (magic, version, self.num_terms, term_offsets_start, term_strings_start, postings_offsets_start,
+         postings_counts_start, index_version) = struct.unpack_from(POSITIONS_HEADER_FORMAT, self._buffer)
+        if magic != POSITIONS_MAGIC:
+            raise ValueError(f"{path} is not a positions file")
+        if version != POSITIONS_VERSION:
+            raise ValueError(f"{path} has positions version {version}, expected {POSITIONS_VERSION}")
+
+        num_terms = self.num_terms
+        self._term_offsets = self._buffer[term_offsets_start:term_offsets_start + 8 * (num_terms + 1)].cast("Q")
+        self._term_strings = self._buffer[term_strings_start:postings_offsets_start]
+        self._postings_offsets = self._buffer[postings_offsets_start:postings_offsets_start + 8 * num_terms].cast("Q")
+        self._postings_counts = self._buffer[postings_counts_start:postings_counts_start + 4 * num_terms].cast("I")
+        self.index_version = index_version.hex()
+
+    def _term(self, term_id):
+        return bytes(self._term_strings[self._term_offsets[term_id]:self._term_offsets[term_id + 1]])
+
+    def document_count(self, token):
+        """
+        :return: the number of documents token appears in, 0 if it is not in the corpus.
+        """
+        term_id = _search_terms(self._term, self.num_terms, token)
+        return self._postings_counts[term_id] if term_id >= 0 else 0
+
+    def cursor(self, token):
+        """
+        :return: a PositionsCursor over the positional postings of token, empty if token is not in the corpus.
+        """
+        term_id = _search_terms(self._term, self.num_terms, token)
+        if term_id < 0:
+            return PositionsCursor(b"", 0)
+        return PositionsCursor(self._buffer[self._postings_offsets[term_id]:], self._postings_counts[term_id])
+
+    def close(self):
+        for view in (self._term_offsets, self._term_strings, self._postings_offsets, self._postings_counts,
+                     self._buffer):
+            view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # a cursor is still alive, the mapping is closed when it is collected
+        self._file.close()
+
+
+class PositionsCursor:
+    """
+    Reads the positional postings of a single term in doc id order. positions(doc_id) must be called with increasing
+    doc ids: it skips over the blocks whose last doc id is smaller than doc_id with a binary search of the block table,
+    and decodes at most the block that may hold doc_id.
+    """
+    count: int  # the number of documents of the term
+
+    def __init__(self, buffer, count: int):
+        self._buffer = buffer
+        self.count = count
+        self._last_doc_ids = postings_codec.block_last_doc_ids(buffer, count)
+        self._block = -1  # the block that is decoded
+        self._doc_ids = []
+        self._positions = []
+
+    def _decode(self, block):
+        self._block = block
+        self._doc_ids, self._positions = postings_codec.decode_positional_block(self._buffer, self.count, block)
+
+    def __iter__(self):
+        """
+        :return: a generator of (doc_id, positions) for every document of the term.
+        """
+        for block in range(len(self._last_doc_ids)):
+            self._decode(block)
+            yield from zip(self._doc_ids, self._positions)
+
+    def positions(self, doc_id):
+        """
+        :return: the sorted positions of the term in doc_id, or None if the term is not in doc_id.
+        """
+        block = bisect.bisect_left(self._last_doc_ids, doc_id, max(self._block, 0))
+        if block == len(self._last_doc_ids):
+            return None
+        if block != self._block:
+            self._decode(block)
+        found = bisect.bisect_left(self._doc_ids, doc_id)
+        if found < len(self._doc_ids) and self._doc_ids[found] == doc_id:
+            return self._positions[found]
+        return None
+
+
+class ForwardIndex:
+    """
+    Reader for the document vectors written by ForwardIndexWriter next to an index (create_index --forward). The
+    file is memory-mapped like BinaryIndex. The vector of a document is a slice of delta and variable-byte encoded
+    term ids, which index the sorted vocabulary of the file, and a slice of float32 weights.
+    """
+    num_terms: int  # the size of the vocabulary
+    num_docs: int  # the number of documents
+    index_version: str  # the version of the index the vectors were computed for, see IndexVersion
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        (magic, version, self.num_terms, self.num_docs, term_offsets_start, term_strings_start, doc_ids_start,
+         entry_offsets_start, term_id_offsets_start, term_ids_start, weights_start,
+         index_version) = struct.unpack_from(FORWARD_HEADER_FORMAT, self._buffer)
+        if magic != FORWARD_MAGIC:
+            raise ValueError(f"{path} is not a forward index")
+        if version != FORWARD_VERSION:
+            raise ValueError(f"{path} has forward index version {version}, expected {FORWARD_VERSION}")
+
+        num_terms, num_docs = self.num_terms, self.num_docs
+        self._term_offsets = self._buffer[term_offsets_start:term_offsets_start + 8 * (num_terms + 1)].cast("Q")
+        self._term_strings = self._buffer[term_strings_start:doc_ids_start]
+        self._doc_ids = self._buffer[doc_ids_start:doc_ids_start + 4 * num_docs].cast("i")
+        self._entry_offsets = self._buffer[entry_offsets_start:entry_offsets_start + 8 * (num_docs + 1)].cast("Q")
+        self._term_id_offsets = self._buffer[term_id_offsets_start:
+                                             term_id_offsets_start + 8 * (num_docs + 1)].cast("Q")
+        self._term_ids = self._buffer[term_ids_start:weights_start]
+        self._weights = self._buffer[weights_start:weights_start + 4 * self._entry_offsets[num_docs]].cast("f")
+        self.index_version = index_version.hex()
+
+    def term(self, term_id):
+        return bytes(self._term_strings[self._term_offsets[term_id]:self._term_offsets[term_id + 1]]).decode("utf-8")
+
+    def document_vector(self, doc_id):
+        """
+        :return: (term_ids, weights) of doc_id - the sorted ids of its terms (see term) and their weights
+        idf * tf / document_length. Empty if doc_id is not in the corpus.
+        """
+        position = bisect.bisect_left(self._doc_ids, doc_id)
+        if position == self.num_docs or self._doc_ids[position] != doc_id:
+            return [], []
+        start = self._entry_offsets[position]
+        end = self._entry_offsets[position + 1]
+        deltas, _ = postings_codec.decode_varints(self._term_ids, self._term_id_offsets[position], end - start)
+        term_ids = []
+        term_id = 0
+        for delta in deltas:
+            term_id += delta
+            term_ids.append(term_id)
+        return term_ids, self._weights[start:end].tolist()
+
+    def close(self):
+        for view in (self._term_offsets, self._term_strings, self._doc_ids, self._entry_offsets,
+                     self._term_id_offsets, self._term_ids, self._weights, self._buffer):
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class ShardedIndex:
+    """
+    Reader for an index saved in shards by InvertedIndex.save_shards. Every shard is a regular index file over a
+    contiguous range of doc ids, and the manifest holds what the shards share: the idf of the whole corpus, which the
+    shards were written with, the number of documents and the index version. The shards are opened on first use, so
+    a coordinator that only computes query weights (see sharded_engine) never loads them. The reader exposes the same
+    interface as BinaryIndex, postings are the postings of every shard one after another.
+    """
+    num_documents: int  # the number of documents in the corpus
+    idf_scores: dict  # map between a token and its idf score over the whole corpus
+    index_version: str  # the version of the whole index, see IndexVersion
+    shard_paths: list  # the path of every shard, in doc id order
+
+    def __init__(self, path: str):
+        with open(shard_manifest_path(path), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        self.num_documents = manifest["num_documents"]
+        self.idf_scores = manifest["idf"]
+        self.index_version = manifest["index_version"]
+        self.shard_paths = [os.path.join(shard_directory(path), shard["path"]) for shard in manifest["shards"]]
+        self._first_doc_ids = [shard["first_doc_id"] for shard in manifest["shards"]]
+        self._shards = [None] * len(self.shard_paths)
+
+    def shard(self, shard_id):
+        """
+        :return: the reader of a shard, see load_index_file.
+        """
+        if self._shards[shard_id] is None:
+            self._shards[shard_id] = load_index_file(self.shard_paths[shard_id])
+        return self._shards[shard_id]
+
+    def _shard_of(self, doc_id):
+        return self.shard(bisect.bisect_right(self._first_doc_ids, doc_id) - 1)
+
+    def __contains__(self, token):
+        return token in self.idf_scores
+
+    def terms(self):
+        return sorted(self.idf_scores)
+
+    def document_ids(self):
+        doc_ids = []
+        for shard_id in range(len(self.shard_paths)):
+            doc_ids.extend(self.shard(shard_id).document_ids())
+        return doc_ids
+
+    def idf(self, token):
+        return float(self.idf_scores.get(token, 0))  # idf = 0 if token is not in the corpus
+
+    def document_length(self, doc_id):
+        return self._shard_of(doc_id).document_length(doc_id)
+
+    def max_occurrence(self, doc_id):
+        return self._shard_of(doc_id).max_occurrence(doc_id)
+
+    def max_weight(self, token):
+        return max(self.shard(shard_id).max_weight(token) for shard_id in range(len(self.shard_paths)))
+
+    def postings(self, token):
+        """
+        :return: (doc_ids, tfs) - the postings of token in every shard, sorted by doc id since the shards hold
+        consecutive ranges of doc ids.
+        """
+        doc_ids = []
+        tfs = []
+        for shard_id in range(len(self.shard_paths)):
+            shard_doc_ids, shard_tfs = self.shard(shard_id).postings(token)
+            doc_ids.extend(shard_doc_ids)
+            tfs.extend(shard_tfs)
+        return doc_ids, tfs
+
+    def close(self):
+        for shard in self._shards:
+            if shard is not None:
+                shard.close()
+
+
+class BinaryIndexWriter:
+    """
+    Writes the binary index format. Terms must be added in sorted order. Each term's postings are written as soon as
+    they are added, as a block of int32 doc ids followed by float32 tf scores, or with FLAG_COMPRESSED_POSTINGS as
+    the compressed raw counts of postings_codec, so only the term dictionary is kept in memory. The dictionary, idf,
+    doc ids, documents length and max occurrences arrays are appended by close(), which then fills in the header.
+    close() also reads the postings back once to precompute the max weight of every term, which needs the final
+    documents length, and with FLAG_DENSE_POSTINGS the dense postings of every term.
+    """
+    path: str  # the path of the index file
+    flags: int  # format flags stored in the header
+
+    def __init__(self, path: str, flags: int = 0, max_occurrences: dict = None):
+        """
+        :param path: the path of the index file
+        :param flags: format flags
+        :param max_occurrences: a map between a doc id and its maximal number of occurrences of a token, required
+            with FLAG_COMPRESSED_POSTINGS to turn the tf scores back into raw counts
+        """
+        self.path = path
+        self.flags = flags
+        self._max_occurrences = None
+        if max_occurrences is not None:
+            self._max_occurrences = {int(doc_id): occurrences for doc_id, occurrences in max_occurrences.items()}
+        if flags & FLAG_COMPRESSED_POSTINGS and self._max_occurrences is None:
+            raise ValueError("Compressed postings need max_occurrences")
+        self._file = open(path, 'w+b')
+        self._file.write(b"\0" * HEADER_SIZE)
+        _pad(self._file)
+        self._terms = []
+        self._idf = []
+        self._postings_offsets = []
+        self._postings_counts = []
+        self._postings_sizes = []
+        self._version = IndexVersion()
+
+    def add_term(self, term, idf, doc_ids, tfs):
+        """
+        :param term: the term to add, greater than every term added before it
+        :param idf: the idf score of the term
+        :param doc_ids: the ids of the documents the term appears in, sorted
+        :param tfs: the tf scores of the term, aligned with doc_ids
+        """
+        if self._terms and term <= self._terms[-1]:
+            raise ValueError(f"Terms must be added in sorted order, got {term!r} after {self._terms[-1]!r}")
+        count = len(doc_ids)
+        self._version.add_term(term, idf, doc_ids, tfs)
+        self._terms.append(term)
+        self._idf.append(idf)
+        self._postings_offsets.append(self._file.tell())
+        self._postings_counts.append(count)
+        if self.flags & FLAG_COMPRESSED_POSTINGS:
+            # tf = occurrences / max_occurrences, see InvertedIndex.compute_documents_length
+            counts = [round(tf * self._max_occurrences[doc_id]) for doc_id, tf in zip(doc_ids, tfs)]
+            postings = postings_codec.encode_postings(list(doc_ids), counts)
+        else:
+            postings = struct.pack(f"<{count}i", *doc_ids) + struct.pack(f"<{count}f", *tfs)
+        self._postings_sizes.append(len(postings))
+        self._file.write(postings)
+
+    def close(self, documents_length: dict, num_documents: int, max_occurrences: dict):
+        """
+        :param documents_length: a map between a doc id and its length as a vector
+        :param num_documents: the number of documents in the corpus
+        :param max_occurrences: a map between a doc id and its maximal number of occurrences of a token
+        """
+        file = self._file
+        num_terms = len(self._terms)
+        lengths = {int(doc_id): length for doc_id, length in documents_length.items()}
+
+        weighted = self.flags & FLAG_DENSE_POSTINGS
+        # the position of every doc id in the doc ids section, which interns the documents of the dense postings
+        document_positions = {doc_id: position for position, doc_id in enumerate(sorted(lengths))}
+        weight_offsets = [0]
+        doc_positions = []
+        weights = []
+
+        max_weights = []
+        for term_id in range(num_terms):
+            count = self._postings_counts[term_id]
+            file.seek(self._postings_offsets[term_id])
+            block = file.read(self._postings_sizes[term_id])
+            if self.flags & FLAG_COMPRESSED_POSTINGS:
+                doc_ids, counts = postings_codec.decode_postings(block, count)
+                tfs = [occurrences / self._max_occurrences[doc_id] for doc_id, occurrences in zip(doc_ids, counts)]
+            else:
+                doc_ids = struct.unpack_from(f"<{count}i", block)
+                tfs = struct.unpack_from(f"<{count}f", block, 4 * count)
+            max_weights.append(_max_weight(self._idf[term_id], doc_ids, tfs, lengths))
+            if weighted:
+                # the tf scores as the readers get them, float32 ones included
+                doc_positions.extend(document_positions[doc_id] for doc_id in doc_ids)
+                weights.extend(tfs)
+                weight_offsets.append(len(weights))
+        file.seek(0, os.SEEK_END)
+
+        encoded_terms = [term.encode("utf-8") for term in self._terms]
+
+        _pad(file)
+        term_offsets_start = file.tell()
+        offset = 0
+        term_offsets = [0]
+        for encoded in encoded_terms:
+            offset += len(encoded)
+            term_offsets.append(offset)
+        file.write(struct.pack(f"<{num_terms + 1}Q", *term_offsets))
+
+        term_strings_start = file.tell()
+        file.write(b"".join(encoded_terms))
+
+        _pad(file)
+        postings_offsets_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}Q", *self._postings_offsets))
+        postings_counts_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}I", *self._postings_counts))
+
+        _pad(file)
+        idf_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}d", *self._idf))
+        max_weights_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}d", *max_weights))
+
+        doc_ids = sorted(lengths)
+        occurrences = {int(doc_id): count for doc_id, count in max_occurrences.items()}
+        doc_ids_start = file.tell()
+        file.write(struct.pack(f"<{len(doc_ids)}i", *doc_ids))
+        _pad(file)
+        documents_length_start = file.tell()
+        file.write(struct.pack(f"<{len(doc_ids)}d", *(lengths[doc_id] for doc_id in doc_ids)))
+        max_occurrences_start = file.tell()
+        # a document without any token has no max occurrences
+        file.write(struct.pack(f"<{len(doc_ids)}i", *(occurrences.get(doc_id, 0) for doc_id in doc_ids)))
+
+        weight_offsets_start = doc_positions_start = weights_start = 0
+        if weighted:
+            _pad(file)
+            weight_offsets_start = file.tell()
+            file.write(struct.pack(f"<{num_terms + 1}Q", *weight_offsets))
+            doc_positions_start = file.tell()
+            file.write(struct.pack(f"<{len(doc_positions)}i", *doc_positions))
+            _pad(file)
+            weights_start = file.tell()
+            file.write(struct.pack(f"<{len(weights)}d", *weights))
+
+        file.seek(0)
+        file.write(struct.pack(HEADER_FORMAT, BINARY_MAGIC, BINARY_VERSION, self.flags, num_documents, num_terms,
+                               len(doc_ids), term_offsets_start, term_strings_start, postings_offsets_start,
+                               postings_counts_start, idf_start, max_weights_start, doc_ids_start, documents_length_start,
+                               max_occurrences_start, weight_offsets_start, doc_positions_start, weights_start,
+                               self._version.digest(documents_length, num_documents)))
+        file.close()
+
+
+class PositionsWriter:
+    """
+    Writes the token positions of an index, see PositionalIndex. Terms must be added in sorted order, and their
+    positional postings are written as soon as they are added, compressed by postings_codec.encode_positional_postings.
+    close() appends the term dictionary and fills in the header.
+    """
+    path: str  # the path of the positions file
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(b"\0" * POSITIONS_HEADER_SIZE)
+        _pad(self._file)
+        self._terms = []
+        self._postings_offsets = []
+        self._postings_counts = []
+
+    def add_term(self, term, doc_ids, positions):
+        """
+        :param term: the term to add, greater than every term added before it
+        :param doc_ids: the ids of the documents the term appears in, sorted
+        :param positions: the sorted positions of the term in each document, aligned with doc_ids
+        """
+        if self._terms and term <= self._terms[-1]:
+            raise ValueError(f"Terms must be added in sorted order, got {term!r} after {self._terms[-1]!r}")
+        self._terms.append(term)
+        self._postings_offsets.append(self._file.tell())
+        self._postings_counts.append(len(doc_ids))
+        self._file.write(postings_codec.encode_positional_postings(list(doc_ids), positions))
+
+    def close(self, index_version: str):
+        """
+        :param index_version: the version of the index the positions belong to, as a hex string
+        """
+        file = self._file
+        num_terms = len(self._terms)
+        encoded_terms = [term.encode("utf-8") for term in self._terms]
+
+        _pad(file)
+        term_offsets_start = file.tell()
+        offset = 0
+        term_offsets = [0]
+        for encoded in encoded_terms:
+            offset += len(encoded)
+            term_offsets.append(offset)
+        file.write(struct.pack(f"<{num_terms + 1}Q", *term_offsets))
+
+        term_strings_start = file.tell()
+        file.write(b"".join(encoded_terms))
+
+        _pad(file)
+        postings_offsets_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}Q", *self._postings_offsets))
+        postings_counts_start = file.tell()
+        file.write(struct.pack(f"<{num_terms}I", *self._postings_counts))
+
+        file.seek(0)
+        file.write(struct.pack(POSITIONS_HEADER_FORMAT, POSITIONS_MAGIC, POSITIONS_VERSION, num_terms,
+                               term_offsets_start, term_strings_start, postings_offsets_start, postings_counts_start,
+                               bytes.fromhex(index_version)))
+        file.close()
+
+
+class ForwardIndexWriter:
+    """
+    Writes the document vectors of an index, see ForwardIndex. Documents must be added in doc id order, and their
+    term ids are written as soon as they are added, so only the weights and the offsets are kept in memory until
+    close(), which appends them and the vocabulary and fills in the header.
+    """
+    path: str  # the path of the forward index file
+
+    def __init__(self, path: str, terms: list):
+        """
+        :param path: the path of the forward index file
+        :param terms: the sorted vocabulary, that term ids index
+        """
+        self.path = path
+        self._terms = terms
+        self._file = open(path, 'wb')
+        self._file.write(b"\0" * FORWARD_HEADER_SIZE)
+        self._doc_ids = []
+        self._entry_offsets = [0]
+        self._term_id_offsets = [0]
+        self._weights = []
+        self._term_ids_start = self._file.tell()
+
+    def add_document(self, doc_id, term_ids, weights):
+        """
+        :param doc_id: the document id, greater than every doc id added before it
+        :param term_ids: the sorted ids of the terms of the document
+        :param weights: the weight idf * tf / document_length of every term, aligned with term_ids
+        """
+        if self._doc_ids and doc_id <= self._doc_ids[-1]:
+            raise ValueError(f"Documents must be added in doc id order, got {doc_id} after {self._doc_ids[-1]}")
+        deltas = []
+        previous = 0
+        for term_id in term_ids:
+            deltas.append(term_id - previous)
+            previous = term_id
+        encoded = bytearray()
+        postings_codec.encode_varints(deltas, encoded)
+        self._file.write(encoded)
+        self._doc_ids.append(doc_id)
+        self._weights.extend(weights)
+        self._entry_offsets.append(len(self._weights))
+        self._term_id_offsets.append(self._term_id_offsets[-1] + len(encoded))
+
+    def close(self, index_version: str):
+        """
+        :param index_version: the version of the index the vectors belong to, as a hex string
+        """
+        file = self._file
+        num_terms = len(self._terms)
+        num_docs = len(self._doc_ids)
+        encoded_terms = [term.encode("utf-8") for term in self._terms]
+
+        _pad(file)
+        weights_start = file.tell()
+        file.write(struct.pack(f"<{len(self._weights)}f", *self._weights))
+
+        _pad(file)
+        entry_offsets_start = file.tell()
+        file.write(struct.pack(f"<{num_docs + 1}Q", *self._entry_offsets))
+        term_id_offsets_start = file.tell()
+        file.write(struct.pack(f"<{num_docs + 1}Q", *self._term_id_offsets))
+
+        term_offsets_start = file.tell()
+        offset = 0
+        term_offsets = [0]
+        for encoded in encoded_terms:
+            offset += len(encoded)
+            term_offsets.append(offset)
+        file.write(struct.pack(f"<{num_terms + 1}Q", *term_offsets))
+        term_strings_start = file.tell()
+        file.write(b"".join(encoded_terms))
+
+        _pad(file, 4)
+        doc_ids_start = file.tell()
+        file.write(struct.pack(f"<{num_docs}i", *self._doc_ids))
+
+        file.seek(0)
+        file.write(struct.pack(FORWARD_HEADER_FORMAT, FORWARD_MAGIC, FORWARD_VERSION, num_terms, num_docs,
+                               term_offsets_start, term_strings_start, doc_ids_start, entry_offsets_start,
+                               term_id_offsets_start, self._term_ids_start, weights_start,
+                               bytes.fromhex(index_version)))
+        file.close()
+
+
+class JsonIndexWriter:
+    """
+    Writes the json export term by term, with the same content and layout as json.dump(InvertedIndex.to_dict(),
+    sort_keys=True, indent=4). Terms must be added in sorted order. The tf section is streamed to a temporary file
+    next to the index, because it comes after documents_length and idf in the sorted json, and close() puts the
+    sections together. close() also writes the term table of LazyJsonIndex next to the index.
+    """
+    path: str  # the path of the index file
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tf_path = path + ".tf.tmp"
+        self._tf_file = open(self._tf_path, 'w')
+        self._idf = dict()
+        self._offsets = dict()  # map between a term and the (offset, length) of its tf map in the tf section
+        self._last_term = None
+        self._version = IndexVersion()
+
+    def add_term(self, term, idf, doc_ids, tfs):
+        """
+        :param term: the term to add, greater than every term added before it
+        :param idf: the idf score of the term
+        :param doc_ids: the ids of the documents the term appears in
+        :param tfs: the tf scores of the term, aligned with doc_ids
+        """
+        if self._last_term is not None and term <= self._last_term:
+            raise ValueError(f"Terms must be added in sorted order, got {term!r} after {self._last_term!r}")
+        if self._last_term is not None:
+            self._tf_file.write(",\n")
+        self._last_term = term
+        self._idf[term] = idf
+        self._version.add_term(term, idf, doc_ids, tfs)
+        tf_map = {str(doc_id): tf for doc_id, tf in zip(doc_ids, tfs)}
+        self._tf_file.write(" " * 8 + json.dumps(term) + ": ")
+        start = self._tf_file.tell()
+        self._tf_file.write(_nested_json(tf_map, 2))
+        self._offsets[term] = (start, self._tf_file.tell() - start)
+
+    def close(self, documents_length: dict, num_documents: int, max_occurrences: dict):
+        """
+        :param documents_length: a map between a doc id and its length as a vector
+        :param num_documents: the number of documents in the corpus
+        :param max_occurrences: a map between a doc id and its maximal number of occurrences of a token
+        """
+        self._tf_file.close()
+        index_version = self._version.digest(documents_length, num_documents).hex()
+        documents_length = {str(doc_id): length for doc_id, length in documents_length.items()}
+        max_occurrences = {str(doc_id): count for doc_id, count in max_occurrences.items()}
+        with open(self.path, 'w') as json_file:
+            json_file.write("{\n")
+            json_file.write(' ' * 4 + '"documents_length": ' + _nested_json(documents_length, 1) + ",\n")
+            json_file.write(' ' * 4 + '"idf": ' + _nested_json(self._idf, 1) + ",\n")
+            json_file.write(' ' * 4 + '"index_version": ' + json.dumps(index_version) + ",\n")
+            json_file.write(' ' * 4 + '"max_occurrences": ' + _nested_json(max_occurrences, 1) + ",\n")
+            json_file.write(' ' * 4 + '"num_documents": ' + json.dumps(num_documents) + ",\n")
+            if self._last_term is None:
+                json_file.write(' ' * 4 + '"tf": {}\n')
+            else:
+                json_file.write(' ' * 4 + '"tf": {\n')
+                tf_start = json_file.tell()
+                with open(self._tf_path, 'r') as tf_file:
+                    shutil.copyfileobj(tf_file, json_file)
+                json_file.write("\n" + " " * 4 + "}\n")
+            json_file.write("}")
+        os.remove(self._tf_path)
+
+        # the first line identifies the index file the table belongs to, see LazyJsonIndex.has_term_table
+        stat = os.stat(self.path)
+        with open(term_table_path(self.path), 'w') as table_file:
+            table_file.write(json.dumps({"index_size": stat.st_size, "index_mtime_ns": stat.st_mtime_ns}) + "\n")
+            json.dump({"num_documents": num_documents,
+                       "index_version": index_version,
+                       "idf": self._idf,
+                       "documents_length": documents_length,
+                       "max_occurrences": max_occurrences,
+                       "offsets": {term: (tf_start + offset, length)
+                                   for term, (offset, length) in self._offsets.items()}},
+                      table_file)
+
+
+def _nested_json(value, level):
+    """
+    :return: value as indented json, to be written at the given nesting level of the index file.
+    """
+    return json.dumps(value, sort_keys=True, indent=4).replace("\n", "\n" + " " * 4 * level)
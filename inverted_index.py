@@ -1,32 +1,85 @@
-from aux_methods import tokenize_and_preprocess
+from aux_methods import default_tokenizer, tokenize_and_preprocess
+from index_storage import (ForwardIndexWriter, IndexVersion, PositionsWriter, forward_path, index_writer,
+                           positions_path, remove_index, shard_directory, shard_manifest_path, stems_path)
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import xml.etree.ElementTree as ET
 import os
-import numpy as np
+import math
 import json
 
+# the positions of consecutive texts of a document (title, abstract, extract) are this far apart, so that a phrase
+# or a NEAR/k with a smaller k does not match across them
+POSITION_GAP = 100
+
+
+def parse_record(doc):
+    """
+    :param doc: a RECORD element of a corpus file
+    :return: (doc_id, list_of_text) - the record number without preceding zeros, and the title, abstract and
+        extract of the record.
+    """
+    doc_id = doc.findall("./RECORDNUM")[0].text.strip()
+    doc_id = str(int(doc_id))  # remove preceding zeros
+    title = doc.findall("./TITLE")[0].text
+    list_of_text = [title]
+    abstract = doc.findall("./ABSTRACT")
+    extract = doc.findall("./EXTRACT")
+
+    if len(abstract) > 0:
+        # according to the dtd there is only one such element
+        list_of_text.append(abstract[0].text)
+
+    if len(extract) > 0:
+        # according to the dtd there is only one such element
+        list_of_text.append(extract[0].text)
+
+    return doc_id, list_of_text
+
+
+def iter_records(path):
+    """
+    :param path: a corpus file
+    :return: a generator of parse_record(doc) for every RECORD element of the file. The file is parsed
+        incrementally and every record is dropped from the tree once it was processed, so memory use does not grow
+        with the size of the file.
+    """
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event == "end" and element.tag == "RECORD":
+            yield parse_record(element)
+            root.clear()
+
 
 class TokenInfo:
     token: str  # the token itself
     df_score: int  # the df score of the token associated with this object
     tf_map: dict  # a map between a document id to the number of occurrences of the token in this document
+    positions_map: dict  # a map between a document id and the positions of the token in it, if they are recorded
 
     def __init__(self, token: str):
         self.token = token
         self.tf_map = dict()
+        self.positions_map = dict()
         self.df_score = 0
 
-    def update_token_info(self, document_id, max_occurrences_dict):
+    def update_token_info(self, document_id, max_occurrences_dict, position=None):
         """
         :param max_occurrences_dict: to be received by InvertedIndex. A map between a document id and its maximal number
         of occurrences of a token.
         :param document_id: the document id for which to increase the number of occurrences for.
-        :return: updates the df_score and tf_map
+        :param position: the position of this occurrence in the document, or None if positions are not recorded
+        :return: updates the df_score, tf_map and positions_map
         """
         self.df_score += 1
         if document_id in self.tf_map:
             self.tf_map[document_id] += 1
         else:
             self.tf_map[document_id] = 1
+        if position is not None:
+            self.positions_map.setdefault(document_id, []).append(position)
 
         max_occurrences_dict[document_id] = max(max_occurrences_dict.get(document_id, 0),
                                                 self.tf_map[document_id])
@@ -40,9 +93,15 @@ class InvertedIndex:
     idf_scores: dict  # map between a token and its idf score. It is calculated after creating the inverted index.
     documents_length: dict  # a map between a document id and its length as a vector.
     max_occurrences: dict  # a map between a document id and its maximal number of occurrences of a token.
-    json_filename: str  # the name of the json file to load the index to
+    index_filename: str  # the name of the file to save the index to. Its extension selects the format.
+    num_shards: int  # the number of shards to save the index in, see save_shards. 1 saves a single file.
+    store_weights: bool  # whether to also save the dense postings of the dense engine, binary formats only
+    store_positions: bool  # whether to record the token positions and save them for phrase and NEAR/k queries
+    next_positions: dict  # a map between a document id and the position of its next text, see process_text
+    store_forward: bool  # whether to also save the vector of every document, for relevance feedback
 
-    def __init__(self, corpus_directory: str, filenames: list, json_filename: str):
+    def __init__(self, corpus_directory: str, filenames: list, index_filename: str, num_shards: int = 1,
+                 store_weights: bool = False, store_positions: bool = False, store_forward: bool = False):
         self.index_term_hash = dict()
         self.idf_scores = dict()
         self.documents_length = dict()
@@ -50,7 +109,12 @@ class InvertedIndex:
         self.corpus_directory = corpus_directory
         self.filenames = filenames
         self.num_documents = 0
-        self.json_filename = json_filename
+        self.index_filename = index_filename
+        self.num_shards = num_shards
+        self.store_weights = store_weights
+        self.store_positions = store_positions
+        self.next_positions = dict()
+        self.store_forward = store_forward
 
     def process_text(self, text, doc_id):
         """
@@ -61,54 +125,102 @@ class InvertedIndex:
 
         tokens_without_stopwords = tokenize_and_preprocess(text)
 
+        # positions count the tokens that are kept, so a phrase matches across the stopwords removed from it
+        position = None
+        if self.store_positions:
+            position = self.next_positions.get(doc_id, 0)
+            self.next_positions[doc_id] = position + len(tokens_without_stopwords) + POSITION_GAP
+
         # we update the inverted index (update self.index_term_hash)
         for token in tokens_without_stopwords:
             if token in self.index_term_hash:
                 token_info = self.index_term_hash[token]
-                token_info.update_token_info(document_id=doc_id, max_occurrences_dict=self.max_occurrences)
+                token_info.update_token_info(document_id=doc_id, max_occurrences_dict=self.max_occurrences,
+                                             position=position)
             else:
                 token_info = TokenInfo(token)
-                token_info.update_token_info(document_id=doc_id, max_occurrences_dict=self.max_occurrences)
+                token_info.update_token_info(document_id=doc_id, max_occurrences_dict=self.max_occurrences,
+                                             position=position)
                 self.index_term_hash[token] = token_info
+            if position is not None:
+                position += 1
 
-    def build_inverted_index(self):
+    def index_file(self, filename):
         """
-        :return: This method creates and saves the inverted index in a json file called self.json_filename
+        :param filename: a corpus file in self.corpus_directory
+        :return: parses the RECORD elements of the file and adds their text to the inverted index.
         """
+        with profiling.span("build.parse_xml"):
+            tree = ET.parse(os.path.join(self.corpus_directory, filename))
+        root = tree.getroot()
 
-        for filename in self.filenames:
+        documents = root.findall("./RECORD")
+        for doc in documents:
+            self.num_documents += 1
+            doc_id, list_of_text = parse_record(doc)
+            self.documents_length[doc_id] = 0  # initialize the document length to 0 for afterwards
 
-            tree = ET.parse(os.path.join(self.corpus_directory, filename))
-            root = tree.getroot()
+            for text in list_of_text:
+                self.process_text(text, doc_id)
 
-            documents = root.findall("./RECORD")
-            for doc in documents:
-                self.num_documents += 1
-                doc_id = doc.findall("./RECORDNUM")[0].text.strip()
-                doc_id = str(int(doc_id))  # remove preceding zeros
-                self.documents_length[doc_id] = 0  # initialize the document length to 0 for afterwards
-                title = doc.findall("./TITLE")[0].text
-                list_of_text = [title]
-                abstract = doc.findall("./ABSTRACT")
-                extract = doc.findall("./EXTRACT")
+    def merge(self, partial):
+        """
+        :param partial: an InvertedIndex built over files that come after the files of this index, before
+            compute_idf was called on either of them.
+        :return: adds the documents and postings of partial to this index. Tokens and documents keep the order in
+            which they were first seen, so merging partial indexes in file order gives the same index as indexing
+            the files one after another.
+        """
+        self.num_documents += partial.num_documents
+        for doc_id in partial.documents_length.keys():
+            self.documents_length[doc_id] = 0
 
-                if len(abstract) > 0:
-                    # according to the dtd there is only one such element
-                    list_of_text.append(abstract[0].text)
+        for token, partial_info in partial.index_term_hash.items():
+            if token not in self.index_term_hash:
+                self.index_term_hash[token] = partial_info
+            else:
+                token_info = self.index_term_hash[token]
+                token_info.df_score += partial_info.df_score
+                for doc_id, occurrences in partial_info.tf_map.items():
+                    token_info.tf_map[doc_id] = token_info.tf_map.get(doc_id, 0) + occurrences
+                for doc_id, positions in partial_info.positions_map.items():
+                    token_info.positions_map.setdefault(doc_id, []).extend(positions)
+
+            tf_map = self.index_term_hash[token].tf_map
+            for doc_id in partial_info.tf_map.keys():
+                self.max_occurrences[doc_id] = max(self.max_occurrences.get(doc_id, 0), tf_map[doc_id])
 
-                if len(extract) > 0:
-                    # according to the dtd there is only one such element
-                    list_of_text.append(extract[0].text)
+    def build_inverted_index(self, workers: int = 1):
+        """
+        :param workers: the number of processes that parse and tokenize the corpus files. With more than one worker
+            every file is indexed separately in a process pool and the partial indexes are merged in file order,
+            which gives exactly the index of the serial build.
+        :return: This method creates and saves the inverted index in a file called self.index_filename, and the stems
+            of the words of the corpus next to it, see aux_methods.Tokenizer.save_stems.
+        """
 
-                for text in list_of_text:
-                    self.process_text(text, doc_id)
+        with profiling.span("build.index_files"):
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    partial_indexes = executor.map(_index_corpus_file, repeat(self.corpus_directory), self.filenames,
+                                                   repeat(self.store_positions))
+                    for partial, stems in partial_indexes:
+                        self.merge(partial)
+                        default_tokenizer.stems.update(stems)
+            else:
+                for filename in self.filenames:
+                    self.index_file(filename)
+        profiling.count("documents_parsed", self.num_documents)
 
-        self.compute_idf()
-        self.compute_documents_length()
+        with profiling.span("build.compute_idf"):
+            self.compute_idf()
+        with profiling.span("build.compute_documents_length"):
+            self.compute_documents_length()
 
         # now we have all the data we want
 
-        self.save_json()
+        self.save_index()
+        default_tokenizer.save_stems(stems_path(self.index_filename))
 
     def compute_idf(self):
         """
@@ -117,15 +229,18 @@ class InvertedIndex:
         """
         for token in self.index_term_hash.keys():
             df_score = self.index_term_hash[token].df_score
-            self.idf_scores[token] = np.log2(self.num_documents / df_score)
+            self.idf_scores[token] = math.log2(self.num_documents / df_score)
 
     def compute_documents_length(self):
         """
             To be called only after compute_idf
         :return: This method calculates the norm (length) of each document in the corpus. It also normalizes the
             tf scores for each token and a document by the maximal number of occurrences of a token in this document.
+            The squared weights of a document are summed in sorted token order, the order in which
+            streaming_index.StreamingInvertedIndex merges the tokens, so every builder gets the same lengths to the
+            last bit, whatever order the tokens were first seen in.
         """
-        for token in self.index_term_hash.keys():
+        for token in sorted(self.index_term_hash.keys()):
             idf_score = self.idf_scores[token]
             token_info = self.index_term_hash[token]
             tf_map = token_info.tf_map
@@ -135,20 +250,173 @@ class InvertedIndex:
                 self.documents_length[doc_id] += (idf_score * tf_normalized) ** 2
 
         for doc_id in self.documents_length.keys():
-            self.documents_length[doc_id] = np.sqrt(self.documents_length[doc_id])
+            self.documents_length[doc_id] = math.sqrt(self.documents_length[doc_id])
+
+    def save_index(self):
+        """
+        :return: saves the index to self.index_filename, as json, binary or compressed binary according to its
+            extension, or in self.num_shards shards of that format. The index replaces the one saved there before and
+            every file saved next to it, see index_storage.remove_index. With store_positions the token positions are
+            saved next to it, see save_positions, and with store_forward the document vectors, see save_forward.
+        """
+        with profiling.span("index.save"):
+            remove_index(self.index_filename)
+            if self.num_shards > 1:
+                self.save_shards(self.num_shards)
+            else:
+                self.save_file(self.index_filename)
+            if self.store_positions:
+                self.save_positions(positions_path(self.index_filename))
+            if self.store_forward:
+                self.save_forward(forward_path(self.index_filename))
 
-    def save_json(self):
+    def to_dict(self):
+        """
+            To be called only after compute_documents_length
+        :return: the content of the json export of the index.
+        """
         dict_to_save = {"tf": dict(),
                         "idf": self.idf_scores,
+                        "index_version": self.index_version(),
                         "documents_length": self.documents_length,
+                        "max_occurrences": self.max_occurrences,
                         "num_documents": self.num_documents}
 
         for token in self.index_term_hash.keys():
             token_info = self.index_term_hash[token]
             dict_to_save["tf"][token] = token_info.tf_map  # reminder: token_info.tf_map is a dictionary
 
-        with open(self.json_filename, 'w') as json_file:
-            json.dump(dict_to_save, json_file, sort_keys=True, indent=4)
+        return dict_to_save
+
+    def index_version(self):
+        """
+            To be called only after compute_documents_length
+        :return: the version of the index as a hex string, the same one index_writer stores, see
+            index_storage.IndexVersion.
+        """
+        version = IndexVersion()
+        for token in sorted(self.index_term_hash.keys()):
+            tf_map = self.index_term_hash[token].tf_map
+            doc_ids = sorted(tf_map, key=int)
+            version.add_term(token, self.idf_scores[token], [int(doc_id) for doc_id in doc_ids],
+                             [tf_map[doc_id] for doc_id in doc_ids])
+        return version.digest(self.documents_length, self.num_documents).hex()
+
+    def save_file(self, filename):
+        """
+            To be called only after compute_documents_length
+        :return: streams the index to filename with index_storage.index_writer, in the format selected by its
+            extension. A json file is the same as json.dump(self.to_dict(), sort_keys=True, indent=4), and it comes
+            with the term table that index_storage.LazyJsonIndex reads it through.
+        """
+        writer = index_writer(filename, self.max_occurrences, self.store_weights)
+        for token in sorted(self.index_term_hash.keys()):
+            tf_map = self.index_term_hash[token].tf_map
+            doc_ids = sorted(tf_map, key=int)
+            writer.add_term(token, self.idf_scores[token], [int(doc_id) for doc_id in doc_ids],
+                            [tf_map[doc_id] for doc_id in doc_ids])
+        writer.close(self.documents_length, self.num_documents, self.max_occurrences)
+
+    def save_positions(self, filename):
+        """
+            To be called only after compute_documents_length, on an index built with store_positions
+        :return: saves the positions of every token in every document to filename with index_storage.PositionsWriter,
+            stamped with the version of the index, for phrase_query. The positions are shared by all the shards of a
+            sharded index.
+        """
+        writer = PositionsWriter(filename)
+        for token in sorted(self.index_term_hash.keys()):
+            positions_map = self.index_term_hash[token].positions_map
+            doc_ids = sorted(positions_map, key=int)
+            writer.add_term(token, [int(doc_id) for doc_id in doc_ids], [positions_map[doc_id] for doc_id in doc_ids])
+        writer.close(self.index_version())
+
+    def save_forward(self, filename):
+        """
+            To be called only after compute_documents_length
+        :return: saves the vector of every document to filename with index_storage.ForwardIndexWriter, stamped with
+            the version of the index: the weight idf * tf / document_length of every term of the document, which are
+            the components of the unit vector that the cosine similarity compares queries with. Terms with a weight
+            of 0 (in every document) are left out.
+        """
+        terms = sorted(self.index_term_hash.keys())
+        vectors = {doc_id: ([], []) for doc_id in self.documents_length}  # map between a doc id and its vector
+        for term_id, token in enumerate(terms):
+            idf_score = self.idf_scores[token]
+            for doc_id, tf in self.index_term_hash[token].tf_map.items():
+                weight = idf_score * tf / self.documents_length[doc_id] if self.documents_length[doc_id] else 0.0
+                if weight != 0:
+                    term_ids, weights = vectors[doc_id]
+                    term_ids.append(term_id)
+                    weights.append(weight)
+
+        writer = ForwardIndexWriter(filename, terms)
+        for doc_id in sorted(vectors, key=int):
+            writer.add_document(int(doc_id), *vectors[doc_id])
+        writer.close(self.index_version())
+
+    def save_shards(self, num_shards):
+        """
+            To be called only after compute_documents_length
+        :param num_shards: the number of shards, at most the number of documents
+        :return: partitions the documents into num_shards ranges of consecutive doc ids of about the same size, and
+            saves the postings of every range as an index file in index_storage.shard_directory(self.index_filename),
+            in the format selected by the extension of self.index_filename. Every shard keeps the idf and the
+            documents length of the whole corpus, so a document gets the same score from its shard as from the
+            whole index. The manifest lists the shards with their first doc id, and holds the idf for the query
+            weights, see index_storage.ShardedIndex.
+        """
+        directory = shard_directory(self.index_filename)
+        os.makedirs(directory)
+
+        doc_ids = sorted(self.documents_length, key=int)
+        num_shards = max(1, min(num_shards, len(doc_ids)))
+        extension = os.path.splitext(self.index_filename)[1]
+        shard_of = dict()  # map between a doc id and its shard
+        shards = []
+        for shard_id in range(num_shards):
+            shard_doc_ids = doc_ids[shard_id * len(doc_ids) // num_shards:(shard_id + 1) * len(doc_ids) // num_shards]
+            for doc_id in shard_doc_ids:
+                shard_of[doc_id] = shard_id
+            filename = f"shard_{shard_id:03d}{extension}"
+            shards.append({"path": filename,
+                           "first_doc_id": int(shard_doc_ids[0]) if shard_doc_ids else 0,
+                           "documents_length": {doc_id: self.documents_length[doc_id] for doc_id in shard_doc_ids},
+                           "max_occurrences": {doc_id: self.max_occurrences[doc_id] for doc_id in shard_doc_ids
+                                               if doc_id in self.max_occurrences}})
+        writers = [index_writer(os.path.join(directory, shard["path"]), shard["max_occurrences"], self.store_weights)
+                   for shard in shards]
+
+        for token in sorted(self.index_term_hash.keys()):
+            tf_map = self.index_term_hash[token].tf_map
+            shard_postings = [([], []) for _ in range(num_shards)]
+            for doc_id in sorted(tf_map, key=int):
+                shard_doc_ids, shard_tfs = shard_postings[shard_of[doc_id]]
+                shard_doc_ids.append(int(doc_id))
+                shard_tfs.append(tf_map[doc_id])
+            for writer, (shard_doc_ids, shard_tfs) in zip(writers, shard_postings):
+                if shard_doc_ids:
+                    writer.add_term(token, self.idf_scores[token], shard_doc_ids, shard_tfs)
+
+        for writer, shard in zip(writers, shards):
+            writer.close(shard["documents_length"], self.num_documents, shard["max_occurrences"])
+
+        manifest = {"num_documents": self.num_documents,
+                    "index_version": self.index_version(),
+                    "idf": self.idf_scores,
+                    "shards": [{"path": shard["path"], "first_doc_id": shard["first_doc_id"]} for shard in shards]}
+        with open(shard_manifest_path(self.index_filename), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, sort_keys=True, indent=4)
+
+
+def _index_corpus_file(corpus_directory, filename, store_positions=False):
+    """
+    :return: (partial, stems) - a partial InvertedIndex of a single corpus file, to be merged by
+        InvertedIndex.build_inverted_index, and the stems of its words, see aux_methods.Tokenizer.stem_table.
+    """
+    partial = InvertedIndex(corpus_directory, [filename], None, store_positions=store_positions)
+    partial.index_file(filename)
+    return partial, default_tokenizer.stem_table()
 
 
 # if __name__ == "__main__":
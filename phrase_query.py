@@ -0,0 +1,131 @@
+"""
+Phrase and proximity constraints for queries, answered from the token positions of an index built with
+create_index --positions (see index_storage.PositionalIndex):
+
+    "sweat chloride test"            the tokens must appear next to each other, in this order
+    pancreatic NEAR/5 insufficiency  the operands must appear in either order with at most 5 tokens from the end of
+                                     one to the start of the other (next to each other is 1)
+
+An operand of NEAR/k is a word or a quoted phrase. Positions count the tokens that are left after stopwords are
+removed, so "effects of calcium" matches "effects of the calcium". A quoted single token is not a constraint, it is
+scored as a plain query word. The documents that satisfy every constraint of a query are then ranked by the cosine
+similarity of the whole query, operators removed.
+"""
+from aux_methods import tokenize_and_preprocess
+import bisect
+import re
+
+_OPERAND = r'"[^"]*"|[^\s"]+'
+NEAR_PATTERN = re.compile(rf'({_OPERAND})\s+NEAR/(\d+)\s+({_OPERAND})')
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+
+class Phrase:
+    """
+    Consecutive tokens.
+    """
+    tokens: list  # the tokens of the phrase, in order
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+
+    def starts(self, positions):
+        """
+        :param positions: a map between every token of the phrase and its sorted positions in a document
+        :return: the sorted positions the phrase starts at in the document.
+        """
+        following = [set(positions[token]) for token in self.tokens[1:]]
+        return [start for start in positions[self.tokens[0]]
+                if all(start + offset in token_positions for offset, token_positions in enumerate(following, 1))]
+
+    def matches(self, positions):
+        return len(self.starts(positions)) > 0
+
+
+class Near:
+    """
+    Two phrases (or single tokens) at most k tokens apart, in either order.
+    """
+    left: Phrase
+    right: Phrase
+    k: int  # the maximal distance from the end of one operand to the start of the other
+
+    def __init__(self, left: Phrase, right: Phrase, k: int):
+        self.left = left
+        self.right = right
+        self.k = k
+
+    @property
+    def tokens(self):
+        return self.left.tokens + self.right.tokens
+
+    def matches(self, positions):
+        left_starts = self.left.starts(positions)
+        right_starts = self.right.starts(positions)
+        left_length = len(self.left.tokens)
+        right_length = len(self.right.tokens)
+        for start in left_starts:
+            # right after left: its start is in [end of left + 1, end of left + k]
+            low = bisect.bisect_left(right_starts, start + left_length)
+            if low < len(right_starts) and right_starts[low] <= start + left_length - 1 + self.k:
+                return True
+            # right before left: its end is in [start of left - k, start of left - 1]
+            low = bisect.bisect_left(right_starts, start - self.k - right_length + 1)
+            if low < len(right_starts) and right_starts[low] <= start - right_length:
+                return True
+        return False
+
+
+def _operand(text):
+    return Phrase(tokenize_and_preprocess(text.strip('"')))
+
+
+def parse_query(query):
+    """
+    :param query: user query
+    :return: (text, constraints) - the query without the NEAR/k operators, to be scored, and its Phrase and Near
+        constraints. The operators are removed even when they have no constraint, e.g. with a missing operand.
+    """
+    if '"' not in query and "NEAR/" not in query:
+        return query, []
+
+    constraints = []
+    for match in NEAR_PATTERN.finditer(query):
+        left, right = _operand(match.group(1)), _operand(match.group(3))
+        if left.tokens and right.tokens:
+            constraints.append(Near(left, right, int(match.group(2))))
+    # the phrases that are operands of NEAR/k are already checked by it
+    for match in PHRASE_PATTERN.finditer(NEAR_PATTERN.sub(" ", query)):
+        phrase = _operand(match.group(1))
+        if len(phrase.tokens) > 1:
+            constraints.append(phrase)
+    return re.sub(r"\bNEAR/\d+\b", " ", query), constraints
+
+
+def matching_documents(positional_index, constraints):
+    """
+    :param positional_index: an index_storage.PositionalIndex
+    :param constraints: the constraints returned by parse_query
+    :return: the set of doc ids that satisfy every constraint. The postings of all the tokens are intersected
+        starting from the rarest token: every one of its documents is looked up in the other tokens, rarest first,
+        with their skip pointers, and dropped at the first token it lacks, so the cost depends on the number of
+        documents of the rarest token rather than on the total length of the postings.
+    """
+    tokens = sorted({token for constraint in constraints for token in constraint.tokens},
+                    key=positional_index.document_count)
+    if len(tokens) == 0 or positional_index.document_count(tokens[0]) == 0:
+        return set()
+
+    cursors = [positional_index.cursor(token) for token in tokens[1:]]
+    documents = set()
+    for doc_id, rarest_positions in positional_index.cursor(tokens[0]):
+        positions = {tokens[0]: rarest_positions}
+        for token, cursor in zip(tokens[1:], cursors):
+            token_positions = cursor.positions(doc_id)
+            if token_positions is None:
+                break
+            positions[token] = token_positions
+        else:
+            if all(constraint.matches(positions) for constraint in constraints):
+                documents.add(doc_id)
+    return documents
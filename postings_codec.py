@@ -0,0 +1,182 @@
+import struct
+
+# the number of postings in a block. Every block can be decoded on its own, and the block table keeps the last doc id
+# of every block so a reader can skip the blocks that come before a doc id.
+BLOCK_SIZE = 128
+
+# last doc id and byte offset of the block data, relative to the start of the term postings
+BLOCK_ENTRY_FORMAT = "<II"
+BLOCK_ENTRY_SIZE = struct.calcsize(BLOCK_ENTRY_FORMAT)
+
+
+def encode_varints(values, out: bytearray):
+    """
+    :param values: non negative integers
+    :param out: the buffer to append to
+    :return: appends every value to out as a variable-byte integer: 7 bits per byte, low bits first, with the high bit
+        set on every byte but the last.
+    """
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(buffer, position, count):
+    """
+    :param buffer: bytes written by encode_varints
+    :param position: the offset of the first value
+    :param count: the number of values to decode
+    :return: (values, position) - the decoded values and the offset right after them.
+    """
+    values = []
+    for _ in range(count):
+        value = 0
+        shift = 0
+        byte = buffer[position]
+        position += 1
+        while byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            byte = buffer[position]
+            position += 1
+        values.append(value | (byte << shift))
+    return values, position
+
+
+def num_blocks(count):
+    return (count + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+
+def encode_postings(doc_ids, counts):
+    """
+    :param doc_ids: the doc ids of a term, sorted
+    :param counts: the raw number of occurrences of the term in each document
+    :return: the compressed postings: a table with an entry per block, followed by the blocks. A block is the
+        varint deltas of its doc ids (the first one relative to the last doc id of the previous block) followed by
+        the varint counts.
+    """
+    blocks = bytearray()
+    table = bytearray()
+    table_size = num_blocks(len(doc_ids)) * BLOCK_ENTRY_SIZE
+    previous = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block_doc_ids = doc_ids[start:start + BLOCK_SIZE]
+        table += struct.pack(BLOCK_ENTRY_FORMAT, block_doc_ids[-1], table_size + len(blocks))
+        deltas = []
+        for doc_id in block_doc_ids:
+            deltas.append(doc_id - previous)
+            previous = doc_id
+        encode_varints(deltas, blocks)
+        encode_varints(counts[start:start + BLOCK_SIZE], blocks)
+    return bytes(table + blocks)
+
+
+def block_last_doc_ids(buffer, count):
+    """
+    :param buffer: the compressed postings of a term
+    :param count: the number of postings of the term
+    :return: the last doc id of every block.
+    """
+    return [struct.unpack_from(BLOCK_ENTRY_FORMAT, buffer, block * BLOCK_ENTRY_SIZE)[0]
+            for block in range(num_blocks(count))]
+
+
+def _decode_block_doc_ids(buffer, count, block):
+    """
+    :return: (doc_ids, position) - the doc ids of the block and the offset of the data that follows them.
+    """
+    _, position = struct.unpack_from(BLOCK_ENTRY_FORMAT, buffer, block * BLOCK_ENTRY_SIZE)
+    previous = struct.unpack_from(BLOCK_ENTRY_FORMAT, buffer, (block - 1) * BLOCK_ENTRY_SIZE)[0] if block > 0 else 0
+    block_count = min(BLOCK_SIZE, count - block * BLOCK_SIZE)
+    deltas, position = decode_varints(buffer, position, block_count)
+    doc_ids = []
+    for delta in deltas:
+        previous += delta
+        doc_ids.append(previous)
+    return doc_ids, position
+
+
+def decode_block(buffer, count, block):
+    """
+    :param buffer: the compressed postings of a term
+    :param count: the number of postings of the term
+    :param block: the number of the block to decode
+    :return: (doc_ids, counts) of the block.
+    """
+    doc_ids, position = _decode_block_doc_ids(buffer, count, block)
+    counts, _ = decode_varints(buffer, position, len(doc_ids))
+    return doc_ids, counts
+
+
+def iter_blocks(buffer, count):
+    """
+    :return: a generator of decode_block for every block of the compressed postings, in order.
+    """
+    for block in range(num_blocks(count)):
+        yield decode_block(buffer, count, block)
+
+
+def decode_postings(buffer, count):
+    """
+    :return: (doc_ids, counts) of all the compressed postings.
+    """
+    doc_ids = []
+    counts = []
+    for block_doc_ids, block_counts in iter_blocks(buffer, count):
+        doc_ids.extend(block_doc_ids)
+        counts.extend(block_counts)
+    return doc_ids, counts
+
+
+def encode_positional_postings(doc_ids, positions):
+    """
+    :param doc_ids: the doc ids of a term, sorted
+    :param positions: the sorted positions of the term in each document
+    :return: the compressed positional postings, with the block table of encode_postings as skip pointers. A block is
+        the varint deltas of its doc ids followed, for every document, by its number of positions and the varint
+        deltas of its positions (the first one relative to 0).
+    """
+    blocks = bytearray()
+    table = bytearray()
+    table_size = num_blocks(len(doc_ids)) * BLOCK_ENTRY_SIZE
+    previous = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block_doc_ids = doc_ids[start:start + BLOCK_SIZE]
+        table += struct.pack(BLOCK_ENTRY_FORMAT, block_doc_ids[-1], table_size + len(blocks))
+        deltas = []
+        for doc_id in block_doc_ids:
+            deltas.append(doc_id - previous)
+            previous = doc_id
+        encode_varints(deltas, blocks)
+        for document_positions in positions[start:start + BLOCK_SIZE]:
+            encode_varints([len(document_positions)], blocks)
+            last_position = 0
+            position_deltas = []
+            for position in document_positions:
+                position_deltas.append(position - last_position)
+                last_position = position
+            encode_varints(position_deltas, blocks)
+    return bytes(table + blocks)
+
+
+def decode_positional_block(buffer, count, block):
+    """
+    :param buffer: the compressed positional postings of a term
+    :param count: the number of documents of the term
+    :param block: the number of the block to decode
+    :return: (doc_ids, positions) of the block, positions holding the sorted positions of every document.
+    """
+    doc_ids, offset = _decode_block_doc_ids(buffer, count, block)
+    positions = []
+    for _ in doc_ids:
+        (num_positions,), offset = decode_varints(buffer, offset, 1)
+        deltas, offset = decode_varints(buffer, offset, num_positions)
+        document_positions = []
+        position = 0
+        for delta in deltas:
+            position += delta
+            document_positions.append(position)
+        positions.append(document_positions)
+    return doc_ids, positions
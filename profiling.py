@@ -0,0 +1,137 @@
+"""
+Lightweight tracing of the build and query stages. Profiling is off unless enable() is called (vsm_ir.py --profile),
+and while it is off span() returns a shared no-op context manager and count() returns at once, so the instrumented
+code pays for a function call at most. Hot loops check profiling.profiler themselves and report their totals once:
+
+    with profiling.span("query.score"):
+        ...
+    if profiling.profiler is not None:
+        profiling.profiler.count("postings_scanned", scanned)
+
+Only the current process is traced, the work done in worker processes (--workers, the sharded engine) is not.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+profiler = None  # the active Profiler, or None while profiling is disabled
+
+_DISABLED_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Collects timing spans and counters. Every span is kept, for the Chrome trace, and the summary aggregates the
+    spans by name.
+    """
+    spans: list  # (name, start, end, thread id) of every finished span, in perf_counter seconds
+    counters: dict  # map between a counter name and its value
+    start: float  # the perf_counter time the profiler was created at, the origin of the trace
+
+    def __init__(self):
+        self.spans = []
+        self.counters = dict()
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter())
+
+    def add_span(self, name, start, end):
+        """
+        :return: records a span that was timed by the caller with time.perf_counter.
+        """
+        self.spans.append((name, start, end, threading.get_ident()))
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        :return: a list of (name, calls, total seconds, mean seconds, max seconds) of every span name, the slowest
+            stage first.
+        """
+        stages = dict()  # map between a span name and [calls, total, max]
+        for name, start, end, _ in self.spans:
+            stage = stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += end - start
+            stage[2] = max(stage[2], end - start)
+        rows = [(name, calls, total, total / calls, longest) for name, (calls, total, longest) in stages.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def summary_table(self):
+        """
+        :return: the summary and the counters as a text table.
+        """
+        lines = [f"{'stage':<32}{'calls':>10}{'total ms':>12}{'mean ms':>12}{'max ms':>12}"]
+        for name, calls, total, mean, longest in self.summary():
+            lines.append(f"{name:<32}{calls:>10}{total * 1000:>12.2f}{mean * 1000:>12.3f}{longest * 1000:>12.3f}")
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'counter':<32}{'value':>10}")
+            for name in sorted(self.counters):
+                value = self.counters[name]
+                lines.append(f"{name:<32}{value:>10.4f}" if isinstance(value, float) else f"{name:<32}{value:>10}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        :return: the spans in the Chrome trace event format (chrome://tracing, Perfetto), with the counters as a
+            counter event at the end of the trace. The summary and the counters are also kept under otherData.
+        """
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": thread_id,
+                   "ts": (start - self.start) * 1e6, "dur": (end - start) * 1e6}
+                  for name, start, end, thread_id in self.spans]
+        events.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+                       "ts": (time.perf_counter() - self.start) * 1e6, "args": dict(self.counters)})
+        summary = [{"name": name, "calls": calls, "total_seconds": total, "mean_seconds": mean, "max_seconds": longest}
+                   for name, calls, total, mean, longest in self.summary()]
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"summary": summary, "counters": dict(self.counters)}}
+
+    def save(self, path):
+        """
+        :return: saves chrome_trace() to path as json.
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+def enable():
+    """
+    :return: starts profiling with a new Profiler, and returns it.
+    """
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
+
+
+def span(name):
+    """
+    :param name: the name of the stage, e.g. "query.score"
+    :return: a context manager that times the stage, or a no-op one while profiling is disabled.
+    """
+    if profiler is None:
+        return _DISABLED_SPAN
+    return profiler.span(name)
+
+
+def count(name, value=1):
+    """
+    :return: adds value to the counter name, if profiling is enabled.
+    """
+    if profiler is not None:
+        profiler.count(name, value)
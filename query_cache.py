@@ -0,0 +1,171 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+
+VERSION_MARKER = ".query_cache_version"  # the file that marks a directory of results written by QueryResultCache
+
+
+def query_key(weights, top_k=None):
+    """
+    :param weights: the query weights returned by QueryEngine.query_weights
+    :param top_k: the top_k the query is ranked with
+    :return: a key for the ranking of the query. Queries that are tokenized and stemmed to the same tokens with the
+        same number of occurrences, in any order, get the same key.
+    """
+    occurrences = dict()  # map between a token and [occurrences, token_weight]
+    for token, token_weight, _ in weights:
+        if token in occurrences:
+            occurrences[token][0] += 1
+        else:
+            occurrences[token] = [1, token_weight]
+    normalized = sorted((token, count, repr(float(token_weight)))
+                        for token, (count, token_weight) in occurrences.items())
+    return hashlib.blake2b(json.dumps([top_k, normalized]).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class QueryResultCache:
+    """
+    Caches the ranked doc ids of queries. The results are kept in memory up to capacity, evicting the least recently
+    used one, and if a directory is given they are also saved there as one json file per query, so that they survive
+    the process and are shared by every process that uses the same directory. The directory keeps up to disk_capacity
+    results, evicting the least recently used ones by their modification time. Every result belongs to the version of
+    the index it was ranked with (see index_storage.IndexVersion): once a different version is asked for, the results
+    of the old one are dropped, from memory and from the directory. A directory should therefore serve a single index.
+    The results of a version are saved in a subdirectory named after it that holds a VERSION_MARKER file, and only
+    such subdirectories are ever deleted, so the directory may be shared with other files.
+    """
+    capacity: int  # the maximal number of results kept in memory
+    directory: str  # the directory of the on-disk results, or None
+    disk_capacity: int  # the maximal number of results kept in the directory
+    index_version: str  # the version of the index the cached results belong to
+    hits: int  # lookups answered from memory or from the directory
+    disk_hits: int  # the hits that were answered from the directory
+    misses: int  # lookups that had to be ranked
+    evictions: int  # results dropped from memory to respect capacity
+    disk_evictions: int  # results deleted from the directory to respect disk_capacity
+
+    def __init__(self, capacity: int = 1024, directory: str = None, disk_capacity: int = 65536):
+        self.capacity = capacity
+        self.directory = directory
+        self.disk_capacity = disk_capacity
+        self.index_version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._results = OrderedDict()  # map between a query key and its ranked doc ids, least recently used first
+        self._disk_entries = None  # the number of results in the directory of the version, counted on the first put
+
+    def _use_version(self, index_version):
+        if index_version == self.index_version:
+            return
+        self.index_version = index_version
+        self._results.clear()
+        self._disk_entries = None
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name != index_version and os.path.isfile(os.path.join(path, VERSION_MARKER)):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def _version_directory(self):
+        return os.path.join(self.directory, self.index_version)
+
+    def _path(self, key):
+        return os.path.join(self._version_directory(), key + ".json")
+
+    def _saved_results(self):
+        """
+        :return: the paths of the results saved in the directory of the version.
+        """
+        directory = self._version_directory()
+        return [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".json")]
+
+    def get(self, index_version, key):
+        """
+        :param index_version: the version of the index the query is ranked with
+        :param key: the key returned by query_key
+        :return: the cached ranked doc ids of the query, or None.
+        """
+        self._use_version(index_version)
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return list(self._results[key])
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "r") as result_file:
+                ranked_documents = json.load(result_file)
+            # a disk hit makes the result recently used, see _evict_saved_results
+            os.utime(self._path(key))
+            self._remember(key, ranked_documents)
+            self.hits += 1
+            self.disk_hits += 1
+            return list(ranked_documents)
+
+        self.misses += 1
+        return None
+
+    def put(self, index_version, key, ranked_documents):
+        """
+        :param index_version: the version of the index the query was ranked with
+        :param key: the key returned by query_key
+        :param ranked_documents: the ranked doc ids of the query
+        """
+        self._use_version(index_version)
+        self._remember(key, list(ranked_documents))
+        if self.directory is not None:
+            directory = self._version_directory()
+            if not os.path.isfile(os.path.join(directory, VERSION_MARKER)):
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, VERSION_MARKER), "w") as marker_file:
+                    marker_file.write(index_version)
+            if self._disk_entries is None:
+                self._disk_entries = len(self._saved_results())
+            if not os.path.exists(self._path(key)):
+                self._disk_entries += 1
+            # written aside and renamed, so that a concurrent reader never sees a partial file
+            temporary_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as result_file:
+                json.dump(ranked_documents, result_file)
+            os.replace(temporary_path, self._path(key))
+            if self._disk_entries > self.disk_capacity:
+                self._evict_saved_results()
+
+    def _evict_saved_results(self):
+        """
+        Deletes the least recently used results of the directory, down to 7/8 of disk_capacity, so that the directory
+        is only listed once every disk_capacity / 8 new results.
+        """
+        paths = []
+        for path in self._saved_results():
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:  # deleted by another process
+                pass
+        paths.sort()
+        excess = max(len(paths) - self.disk_capacity * 7 // 8, 0)
+        for _, path in paths[:excess]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.disk_evictions += excess
+        self._disk_entries = len(paths) - excess
+
+    def _remember(self, key, ranked_documents):
+        self._results[key] = ranked_documents
+        self._results.move_to_end(key)
+        while len(self._results) > self.capacity:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        :return: a map between the name of every counter and its value.
+        """
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions, "size": len(self._results)}
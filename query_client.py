@@ -0,0 +1,92 @@
+"""
+An asyncio client of query_server.QueryServer. A single connection can have many queries in flight, the responses
+are matched to the queries by their request id:
+
+    client = await QueryClient.connect("127.0.0.1", 8765)
+    ranked = await client.query("effects of calcium on mucus", top_k=10)  # [[doc_id, score], ...]
+    await client.close()
+"""
+import asyncio
+import itertools
+import json
+import sys
+
+
+class QueryClient:
+    """
+    A connection to a query server.
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._ids = itertools.count()
+        self._waiting = dict()  # map between the id of a request in flight and the future of its response
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        error = ConnectionError("The server closed the connection")
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._waiting.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(RuntimeError(response["error"]))
+                else:
+                    future.set_result(response["results"])
+        except (ConnectionError, asyncio.CancelledError) as exception:
+            error = exception
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError(str(error)))
+        self._waiting.clear()
+
+    async def query(self, query, top_k=None):
+        """
+        :param query: user query
+        :param top_k: see QueryEngine.rank
+        :return: the ranked [doc_id, score] pairs of the query.
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        request = {"id": request_id, "query": query}
+        if top_k is not None:
+            request["top_k"] = top_k
+        self.writer.write((json.dumps(request) + "\n").encode("utf-8"))
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._receiver.cancel()
+
+
+async def query_server(query, top_k=None, host="127.0.0.1", port=8765):
+    """
+    :return: the ranked [doc_id, score] pairs of a single query, over a new connection.
+    """
+    client = await QueryClient.connect(host, port)
+    try:
+        return await client.query(query, top_k)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    # python query_client.py "<query>" [port]
+    for doc_id, score in asyncio.run(query_server(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765)):
+        print(f"{doc_id}\t{score:.6f}")
@@ -0,0 +1,201 @@
+"""
+A local query server (vsm_ir.py serve) that keeps an index loaded and answers concurrent queries over TCP. The protocol
+is one json object per line in both directions:
+
+    request:  {"id": 7, "query": "effects of calcium on mucus", "top_k": 10}
+    response: {"id": 7, "results": [[doc_id, score], ...]}
+              {"id": 7, "error": "..."}
+
+"top_k" is optional and "id" is echoed back as is, so a client can send many requests on one connection without
+waiting and match the responses, which arrive in the order the queries finish. The asyncio loop only parses and
+writes lines: the scoring runs in a pool of worker processes that each load the index once. Requests that arrive
+within batch_window seconds of each other are scored as one batch, split evenly between the workers, so that a burst
+of queries pays for a single round trip to every worker instead of one per query.
+"""
+from answer_query import QueryEngine
+from aux_methods import default_tokenizer
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import json
+
+_engine = None  # the engine of the current worker process, see load_engine
+_load_error = None  # the ValueError the engine of the current worker process raised while loading, see load_engine
+
+
+def load_engine(engine_class, index_path):
+    """
+    :param engine_class: QueryEngine or a subclass of it
+    :param index_path: the path of the index
+    :return: loads the index and the stemmer once for all the batches that this process scores. If the engine
+        cannot load the index, e.g. an index without the sidecar it needs, score_batch raises its error, since an
+        error in the initializer of a worker would only break the pool.
+    """
+    global _engine, _load_error
+    try:
+        _engine = engine_class(index_path)
+    except ValueError as error:
+        _engine, _load_error = None, error
+        return
+    default_tokenizer.load_stemmer()
+
+
+def score_batch(requests):
+    """
+    :param requests: a list of (query, top_k)
+    :return: the ranked (doc_id, score) pairs of every query, see QueryEngine.rank_scored. The queries with the same
+        top_k are ranked together with QueryEngine.rank_scored_many, so that sparse_engine.SparseQueryEngine scores them
+        with a single matrix product and sharded_engine.ShardedQueryEngine with a single scatter and gather.
+    """
+    if _engine is None:
+        raise _load_error
+    batches = dict()  # map between a top_k and the positions of its requests
+    for position, (_, top_k) in enumerate(requests):
+        batches.setdefault(top_k, []).append(position)
+
+    results = [None] * len(requests)
+    for top_k, positions in batches.items():
+        ranked = _engine.rank_scored_many([requests[position][0] for position in positions], top_k)
+        for position, ranked_documents in zip(positions, ranked):
+            results[position] = ranked_documents
+    return results
+
+
+class QueryServer:
+    """
+    Serves the index at index_path with the newline delimited json protocol of this module.
+    """
+    index_path: str  # the path of the served index
+    engine_class: type  # the engine the workers score with
+    workers: int  # the number of worker processes
+    batch_window: float  # how long in seconds a request waits for others to join its batch
+    max_batch: int  # a batch is scored at once when it reaches this many requests
+    executor: ProcessPoolExecutor  # the worker processes, None until start is called
+
+    def __init__(self, index_path: str, engine_class=QueryEngine, workers: int = 1, batch_window: float = 0.002,
+                 max_batch: int = 64):
+        self.index_path = index_path
+        self.engine_class = engine_class
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.executor = None
+        self._pending = []  # (query, top_k, future) of the requests of the next batch
+        self._flush_handle = None  # the timer that scores the next batch when batch_window is over
+
+    async def start(self):
+        """
+        :return: starts the worker processes and waits until every one of them has loaded the index and the stemmer.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=load_engine,
+                                            initargs=(self.engine_class, self.index_path))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, score_batch, []) for _ in range(self.workers)])
+
+    def submit(self, query, top_k=None):
+        """
+        :param query: user query
+        :param top_k: see QueryEngine.rank
+        :return: a future of the ranked (doc_id, score) pairs of the query, scored with the next batch.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, top_k, future))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self.flush)
+        return future
+
+    def flush(self):
+        """
+        :return: sends the pending requests to the workers, as one chunk per worker.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if len(pending) == 0:
+            return
+
+        chunk_size = -(-len(pending) // self.workers)
+        for start in range(0, len(pending), chunk_size):
+            asyncio.ensure_future(self._score_chunk(pending[start:start + chunk_size]))
+
+    async def _score_chunk(self, chunk):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, score_batch,
+                                                 [(query, top_k) for query, top_k, _ in chunk])
+        except Exception as error:
+            for _, _, future in chunk:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, _, future), ranked in zip(chunk, results):
+            if not future.done():
+                future.set_result(ranked)
+
+    async def handle_request(self, line, writer):
+        """
+        :param line: a request line
+        :param writer: the stream the response is written to
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            top_k = request.get("top_k")
+            if not isinstance(request.get("query"), str) or (top_k is not None and not isinstance(top_k, int)):
+                raise ValueError("a request needs a string query and an optional integer top_k")
+            ranked = await self.submit(request["query"], top_k)
+            response = {"id": request_id, "results": [[doc_id, score] for doc_id, score in ranked]}
+        except Exception as error:
+            response = {"id": request_id, "error": str(error) or type(error).__name__}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(self.handle_request(line, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        """
+        :return: loads the index in the workers and serves until the task is cancelled.
+        """
+        try:
+            await self.start()
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Serving {self.index_path} on {host}:{port} with {self.workers} workers", flush=True)
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+
+def serve(index_path, host="127.0.0.1", port=8765, engine_class=QueryEngine, workers=1, batch_window=0.002):
+    """
+    :return: runs a QueryServer until it is interrupted (Ctrl+C).
+    """
+    server = QueryServer(index_path, engine_class, workers, batch_window)
+    try:
+        asyncio.run(server.serve(host, port))
+    except BrokenProcessPool:
+        print(f"The workers could not load {index_path} with {engine_class.__name__}")
+    except KeyboardInterrupt:
+        pass
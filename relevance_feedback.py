@@ -0,0 +1,54 @@
+"""
+Pseudo relevance feedback (vsm_ir.py query --feedback k): the top k documents of a query are assumed to be relevant,
+and the query vector is moved towards their centroid with Rocchio's formula before it is scored again:
+
+    expanded = ALPHA * query / |query| + BETA * mean(document vectors of the top k)
+
+Both vectors are unit vectors, so ALPHA and BETA weigh the original query against the feedback documents whatever
+their lengths. The document vectors come from the forward index saved next to the index (create_index --forward),
+so the feedback pass never goes back to the corpus. Only the EXPANSION_TERMS heaviest new terms are added to the
+query, which bounds the postings that the second pass reads.
+"""
+import math
+
+ALPHA = 1.0  # the weight of the original query
+BETA = 0.75  # the weight of the centroid of the feedback documents
+EXPANSION_TERMS = 20  # the maximal number of terms added to a query
+
+
+def expand_query(weights, query_length, document_vectors, idf, expansion_terms=EXPANSION_TERMS, alpha=ALPHA,
+                 beta=BETA):
+    """
+    :param weights: the query weights returned by QueryEngine.query_weights
+    :param query_length: the norm of the query vector returned by QueryEngine.query_weights
+    :param document_vectors: a map between a token and its weight idf * tf / document_length for every feedback
+        document, see index_storage.ForwardIndex
+    :param idf: returns the idf score of a token
+    :param expansion_terms: the maximal number of terms added to the query
+    :param alpha: the weight of the original query
+    :param beta: the weight of the centroid of the feedback documents
+    :return: (weights, query_length) of the expanded query, in the format of QueryEngine.query_weights, with every
+        token once: the tokens of the query in their order, then the added terms from the heaviest.
+    """
+    if query_length == 0 or len(document_vectors) == 0:
+        return weights, query_length
+
+    # a repeated query token is scored once per occurrence, so its component is the sum of its weights
+    expanded = dict()  # map between a token and its weight in the expanded query
+    for token, token_weight, _ in weights:
+        expanded[token] = expanded.get(token, 0.0) + alpha * token_weight / query_length
+
+    centroid = dict()  # map between a token and its weight in the centroid of the feedback documents
+    for vector in document_vectors:
+        for token, weight in vector.items():
+            centroid[token] = centroid.get(token, 0.0) + beta * weight / len(document_vectors)
+
+    new_terms = sorted((token for token in centroid if token not in expanded),
+                       key=lambda token: (-centroid[token], token))[:expansion_terms]
+    for token in list(expanded) + new_terms:
+        expanded[token] = expanded.get(token, 0.0) + centroid.get(token, 0.0)
+
+    # score_weights scores a token as token_weight * idf * tf / document_length, the token weight times the weight of
+    # the token in the document vector, so with the norm of the expanded query it computes their cosine similarity
+    expanded_weights = [(token, weight, idf(token)) for token, weight in expanded.items()]
+    return expanded_weights, math.sqrt(sum(weight ** 2 for weight in expanded.values()))
@@ -0,0 +1,170 @@
+from answer_query import QueryEngine
+from index_storage import ShardedIndex
+from phrase_query import parse_query
+from query_cache import query_key
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+
+_shard_engine = None  # the QueryEngine of the shard that the current process scores, see load_shard
+
+
+def load_shard(shard_path):
+    """
+    :param shard_path: the path of a shard file
+    :return: loads the shard once for all the queries that this process scores.
+    """
+    global _shard_engine
+    _shard_engine = QueryEngine(shard_path)
+
+
+def score_shard(queries, top_k):
+    """
+    :param queries: a list of (weights, query_length) computed by the coordinator with the idf of the whole corpus
+    :param top_k: see QueryEngine.rank
+    :return: the candidates of every query in the shard loaded by load_shard, as a list of (doc_id, score,
+        first_position). Without top_k these are the documents that pass the 0.2 x best score cutoff within the
+        shard: the best score of the whole corpus is at least the best score of the shard, so no other document of
+        the shard can pass the global cutoff. first_position is the position of the first query token whose postings
+        hold the document, which together with the doc id gives the order in which QueryEngine.score_weights first
+        sees the documents, and so the order of documents with equal scores. With top_k they are the top_k best
+        documents of the shard, with first_position 0, since documents with equal scores are ordered by doc id.
+    """
+    index = _shard_engine.index
+    results = []
+    for weights, query_length in queries:
+        if top_k is not None:
+            results.append([(doc_id, score, 0) for doc_id, score in
+                            _shard_engine.top_k_scores(weights, query_length, top_k)])
+            continue
+
+        scores = _shard_engine.score_weights(weights, query_length)
+        if len(scores) == 0:
+            results.append([])
+            continue
+        best_score = max(abs(score) for score in scores.values())
+        candidates = {doc_id: score for doc_id, score in scores.items() if abs(score) >= 0.2 * best_score}
+
+        first_positions = dict()  # map between a candidate and its first_position
+        for position, (token, _, _) in enumerate(weights):
+            if len(first_positions) == len(candidates):
+                break
+            doc_ids, _ = index.postings(token)
+            for doc_id in candidates:
+                if doc_id not in first_positions:
+                    found = bisect.bisect_left(doc_ids, doc_id)
+                    if found < len(doc_ids) and doc_ids[found] == doc_id:
+                        first_positions[doc_id] = position
+        results.append([(doc_id, score, first_positions[doc_id]) for doc_id, score in candidates.items()])
+    return results
+
+
+class ShardedQueryEngine(QueryEngine):
+    """
+    A coordinator for an index saved in shards (see InvertedIndex.save_shards). The coordinator only holds the
+    manifest: it computes the query weights with the idf of the whole corpus, scatters them to a process per shard,
+    and gathers the candidates of every shard. The 0.2 x best score cutoff is applied to the candidates of all the
+    shards with the best score of the whole corpus, and the documents are sorted exactly like QueryEngine.rank sorts
+    them, so the rankings are the same as those of the unsharded index. Batches are scattered as a single task per
+    shard.
+    """
+    executors: list  # a single process ProcessPoolExecutor per shard, that keeps the shard loaded
+
+    def __init__(self, index_path: str, cache=None):
+        super().__init__(index_path, cache)
+        if not isinstance(self.index, ShardedIndex):
+            raise ValueError(f"{index_path} is not a sharded index, create it with --shards")
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=load_shard, initargs=(shard_path,))
+                          for shard_path in self.index.shard_paths]
+
+    def rank_weights(self, weights, query_length, top_k=None):
+        return self.rank_weights_many([(weights, query_length)], top_k)[0]
+
+    def rank_scored_weights(self, weights, query_length, top_k=None):
+        return self.rank_scored_weights_many([(weights, query_length)], top_k)[0]
+
+    def rank_weights_many(self, queries, top_k=None):
+        """
+        :param queries: a list of (weights, query_length) returned by query_weights
+        :param top_k: see rank
+        :return: the ranked doc ids of every query, see rank.
+        """
+        return [[doc_id for doc_id, _ in scored] for scored in self.rank_scored_weights_many(queries, top_k)]
+
+    def rank_scored_weights_many(self, queries, top_k=None):
+        """
+        :return: see rank_weights_many, with the ranked documents as (doc_id, score) pairs.
+        """
+        if len(queries) == 0:
+            return []
+
+        with profiling.span("query.scatter_gather"):
+            futures = [executor.submit(score_shard, queries, top_k) for executor in self.executors]
+            shard_results = [future.result() for future in futures]
+
+        ranked = []
+        for query_id, (_, query_length) in enumerate(queries):
+            candidates = [candidate for results in shard_results for candidate in results[query_id]]
+            if query_length == 0 or len(candidates) == 0:
+                ranked.append([])
+                continue
+
+            if top_k is not None:
+                # ties are ordered by doc id, like QueryEngine.top_k_scores
+                candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+                candidates = candidates[:top_k]
+                best_score = abs(candidates[0][1])
+            else:
+                # ties keep the order in which QueryEngine.score_weights would have first seen the documents
+                candidates.sort(key=lambda candidate: (candidate[2], candidate[0]))
+                best_score = max(abs(score) for _, score, _ in candidates)
+                candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+            ranked.append([(doc_id, score) for doc_id, score, _ in candidates if abs(score) >= 0.2 * best_score])
+        return ranked
+
+    def rank_many(self, queries, top_k=None):
+        """
+        :param queries: a list of (query_id, query) pairs
+        :param top_k: see rank
+        :return: a map between a query id and the ranked doc ids of that query. The queries that are not in the
+            cache are scored as one batch, except for the queries with phrases or NEAR/k and the queries with feedback,
+            which are ranked one by one by the coordinator (see QueryEngine.rank_matching and rank_feedback).
+        """
+        parsed_queries = [parse_query(query) for _, query in queries]
+        weights = [self.query_weights(text) for text, _ in parsed_queries]
+        ranked = [self.rank(query, top_k) if self.feedback or constraints else None
+                  for (_, query), (_, constraints) in zip(queries, parsed_queries)]
+        if self.cache is not None:
+            keys = [query_key(query_weights, top_k) for query_weights, _ in weights]
+            ranked = [self.cache.get(self.index.index_version, key) if ranked_documents is None else ranked_documents
+                      for key, ranked_documents in zip(keys, ranked)]
+
+        missing = [i for i in range(len(queries)) if ranked[i] is None]
+        for i, ranked_documents in zip(missing, self.rank_weights_many([weights[i] for i in missing], top_k)):
+            ranked[i] = ranked_documents
+            if self.cache is not None:
+                self.cache.put(self.index.index_version, keys[i], ranked_documents)
+
+        return {query_id: ranked_documents for (query_id, _), ranked_documents in zip(queries, ranked)}
+
+    def rank_scored_many(self, queries, top_k=None):
+        """
+        :param queries: a list of user queries
+        :param top_k: see rank
+        :return: the ranked (doc_id, score) pairs of every query, see rank_scored. The queries are scored with a
+            single scatter and gather, except for the queries with phrases or NEAR/k and the queries with feedback,
+            which are ranked one by one by the coordinator, like in rank_many.
+        """
+        parsed_queries = [parse_query(query) for query in queries]
+        ranked = [self.rank_scored(query, top_k) if self.feedback or constraints else None
+                  for query, (_, constraints) in zip(queries, parsed_queries)]
+        missing = [i for i in range(len(queries)) if ranked[i] is None]
+        scored = self.rank_scored_weights_many([self.query_weights(parsed_queries[i][0]) for i in missing], top_k)
+        for i, ranked_documents in zip(missing, scored):
+            ranked[i] = ranked_documents
+        return ranked
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+        super().close()
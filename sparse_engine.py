@@ -0,0 +1,178 @@
+from answer_query import QueryEngine, check_top_k
+from phrase_query import parse_query
+import profiling
+import numpy as np
+import scipy.sparse as sp
+
+
+class SparseQueryEngine(QueryEngine):
+    """
+    A QueryEngine that scores batches of queries with sparse linear algebra. The index is loaded once into a CSR
+    term x document matrix of the final document weights idf * tf / document_length, and a batch of queries becomes
+    a CSR query x term matrix of the query weights divided by the query length, so the cosine similarities of every
+    query and document are a single sparse matrix product. The 0.2 x best score cutoff, the sort and the top-k are
+    then applied to all the queries at once. Batches are scored as a whole, so the engine does not take a cache.
+    """
+    terms: list  # the vocabulary, in the order of the matrix rows
+    term_ids: dict  # map between a token and its row in the matrix
+    doc_ids: np.ndarray  # the doc id of every matrix column, sorted
+    matrix: sp.csr_matrix  # terms x documents matrix of idf * tf / document_length
+
+    def __init__(self, index_path: str, cache=None):
+        if cache is not None:
+            raise ValueError("The sparse engine does not use a query cache, drop --cache-size and --cache-dir")
+        super().__init__(index_path)
+        self.terms = list(self.index.terms())
+        self.term_ids = {token: term_id for term_id, token in enumerate(self.terms)}
+        self.doc_ids = np.asarray(self.index.document_ids(), dtype=np.int64)
+        documents_length = np.array([self.index.document_length(doc_id) for doc_id in self.doc_ids.tolist()])
+
+        indptr = [0]
+        columns = []
+        weights = []
+        for token in self.terms:
+            doc_ids, tfs = self.index.postings(token)
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            column = np.searchsorted(self.doc_ids, doc_ids)
+            columns.append(column)
+            weights.append(self.index.idf(token) * np.asarray(tfs, dtype=np.float64) / documents_length[column])
+            indptr.append(indptr[-1] + len(doc_ids))
+
+        self.matrix = sp.csr_matrix((np.concatenate(weights) if weights else np.zeros(0),
+                                     np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64),
+                                     np.array(indptr)),
+                                    shape=(len(self.terms), len(self.doc_ids)))
+
+    def query_rows(self, queries):
+        """
+        :param queries: a list of user queries
+        :return: for every query, a map between a term id and its query weight divided by the query length, in the
+            order the terms first appear in the query. A query that repeats a token gets the weight of every
+            occurrence, like QueryEngine.score.
+        """
+        rows = []
+        for query in queries:
+            query_weights, query_length = self.query_weights(query)
+            row = dict()  # map between a term id and its weight in the query
+            if query_length > 0:
+                for token, token_weight, _ in query_weights:
+                    if token in self.term_ids:
+                        term_id = self.term_ids[token]
+                        row[term_id] = row.get(term_id, 0.0) + token_weight / query_length
+            rows.append(row)
+        return rows
+
+    def query_matrix(self, rows):
+        """
+        :param rows: the rows returned by query_rows
+        :return: a CSR queries x terms matrix of the normalized query weights.
+        """
+        indptr = [0]
+        columns = []
+        weights = []
+        for row in rows:
+            columns.extend(row.keys())
+            weights.extend(row.values())
+            indptr.append(len(columns))
+
+        return sp.csr_matrix((np.array(weights, dtype=np.float64), np.array(columns, dtype=np.int64),
+                              np.array(indptr)), shape=(len(rows), len(self.terms)))
+
+    def score_many(self, rows):
+        """
+        :param rows: the rows returned by query_rows
+        :return: a CSR queries x documents matrix of cosine similarities, see doc_ids for the doc id of each column.
+        """
+        with profiling.span("query.sparse_score"):
+            scores = (self.query_matrix(rows) @ self.matrix).tocsr()
+        profiling.count("candidates_scored", scores.nnz)
+        return scores
+
+    def first_positions(self, row, columns):
+        """
+        :param row: a row returned by query_rows
+        :param columns: columns that have a score in the row
+        :return: for every column, the position in row of the first term whose postings hold the document. Together
+            with the doc id it gives the order in which QueryEngine.score_weights first sees the documents.
+        """
+        first_terms = np.zeros(len(self.doc_ids), dtype=np.int64)
+        # the earliest term is written last, so it wins
+        for position, term_id in reversed(list(enumerate(row))):
+            first_terms[self.matrix.indices[self.matrix.indptr[term_id]:self.matrix.indptr[term_id + 1]]] = position
+        return first_terms[columns]
+
+    def rank_many(self, queries, top_k=None):
+        """
+        :param queries: a list of (query_id, query) pairs
+        :param top_k: if given, only the top_k best documents of every query are returned
+        :return: a map between a query id and the ranked doc ids of that query, see rank_scored_many.
+        """
+        ranked = self.rank_scored_many([query for _, query in queries], top_k)
+        return {query_id: [doc_id for doc_id, _ in scored] for (query_id, _), scored in zip(queries, ranked)}
+
+    def rank_scored_many(self, queries, top_k=None):
+        """
+        :param queries: a list of user queries
+        :param top_k: if given, only the top_k best documents of every query are returned
+        :return: the ranked (doc_id, score) pairs of every query, with the 0.2 x best score cutoff of
+            QueryEngine.rank. Documents with equal scores are ordered like QueryEngine.rank orders them: by doc id
+            with top_k, and otherwise in the order QueryEngine.score_weights first sees them. The queries with phrases
+            or NEAR/k (see phrase_query) only keep the documents that satisfy them. With feedback the second pass
+            depends on the first pass of every query, so the queries are ranked one by one (see
+            QueryEngine.rank_feedback).
+        """
+        check_top_k(top_k)
+        if self.feedback:
+            return [self.rank_scored(query, top_k) for query in queries]
+
+        parsed_queries = [parse_query(query) for query in queries]
+        rows = self.query_rows([text for text, _ in parsed_queries])
+        scores = self.score_many(rows)
+        scores.eliminate_zeros()
+        row_lengths = np.diff(scores.indptr)
+        query_ids = np.repeat(np.arange(len(queries)), row_lengths)  # the query of every score
+
+        matching = np.ones(len(scores.data), dtype=bool)
+        for i, (_, constraints) in enumerate(parsed_queries):
+            if constraints:
+                row = slice(scores.indptr[i], scores.indptr[i + 1])
+                documents = np.fromiter(self.matching_documents(constraints), dtype=np.int64)
+                matching[row] = np.isin(self.doc_ids[scores.indices[row]], documents)
+        absolute_scores = np.where(matching, np.abs(scores.data), 0.0)
+
+        # the best absolute score of every query, repeated for each of its documents
+        best_scores = np.zeros(len(queries))
+        np.maximum.at(best_scores, query_ids, absolute_scores)
+        keep = matching & (absolute_scores >= 0.2 * best_scores[query_ids])
+
+        columns = scores.indices[keep]
+        query_ids = query_ids[keep]
+        data = scores.data[keep]
+        # sort by query, then by descending score, then by doc id
+        order = np.lexsort((columns, -data, query_ids))
+        sorted_ids, sorted_data = query_ids[order], data[order]
+        tied = (sorted_ids[1:] == sorted_ids[:-1]) & (sorted_data[1:] == sorted_data[:-1])
+        if top_k is None and tied.any():
+            # without top_k, ties are in the order score_weights first sees the documents, which is only worked out
+            # for the queries that have ties
+            first_positions = np.zeros(len(columns), dtype=np.int64)
+            query_starts = np.searchsorted(query_ids, np.arange(len(queries) + 1))
+            for i in np.unique(sorted_ids[1:][tied]).tolist():
+                entries = slice(query_starts[i], query_starts[i + 1])
+                first_positions[entries] = self.first_positions(rows[i], columns[entries])
+            order = np.lexsort((columns, first_positions, -data, query_ids))
+        query_ids = query_ids[order]
+        ranked_doc_ids = self.doc_ids[columns[order]].tolist()
+        ranked_scores = data[order].tolist()
+
+        row_starts = np.searchsorted(query_ids, np.arange(len(queries) + 1))
+        if top_k is not None:
+            row_ends = np.minimum(row_starts[1:], row_starts[:-1] + top_k)
+        else:
+            row_ends = row_starts[1:]
+
+        return [list(zip(ranked_doc_ids[row_starts[i]:row_ends[i]], ranked_scores[row_starts[i]:row_ends[i]]))
+                for i in range(len(queries))]
+
+    def rank(self, query, top_k=None):
+        return self.rank_many([(None, query)], top_k)[None]
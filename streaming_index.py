@@ -0,0 +1,156 @@
+from aux_methods import default_tokenizer, tokenize_and_preprocess
+from index_storage import index_writer, remove_index, stems_path
+from inverted_index import iter_records
+import profiling
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+import math
+
+# rough in-memory cost of the partial postings, used to turn the memory budget into a number of postings
+BYTES_PER_POSTING = 120
+BYTES_PER_TERM = 400
+
+
+class StreamingInvertedIndex:
+    """
+    Builds the same index as InvertedIndex, to the last bit, with bounded memory (SPIMI). Records are parsed
+    incrementally, and the postings are counted in memory until they reach the memory budget, then they are written
+    to disk as a run sorted by token. After the corpus was read, the runs are merged token by token (k-way merge), and
+    every token is written to the index as soon as its postings are complete. Only per-document statistics and the
+    idf of every token are kept in memory for the whole build.
+    """
+    corpus_directory: str  # the directory in which the corpus is
+    filenames: list  # list of filenames to go through in corpus_directory
+    index_filename: str  # the name of the file to save the index to. Its extension selects the format.
+    memory_budget: int  # the number of bytes the partial postings may take before they are flushed to a run
+    temp_directory: str  # the directory in which the runs are written, None for the system default
+    num_documents: int  # the number of documents in the corpus
+    documents_length: dict  # a map between a document id and its length as a vector.
+    max_occurrences: dict  # a map between a document id and its maximal number of occurrences of a token.
+    run_paths: list  # the runs written so far, in the order they were written
+    store_weights: bool  # whether to also save the dense postings of the dense engine, binary formats only
+
+    def __init__(self, corpus_directory: str, filenames: list, index_filename: str, memory_budget: int,
+                 temp_directory: str = None, store_weights: bool = False):
+        self.corpus_directory = corpus_directory
+        self.filenames = filenames
+        self.index_filename = index_filename
+        self.memory_budget = memory_budget
+        self.temp_directory = temp_directory
+        self.store_weights = store_weights
+        self.num_documents = 0
+        self.documents_length = dict()
+        self.max_occurrences = dict()
+        self.run_paths = []
+        self._postings = dict()  # a map between a token and a map between a doc id and its number of occurrences
+        self._num_postings = 0
+
+    def process_text(self, text, doc_id):
+        """
+        :param text: text to process
+        :param doc_id: document id to whom the text belongs.
+        :return: it breaks the text to tokens and counts them in the partial postings.
+        """
+        for token in tokenize_and_preprocess(text):
+            tf_map = self._postings.get(token)
+            if tf_map is None:
+                tf_map = self._postings[token] = dict()
+            if doc_id in tf_map:
+                tf_map[doc_id] += 1
+            else:
+                tf_map[doc_id] = 1
+                self._num_postings += 1
+
+            self.max_occurrences[doc_id] = max(self.max_occurrences.get(doc_id, 0), tf_map[doc_id])
+
+    def memory_used(self):
+        """
+        :return: an estimate of the number of bytes taken by the partial postings.
+        """
+        return self._num_postings * BYTES_PER_POSTING + len(self._postings) * BYTES_PER_TERM
+
+    def flush_run(self, run_directory):
+        """
+        :param run_directory: the directory to write the run in
+        :return: writes the partial postings sorted by token to a new run, one "token<TAB>doc:count ..." line per
+            token, and clears them.
+        """
+        if len(self._postings) == 0:
+            return
+        run_path = os.path.join(run_directory, f"run_{len(self.run_paths):05d}.txt")
+        with open(run_path, "w") as run_file, profiling.span("build.flush_run"):
+            for token in sorted(self._postings):
+                postings = " ".join(f"{doc_id}:{count}" for doc_id, count in self._postings[token].items())
+                run_file.write(f"{token}\t{postings}\n")
+        self.run_paths.append(run_path)
+        self._postings = dict()
+        self._num_postings = 0
+
+    def build_inverted_index(self):
+        """
+        :return: This method creates and saves the inverted index in a file called self.index_filename, and the stems
+            of the words of the corpus next to it, like InvertedIndex.build_inverted_index.
+        """
+        run_directory = tempfile.mkdtemp(prefix="vsm_runs_", dir=self.temp_directory)
+        try:
+            with profiling.span("build.index_files"):
+                for filename in self.filenames:
+                    for doc_id, list_of_text in iter_records(os.path.join(self.corpus_directory, filename)):
+                        self.num_documents += 1
+                        self.documents_length[doc_id] = 0  # initialize the document length to 0 for afterwards
+                        for text in list_of_text:
+                            self.process_text(text, doc_id)
+
+                        if self.memory_used() >= self.memory_budget:
+                            self.flush_run(run_directory)
+            profiling.count("documents_parsed", self.num_documents)
+
+            self.flush_run(run_directory)
+            with profiling.span("build.merge_runs"):
+                self.merge_runs()
+            default_tokenizer.save_stems(stems_path(self.index_filename))
+        finally:
+            shutil.rmtree(run_directory, ignore_errors=True)
+
+    def merge_runs(self):
+        """
+        :return: merges the runs into the index. For every token it computes the idf, normalizes the tf scores by
+            the maximal number of occurrences in each document and adds them to the documents length in sorted token
+            order, like InvertedIndex.compute_idf and InvertedIndex.compute_documents_length. Like
+            InvertedIndex.save_index, the index replaces the one saved there before and every file saved next to it.
+        """
+        remove_index(self.index_filename)
+        writer = index_writer(self.index_filename, self.max_occurrences, self.store_weights)
+        run_files = [open(run_path, "r") for run_path in self.run_paths]
+        try:
+            runs = [(line.rstrip("\n").split("\t") for line in run_file) for run_file in run_files]
+            # heapq.merge is stable, so the postings of a token come in the order the runs were written
+            merged = heapq.merge(*runs, key=lambda entry: entry[0])
+            for token, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+                tf_map = dict()
+                for _, postings in entries:
+                    for posting in postings.split(" "):
+                        doc_id, count = posting.split(":")
+                        tf_map[doc_id] = tf_map.get(doc_id, 0) + int(count)
+
+                df_score = sum(tf_map.values())  # every occurrence counts, as in TokenInfo.update_token_info
+                idf_score = math.log2(self.num_documents / df_score)
+                for doc_id in tf_map:
+                    tf_normalized = tf_map[doc_id] / self.max_occurrences[doc_id]
+                    tf_map[doc_id] = tf_normalized
+                    self.documents_length[doc_id] += (idf_score * tf_normalized) ** 2
+
+                doc_ids = sorted(tf_map, key=int)
+                writer.add_term(token, idf_score, [int(doc_id) for doc_id in doc_ids],
+                                [tf_map[doc_id] for doc_id in doc_ids])
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+        for doc_id in self.documents_length.keys():
+            self.documents_length[doc_id] = math.sqrt(self.documents_length[doc_id])
+
+        writer.close(self.documents_length, self.num_documents, self.max_occurrences)
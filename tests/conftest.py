@@ -0,0 +1,48 @@
+import os
+import pytest
+from answer_query import read_queries
+from inverted_index import InvertedIndex
+
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cfc-xml")
+# two of the six corpus files keep the builds fast, and the common tokens still have more than one block of postings
+CORPUS_FILENAMES = ["cf74.xml", "cf75.xml"]
+
+
+@pytest.fixture(scope="session")
+def queries():
+    """
+    :return: the (query_id, query) pairs of cfquery.xml.
+    """
+    return read_queries(os.path.join(CORPUS_DIRECTORY, "cfquery.xml"))
+
+
+@pytest.fixture(scope="session")
+def build_index(tmp_path_factory):
+    """
+    :return: a function that builds the test corpus into an index with the given file name and InvertedIndex
+        options, and returns its path. Every index is built once per session, so tests must not modify it: a test
+        that updates or rebuilds an index builds its own with build_index_at.
+    """
+    directory = tmp_path_factory.mktemp("indexes")
+    built = dict()
+
+    def build(filename, **options):
+        key = (filename, tuple(sorted(options.items())))
+        if key not in built:
+            path = os.path.join(directory, f"{len(built)}_{filename}")
+            build_index_at(path, **options)
+            built[key] = path
+        return built[key]
+
+    return build
+
+
+def build_index_at(path, workers=1, **options):
+    """
+    :param path: the path of the index, its extension selects the format
+    :param workers: see InvertedIndex.build_inverted_index
+    :param options: the keyword arguments of InvertedIndex, e.g. num_shards or store_positions
+    :return: builds the test corpus into path.
+    """
+    InvertedIndex(CORPUS_DIRECTORY, CORPUS_FILENAMES, str(path), **options).build_inverted_index(workers=workers)
+    return str(path)
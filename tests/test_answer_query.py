@@ -0,0 +1,45 @@
+import json
+import pytest
+from answer_query import QueryEngine, answer_queries, answer_query, read_queries
+
+
+class ClosingEngine(QueryEngine):
+    """
+    Records the engines that were closed.
+    """
+    closed = []
+
+    def close(self):
+        super().close()
+        ClosingEngine.closed.append(self)
+
+
+def test_read_queries_of_cfquery(queries):
+    assert len(queries) == 99
+    assert queries[0] == ("1", "What are the effects of calcium on the physical properties of mucus from CF patients?")
+    assert queries[-1][0] == "100"
+
+
+def test_read_queries_of_a_text_file_skips_blank_lines(tmp_path):
+    (tmp_path / "queries.txt").write_text("cystic fibrosis\n\n   \n  sweat chloride test  \n\ncalcium")
+    assert read_queries(str(tmp_path / "queries.txt")) == [("1", "cystic fibrosis"), ("4", "sweat chloride test"),
+                                                           ("6", "calcium")]
+
+
+def test_answers_are_saved_and_the_engine_is_closed(build_index, tmp_path):
+    path = build_index("index.json")
+    (tmp_path / "queries.txt").write_text("cystic fibrosis\n\nsweat chloride test\n")
+    ClosingEngine.closed = []
+
+    ranked = answer_query(path, "cystic fibrosis", str(tmp_path / "ranked.txt"), engine_class=ClosingEngine)
+    assert (tmp_path / "ranked.txt").read_text() == "\n".join(str(doc_id) for doc_id in ranked)
+    results = answer_queries(path, str(tmp_path / "queries.txt"), str(tmp_path / "ranked.json"),
+                             engine_class=ClosingEngine)
+    with open(tmp_path / "ranked.json") as ranked_file:
+        assert json.load(ranked_file) == results
+    assert list(results) == ["1", "3"] and results["1"] == ranked
+    assert len(ClosingEngine.closed) == 2
+
+    with pytest.raises(ValueError, match="at least 1"):
+        answer_query(path, "cystic fibrosis", str(tmp_path / "ranked.txt"), 0, engine_class=ClosingEngine)
+    assert len(ClosingEngine.closed) == 3
@@ -0,0 +1,19 @@
+from benchmarks.run_benchmarks import compare
+
+
+def results(load_seconds, p50_seconds, queries_per_second, peak_rss_mb):
+    return {"scales": {"1": {"json": {"query": {"load_seconds": load_seconds, "p50_seconds": p50_seconds,
+                                                "queries_per_second": queries_per_second,
+                                                "peak_rss_mb": peak_rss_mb}}}}}
+
+
+def test_compare_ignores_changes_below_the_noise_floor():
+    baseline = results(0.012, 0.0005, 2000, 60)
+    assert compare(results(0.016, 0.0009, 1900, 60.5), baseline, 0.25) == []
+
+
+def test_compare_reports_relative_regressions_above_the_noise_floor():
+    baseline = results(0.012, 0.0005, 2000, 60)
+    assert compare(results(0.040, 0.0005, 1000, 90), baseline, 0.25) == [
+        ("1.json.query.load_seconds", 0.012, 0.040), ("1.json.query.peak_rss_mb", 60, 90),
+        ("1.json.query.queries_per_second", 2000, 1000)]
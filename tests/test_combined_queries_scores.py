@@ -0,0 +1,21 @@
+import json
+import os
+import pytest
+from combined_queries_scores import calculate_scores
+from conftest import CORPUS_DIRECTORY
+
+PACKAGE_DIRECTORY = os.path.dirname(CORPUS_DIRECTORY)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_evaluation_reproduces_the_shipped_scores(monkeypatch, tmp_path, workers):
+    monkeypatch.chdir(tmp_path)
+    calculate_scores(os.path.join(CORPUS_DIRECTORY, "cfquery.xml"),
+                     os.path.join(PACKAGE_DIRECTORY, "vsm_inverted_index.json"), workers)
+
+    with open(tmp_path / "combined_queries_scores.json") as scores_file, \
+            open(os.path.join(PACKAGE_DIRECTORY, "combined_queries_scores.json")) as expected_file:
+        assert json.load(scores_file) == json.load(expected_file)
+    with open(tmp_path / "query_latencies.json") as latencies_file:
+        latencies = json.load(latencies_file)
+    assert latencies["Workers"] == workers and len(latencies["Queries"]) == 99
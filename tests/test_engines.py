@@ -0,0 +1,147 @@
+import pytest
+from answer_query import QueryEngine
+from dense_engine import DenseQueryEngine
+from dynamic_pruning import max_score_top_k, pruning_pays_off
+from inverted_index import InvertedIndex
+from sharded_engine import ShardedQueryEngine
+from sparse_engine import SparseQueryEngine
+
+
+@pytest.fixture(scope="module")
+def reference(build_index, queries):
+    """
+    :return: the exhaustive rankings of every query, without and with top_k.
+    """
+    engine = QueryEngine(build_index("index.json"))
+    rankings = {top_k: engine.rank_many(queries, top_k) for top_k in (None, 10)}
+    engine.close()
+    return rankings
+
+
+@pytest.mark.parametrize("filename", ["index.bin", "index.cbin"])
+def test_binary_indexes_rank_like_the_json_index(build_index, queries, reference, filename):
+    engine = QueryEngine(build_index(filename))
+    assert engine.rank_many(queries, 10) == reference[10]
+    engine.close()
+
+
+@pytest.mark.parametrize("filename", ["index.json", "index.bin", "index.cbin"])
+@pytest.mark.parametrize("k", [1, 10, 100])
+def test_max_score_matches_exhaustive_scoring(build_index, queries, filename, k):
+    engine = QueryEngine(build_index(filename))
+    for _, query in queries:
+        weights, query_length = engine.query_weights(query)
+        scores = engine.score_weights(weights, query_length)
+        expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        assert max_score_top_k(engine.index, weights, query_length, k) == expected
+    engine.close()
+
+
+@pytest.mark.parametrize("filename", ["index.json", "index.cbin"])
+@pytest.mark.parametrize("k", [1, 10, 1000])
+def test_top_k_matches_exhaustive_scoring_with_or_without_pruning(build_index, queries, filename, k):
+    engine = QueryEngine(build_index(filename))
+    pruned = 0
+    for _, query in queries:
+        weights, query_length = engine.query_weights(query)
+        scores = engine.score_weights(weights, query_length)
+        expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        assert engine.top_k_scores(weights, query_length, k) == expected
+        pruned += pruning_pays_off(engine.index, weights, k)
+    # small k are pruned and large k are scored exhaustively
+    assert (pruned > 0) == (k < 1000)
+    engine.close()
+
+
+@pytest.mark.parametrize("engine_class,filename,options",
+                         [(QueryEngine, "index.json", {}), (SparseQueryEngine, "index.json", {}),
+                          (DenseQueryEngine, "weighted.cbin", {"store_weights": True})])
+def test_top_k_must_be_positive(build_index, engine_class, filename, options):
+    engine = engine_class(build_index(filename, **options))
+    with pytest.raises(ValueError, match="at least 1"):
+        engine.rank("cystic fibrosis", 0)
+    with pytest.raises(ValueError, match="at least 1"):
+        engine.rank_many([(1, "cystic fibrosis")], 0)
+    engine.close()
+
+
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_sparse_engine_matches_the_exhaustive_engine(build_index, queries, reference, top_k):
+    engine = SparseQueryEngine(build_index("index.json"))
+    assert engine.rank_many(queries, top_k) == reference[top_k]
+
+
+@pytest.mark.parametrize("engine_class", [SparseQueryEngine, DenseQueryEngine])
+def test_ties_are_ordered_like_the_exhaustive_engine(tmp_path, engine_class):
+    # a document that only holds one query token scores token_weight / query_length, so documents 1 and 2 tie, and
+    # the exhaustive engine sees document 2 first, from the postings of the first query token
+    records = ["sodium", "calcium", "potassium", "potassium"]
+    with open(tmp_path / "corpus.xml", "w") as corpus_file:
+        corpus_file.write("<root>" + "".join(f"<RECORD><RECORDNUM>{doc_id}</RECORDNUM><TITLE>{text}</TITLE></RECORD>"
+                                             for doc_id, text in enumerate(records, start=1)) + "</root>")
+    path = str(tmp_path / "index.cbin")
+    InvertedIndex(str(tmp_path), ["corpus.xml"], path, store_weights=True).build_inverted_index()
+
+    engine = engine_class(path)
+    exhaustive = QueryEngine(path)
+    try:
+        assert exhaustive.rank("calcium sodium") == [2, 1]
+        assert engine.rank("calcium sodium") == [2, 1]
+        assert exhaustive.rank("calcium sodium", 2) == engine.rank("calcium sodium", 2) == [1, 2]
+    finally:
+        engine.close()
+        exhaustive.close()
+
+
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_dense_engine_matches_the_exhaustive_engine(build_index, queries, reference, top_k):
+    engine = DenseQueryEngine(build_index("weighted.cbin", store_weights=True))
+    assert engine.rank_many(queries, top_k) == reference[top_k]
+    engine.close()
+
+
+@pytest.mark.parametrize("filename", ["weighted.bin", "weighted.cbin"])
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_dense_engine_scores_like_the_exhaustive_engine(build_index, queries, filename, top_k):
+    path = build_index(filename, store_weights=True)
+    engine = DenseQueryEngine(path)
+    exhaustive = QueryEngine(path)
+    for _, query in queries:
+        # the scores are equal to the last bit, so near ties are ranked alike too
+        assert engine.rank_scored(query, top_k) == exhaustive.rank_scored(query, top_k)
+    engine.close()
+    exhaustive.close()
+
+
+def test_dense_engine_needs_dense_postings(build_index):
+    with pytest.raises(ValueError, match="--weights"):
+        DenseQueryEngine(build_index("index.cbin"))
+
+
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_sharded_engine_matches_the_unsharded_index(build_index, queries, reference, top_k):
+    engine = ShardedQueryEngine(build_index("sharded.json", num_shards=3))
+    try:
+        assert engine.rank_many(queries, top_k) == reference[top_k]
+        query_id, query = queries[0]
+        assert engine.rank(query, top_k) == reference[top_k][query_id]
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("engine_class,filename,options",
+                         [(QueryEngine, "index.json", {}), (SparseQueryEngine, "index.json", {}),
+                          (ShardedQueryEngine, "sharded.json", {"num_shards": 3})])
+@pytest.mark.parametrize("top_k", [None, 10])
+def test_batches_are_scored_like_single_queries(build_index, queries, engine_class, filename, options, top_k):
+    engine = engine_class(build_index(filename, **options))
+    exhaustive = QueryEngine(build_index("index.json"))
+    try:
+        texts = [query for _, query in queries]
+        for ranked, query in zip(engine.rank_scored_many(texts, top_k), texts):
+            expected = exhaustive.rank_scored(query, top_k)
+            assert [doc_id for doc_id, _ in ranked] == [doc_id for doc_id, _ in expected]
+            assert [score for _, score in ranked] == pytest.approx([score for _, score in expected], rel=1e-9)
+    finally:
+        engine.close()
+        exhaustive.close()
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import pytest
+from benchmarks.import_budget import ACTIONS, COMMANDS, REPOSITORY, measure, measure_command
+
+# multiplies every budget, for slow machines
+SCALE = float(os.environ.get("VSM_BUDGET_SCALE", "1"))
+
+
+@pytest.mark.parametrize("action", list(ACTIONS))
+def test_action_imports_within_budget(action):
+    modules, budget, forbidden = ACTIONS[action]
+    milliseconds, loaded = measure(modules, 3)
+    assert [module for module in forbidden if module in loaded] == []
+    assert milliseconds <= budget * SCALE
+
+
+@pytest.mark.parametrize("command", list(COMMANDS))
+def test_command_runs_within_budget(command):
+    arguments, budget = COMMANDS[command]
+    assert measure_command(arguments, 3) <= budget * SCALE
+
+
+def test_query_of_known_words_does_not_import_nltk(tmp_path):
+    # the words of the query are in the stems saved next to the index that ships with the repository
+    arguments = ["vsm_ir.py", "query", os.path.join(REPOSITORY, "vsm_inverted_index.json"), "cystic fibrosis"]
+    code = f"import sys; sys.argv = {arguments!r}; import vsm_ir; vsm_ir.parse_cmd_line(); print('nltk' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=REPOSITORY),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.splitlines()[-1] == "False"
+    assert os.path.getsize(tmp_path / "ranked_query_docs.txt") > 0
+
+
+def test_stemmer_is_loaded_with_the_engine(build_index):
+    import aux_methods
+    import query_server
+    aux_methods.default_tokenizer.stemmer = None
+    query_server.load_engine(query_server.QueryEngine, build_index("index.json"))
+    assert aux_methods.default_tokenizer.stemmer is not None
@@ -0,0 +1,94 @@
+import json
+import os
+import pytest
+import vsm_ir
+from incremental_index import IncrementalIndex
+from index_storage import BinaryIndex, LazyJsonIndex, delta_directory, load_index
+from inverted_index import InvertedIndex
+from conftest import CORPUS_DIRECTORY, CORPUS_FILENAMES, build_index_at
+
+
+def assert_same_postings(index, reference):
+    assert list(index.document_ids()) == list(reference.document_ids())
+    assert list(index.terms()) == list(reference.terms())
+    for doc_id in reference.document_ids():
+        assert index.document_length(doc_id) == reference.document_length(doc_id)
+    for token in reference.terms():
+        assert list(index.postings(token)[0]) == list(reference.postings(token)[0])
+        assert list(index.postings(token)[1]) == list(reference.postings(token)[1])
+        assert index.idf(token) == reference.idf(token)
+
+
+@pytest.mark.parametrize("filename", ["index.json", "index.cbin"])
+def test_added_file_matches_a_full_build(tmp_path, filename):
+    path = build_index_at(tmp_path / filename)
+    IncrementalIndex(path).add_files([os.path.join(CORPUS_DIRECTORY, "cf76.xml")])
+
+    reference_path = str(tmp_path / f"reference_{filename}")
+    InvertedIndex(CORPUS_DIRECTORY, CORPUS_FILENAMES + ["cf76.xml"], reference_path).build_inverted_index()
+    index, reference = load_index(path), load_index(reference_path)
+    assert_same_postings(index, reference)
+    assert index.index_version == reference.index_version
+
+
+def test_deleted_documents_are_dropped_and_compaction_keeps_the_updates(tmp_path):
+    path = build_index_at(tmp_path / "index.json")
+    index = IncrementalIndex(path)
+    index.delete_documents(["1", "2", "3"])
+
+    merged = load_index(path)
+    assert merged.num_documents == 352
+    assert not {1, 2, 3} & set(merged.document_ids())
+    assert all(not {1, 2, 3} & set(merged.postings(token)[0]) for token in merged.terms())
+
+    index.compact()
+    assert not os.path.isdir(delta_directory(path))
+    assert_same_postings(load_index(path), merged)
+
+
+@pytest.mark.parametrize("filename,reader_class", [("index.json", LazyJsonIndex), ("index.cbin", BinaryIndex)])
+def test_the_merged_index_is_saved_until_the_next_update(tmp_path, filename, reader_class):
+    path = build_index_at(tmp_path / filename)
+    index = IncrementalIndex(path)
+    index.delete_documents(["1"])
+    assert isinstance(load_index(path), reader_class)
+    merged_path = index.merged_path()
+    modified = os.stat(merged_path).st_mtime_ns
+    assert load_index(path).num_documents == 354 and os.stat(merged_path).st_mtime_ns == modified
+
+    index.delete_documents(["2"])
+    assert load_index(path).num_documents == 353
+    assert not os.path.exists(merged_path) and os.path.exists(index.merged_path())
+
+
+def test_an_index_without_max_occurrences_is_not_updated(tmp_path, monkeypatch, capsys):
+    path = build_index_at(tmp_path / "index.json")
+    with open(path, "r") as index_file:
+        index_data = json.load(index_file)
+    del index_data["max_occurrences"]
+    with open(path, "w") as index_file:
+        json.dump(index_data, index_file)
+
+    with pytest.raises(ValueError, match="max_occurrences"):
+        IncrementalIndex(path).delete_documents(["1"])
+    monkeypatch.setattr(vsm_ir.sys, "argv", ["vsm_ir.py", "update_index", path, "--delete", "1", "--compact"])
+    vsm_ir.parse_cmd_line()
+    assert "max_occurrences" in capsys.readouterr().out
+    assert not os.path.isdir(delta_directory(path)) and load_index(path).num_documents == 355
+
+
+def test_a_sharded_index_is_not_updated(tmp_path):
+    path = build_index_at(tmp_path / "index.json", num_shards=2)
+    with pytest.raises(ValueError, match="sharded"):
+        IncrementalIndex(path).add_files([os.path.join(CORPUS_DIRECTORY, "cf76.xml")])
+    assert not os.path.isdir(delta_directory(path))
+
+
+def test_a_new_build_drops_the_segments_of_the_old_index(tmp_path):
+    path = build_index_at(tmp_path / "index.json")
+    IncrementalIndex(path).delete_documents(["1"])
+    build_index_at(path)
+
+    assert not os.path.isdir(delta_directory(path))
+    index = load_index(path)
+    assert index.num_documents == 355 and 1 in set(index.document_ids())
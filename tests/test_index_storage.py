@@ -0,0 +1,102 @@
+import json
+import os
+import pytest
+from index_storage import (BinaryIndex, JsonIndex, LazyJsonIndex, delta_directory, forward_path, load_index,
+                           positions_path, shard_directory, stems_path)
+from streaming_index import StreamingInvertedIndex
+from conftest import CORPUS_DIRECTORY, CORPUS_FILENAMES, build_index_at
+
+
+def assert_same_index(index, reference, tolerance=0.0):
+    assert index.num_documents == reference.num_documents
+    assert list(index.terms()) == list(reference.terms())
+    assert list(index.document_ids()) == list(reference.document_ids())
+    for doc_id in reference.document_ids():
+        assert index.document_length(doc_id) == reference.document_length(doc_id)
+        assert index.max_occurrence(doc_id) == reference.max_occurrence(doc_id)
+    for token in reference.terms():
+        doc_ids, tfs = index.postings(token)
+        reference_doc_ids, reference_tfs = reference.postings(token)
+        assert list(doc_ids) == list(reference_doc_ids)
+        assert list(tfs) == pytest.approx(list(reference_tfs), rel=tolerance, abs=0)
+        assert index.idf(token) == reference.idf(token)
+
+
+@pytest.mark.parametrize("filename", ["index.bin", "index.cbin"])
+def test_binary_formats_hold_the_json_index(build_index, filename):
+    reference = load_index(build_index("index.json"))
+    index = load_index(build_index(filename))
+    assert isinstance(index, BinaryIndex)
+    # the plain binary format stores the tf scores as float32
+    assert_same_index(index, reference, tolerance=1e-6 if filename == "index.bin" else 0.0)
+    assert index.index_version == reference.index_version
+
+
+def test_binary_index_rejects_unknown_documents(build_index):
+    index = load_index(build_index("index.cbin"))
+    with pytest.raises(KeyError):
+        index.document_length(100000)
+    with pytest.raises(KeyError):
+        index.max_occurrence(100000)
+
+
+def test_json_index_is_read_lazily_through_its_term_table(build_index):
+    path = build_index("index.json")
+    index = load_index(path)
+    assert isinstance(index, LazyJsonIndex)
+    assert_same_index(index, JsonIndex(path))
+    index.close()
+
+
+@pytest.mark.parametrize("filename", ["weighted.bin", "weighted.cbin"])
+def test_dense_postings_are_the_postings_of_the_index(build_index, filename):
+    index = load_index(build_index(filename, store_weights=True))
+    document_ids = list(index.document_ids())
+    for token in ["cystic", "pseudomona", "sweat"]:
+        doc_ids, tfs = index.postings(token)
+        doc_positions, weights = index.weighted_postings(token)
+        assert [document_ids[position] for position in doc_positions] == list(doc_ids)
+        assert list(weights) == list(tfs)
+    assert [len(postings) for postings in index.weighted_postings("notaterm")] == [0, 0]
+
+
+@pytest.mark.parametrize("filename", ["index.json", "index.cbin"])
+def test_streaming_build_matches_the_in_memory_build(build_index, tmp_path, filename):
+    path = str(tmp_path / filename)
+    # a small budget spills several runs
+    StreamingInvertedIndex(CORPUS_DIRECTORY, CORPUS_FILENAMES, path, 200000).build_inverted_index()
+    index = load_index(path)
+    reference = load_index(build_index(filename))
+    assert_same_index(index, reference)
+    assert index.index_version == reference.index_version
+
+
+def test_parallel_build_is_identical_to_the_serial_build(build_index):
+    serial = build_index("serial.json")
+    parallel = build_index("parallel.json", workers=2)
+    with open(serial, "rb") as serial_file, open(parallel, "rb") as parallel_file:
+        assert serial_file.read() == parallel_file.read()
+
+
+def build_with_every_sidecar(path):
+    build_index_at(path, num_shards=2, store_positions=True, store_forward=True)
+    # a sharded index cannot be updated, the segment stands for one left over by an index saved there before
+    os.makedirs(delta_directory(path))
+    with open(os.path.join(delta_directory(path), "segment_000000.json"), "w") as segment_file:
+        json.dump({"documents": {}, "deleted": ["1"]}, segment_file)
+    assert all(os.path.exists(sidecar) for sidecar in (shard_directory(path), delta_directory(path),
+                                                       positions_path(path), forward_path(path), stems_path(path)))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_a_new_index_replaces_every_file_of_the_old_one(tmp_path, streaming):
+    path = str(tmp_path / "index.cbin")
+    build_with_every_sidecar(path)
+    if streaming:
+        StreamingInvertedIndex(CORPUS_DIRECTORY, CORPUS_FILENAMES, path, 200000).build_inverted_index()
+    else:
+        build_index_at(path)
+
+    assert sorted(os.listdir(tmp_path)) == ["index.cbin", "index.cbin.stems"]
+    index = load_index(path)
+    assert isinstance(index, BinaryIndex) and index.num_documents == 355
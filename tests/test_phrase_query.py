@@ -0,0 +1,102 @@
+import pytest
+from answer_query import QueryEngine
+from inverted_index import InvertedIndex
+from phrase_query import Near, Phrase, parse_query
+from sharded_engine import ShardedQueryEngine
+from conftest import CORPUS_DIRECTORY, CORPUS_FILENAMES
+
+QUERIES = ['"cystic fibrosis" patients',
+           '"sweat chloride" test',
+           'pancreatic NEAR/5 insufficiency',
+           '"pseudomonas aeruginosa" NEAR/10 antibodies',
+           '"effects of the calcium" mucus']
+
+
+@pytest.fixture(scope="module")
+def token_positions():
+    """
+    :return: a map between a token and a map between a doc id and its positions, recorded in memory.
+    """
+    index = InvertedIndex(CORPUS_DIRECTORY, CORPUS_FILENAMES, None, store_positions=True)
+    for filename in CORPUS_FILENAMES:
+        index.index_file(filename)
+    return {token: {int(doc_id): positions for doc_id, positions in token_info.positions_map.items()}
+            for token, token_info in index.index_term_hash.items()}
+
+
+def phrase_starts(token_positions, doc_id, tokens):
+    positions = [set(token_positions.get(token, dict()).get(doc_id, [])) for token in tokens]
+    return [start for start in positions[0] if all(start + offset in positions[offset]
+                                                    for offset in range(1, len(tokens)))]
+
+
+def brute_force(token_positions, constraint, doc_id):
+    if isinstance(constraint, Phrase):
+        return len(phrase_starts(token_positions, doc_id, constraint.tokens)) > 0
+    left = phrase_starts(token_positions, doc_id, constraint.left.tokens)
+    right = phrase_starts(token_positions, doc_id, constraint.right.tokens)
+    return any(0 < right_start - (left_start + len(constraint.left.tokens) - 1) <= constraint.k or
+               0 < left_start - (right_start + len(constraint.right.tokens) - 1) <= constraint.k
+               for left_start in left for right_start in right)
+
+
+def test_parse_query():
+    assert parse_query("effects of calcium") == ("effects of calcium", [])
+    assert parse_query('"calcium" mucus') == ('"calcium" mucus', [])
+
+    text, constraints = parse_query('"sweat chloride" NEAR/3 test')
+    assert text.split() == ['"sweat', 'chloride"', "test"]
+    assert len(constraints) == 1 and isinstance(constraints[0], Near)
+    assert constraints[0].left.tokens == ["sweat", "chlorid"] and constraints[0].k == 3
+
+
+@pytest.mark.parametrize("query", ["the NEAR/3 calcium", "calcium NEAR/3", "NEAR/3 calcium"])
+def test_near_operators_without_a_constraint_are_not_scored(query):
+    text, constraints = parse_query(query)
+    assert constraints == [] and "NEAR" not in text and "calcium" in text
+
+
+@pytest.mark.parametrize("engine_class,filename,options", [(QueryEngine, "index.json", {}),
+                                                           (ShardedQueryEngine, "sharded.json", {"num_shards": 3})])
+def test_near_operators_without_a_constraint_rank_like_the_plain_query(build_index, engine_class, filename,
+                                                                         options):
+    engine = engine_class(build_index(filename, **options))
+    try:
+        assert engine.rank("the NEAR/3 calcium") == engine.rank("the calcium")
+        assert engine.rank_many([(1, "calcium NEAR/3")], 10) == {1: engine.rank("calcium", 10)}
+        assert engine.rank_scored_many(["NEAR/3 calcium"]) == [engine.rank_scored("calcium")]
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("filename,options", [("positions.json", {"store_positions": True}),
+                                              ("sharded_positions.cbin", {"store_positions": True,
+                                                                          "num_shards": 2})])
+def test_matching_documents_match_a_brute_force_scan(build_index, token_positions, filename, options):
+    engine = QueryEngine(build_index(filename, **options))
+    document_ids = list(engine.index.document_ids())
+    for query in QUERIES:
+        _, constraints = parse_query(query)
+        expected = {doc_id for doc_id in document_ids
+                    if all(brute_force(token_positions, constraint, doc_id) for constraint in constraints)}
+        assert engine.matching_documents(constraints) == expected
+    engine.close()
+
+
+@pytest.mark.parametrize("top_k", [None, 5])
+def test_phrase_queries_rank_the_matching_documents_by_score(build_index, top_k):
+    engine = QueryEngine(build_index("positions.json", store_positions=True))
+    for query in QUERIES:
+        text, constraints = parse_query(query)
+        documents = engine.matching_documents(constraints)
+        scores = {doc_id: score for doc_id, score in engine.score(text).items() if doc_id in documents}
+        ranked = engine.rank(query, top_k)
+        assert set(ranked) <= documents
+        assert [scores[doc_id] for doc_id in ranked] == sorted((scores[doc_id] for doc_id in ranked), reverse=True)
+    engine.close()
+
+
+def test_phrase_queries_need_positions(build_index):
+    engine = QueryEngine(build_index("index.json"))
+    with pytest.raises(ValueError, match="--positions"):
+        engine.rank('"cystic fibrosis"')
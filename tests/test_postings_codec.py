@@ -0,0 +1,37 @@
+import random
+import postings_codec
+
+
+def test_varints_round_trip():
+    values = [0, 1, 127, 128, 300, 2 ** 21, 2 ** 35 + 7]
+    encoded = bytearray()
+    postings_codec.encode_varints(values, encoded)
+    assert postings_codec.decode_varints(encoded, 0, len(values)) == (values, len(encoded))
+
+
+def test_postings_round_trip_over_several_blocks():
+    generator = random.Random(7)
+    doc_ids = sorted(generator.sample(range(1, 100000), 3 * postings_codec.BLOCK_SIZE + 5))
+    counts = [generator.randint(1, 40) for _ in doc_ids]
+    encoded = postings_codec.encode_postings(doc_ids, counts)
+
+    assert postings_codec.decode_postings(encoded, len(doc_ids)) == (doc_ids, counts)
+    assert postings_codec.block_last_doc_ids(encoded, len(doc_ids)) == \
+        [doc_ids[min(end, len(doc_ids)) - 1] for end in range(postings_codec.BLOCK_SIZE, len(doc_ids) + 128, 128)]
+    last_block = postings_codec.num_blocks(len(doc_ids)) - 1
+    assert postings_codec.decode_block(encoded, len(doc_ids), last_block) == \
+        (doc_ids[last_block * postings_codec.BLOCK_SIZE:], counts[last_block * postings_codec.BLOCK_SIZE:])
+
+
+def test_positional_postings_round_trip():
+    generator = random.Random(11)
+    doc_ids = sorted(generator.sample(range(1, 5000), postings_codec.BLOCK_SIZE + 3))
+    positions = [sorted(generator.sample(range(0, 500), generator.randint(1, 6))) for _ in doc_ids]
+    encoded = postings_codec.encode_positional_postings(doc_ids, positions)
+
+    decoded_doc_ids, decoded_positions = [], []
+    for block in range(postings_codec.num_blocks(len(doc_ids))):
+        block_doc_ids, block_positions = postings_codec.decode_positional_block(encoded, len(doc_ids), block)
+        decoded_doc_ids.extend(block_doc_ids)
+        decoded_positions.extend(block_positions)
+    assert (decoded_doc_ids, decoded_positions) == (doc_ids, positions)
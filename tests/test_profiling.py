@@ -0,0 +1,17 @@
+import profiling
+from aux_methods import Tokenizer
+
+
+def test_tokenizing_records_totals_instead_of_a_span_per_text():
+    profiler = profiling.enable()
+    try:
+        tokenizer = Tokenizer()
+        for _ in range(100):
+            tokenizer.tokenize("Effects of calcium on the mucus of cystic fibrosis patients")
+    finally:
+        profiling.disable()
+    assert profiler.spans == []
+    assert profiler.counters["texts_tokenized"] == 100
+    assert profiler.counters["tokens_emitted"] == 600
+    assert profiler.counters["tokenize_seconds"] > 0
+    assert "tokenize_seconds" in profiler.summary_table()
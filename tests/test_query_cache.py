@@ -0,0 +1,73 @@
+import os
+import pytest
+from answer_query import QueryEngine
+from query_cache import QueryResultCache, query_key
+from sparse_engine import SparseQueryEngine
+
+
+def test_query_key_ignores_the_order_of_the_tokens(build_index):
+    engine = QueryEngine(build_index("index.json"))
+    key = query_key(engine.query_weights("sweat chloride test")[0])
+    assert query_key(engine.query_weights("test sweat chloride")[0]) == key
+    assert query_key(engine.query_weights("tests of the chlorides in sweat")[0]) == key
+    assert query_key(engine.query_weights("sweat sweat chloride test")[0]) != key
+    assert query_key(engine.query_weights("sweat chloride test")[0], 10) != key
+
+
+def test_memory_tier_evicts_the_least_recently_used_result():
+    cache = QueryResultCache(capacity=2)
+    cache.put("v1", "a", [1])
+    cache.put("v1", "b", [2])
+    assert cache.get("v1", "a") == [1]
+    cache.put("v1", "c", [3])
+    assert cache.get("v1", "b") is None
+    assert cache.get("v1", "a") == [1] and cache.get("v1", "c") == [3]
+    assert cache.stats() == {"hits": 3, "disk_hits": 0, "misses": 1, "evictions": 1,
+                             "disk_evictions": 0, "size": 2}
+
+
+def test_directory_tier_survives_the_process_and_drops_old_versions(tmp_path):
+    QueryResultCache(directory=str(tmp_path)).put("v1", "a", [3, 1, 2])
+
+    cache = QueryResultCache(directory=str(tmp_path))
+    assert cache.get("v1", "a") == [3, 1, 2]
+    assert cache.disk_hits == 1
+    assert cache.get("v2", "a") is None
+    assert QueryResultCache(directory=str(tmp_path)).get("v1", "a") is None
+
+
+def test_new_versions_only_delete_the_results_of_the_cache(tmp_path):
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes" / "todo.txt").write_text("keep me")
+    (tmp_path / "index.json").write_text("{}")
+    QueryResultCache(directory=str(tmp_path)).put("v1", "a", [1])
+    QueryResultCache(directory=str(tmp_path)).put("v2", "a", [2])
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["index.json", "notes", "v2"]
+    assert (tmp_path / "notes" / "todo.txt").read_text() == "keep me"
+
+
+def test_directory_tier_evicts_the_least_recently_used_results(tmp_path):
+    cache = QueryResultCache(capacity=1, directory=str(tmp_path), disk_capacity=8)
+    for number in range(8):
+        cache.put("v1", str(number), [number])
+        os.utime(tmp_path / "v1" / f"{number}.json", (number, number))
+    # a disk hit makes 0 the most recently used result
+    assert QueryResultCache(directory=str(tmp_path)).get("v1", "0") == [0]
+    cache.put("v1", "8", [8])
+
+    assert cache.disk_evictions == 2
+    assert sorted(path.stem for path in (tmp_path / "v1").glob("*.json")) == ["0", "3", "4", "5", "6", "7", "8"]
+
+
+def test_cached_rankings_equal_the_uncached_rankings(build_index, queries, tmp_path):
+    path = build_index("index.json")
+    expected = QueryEngine(path).rank_many(queries, 10)
+    for _ in range(2):
+        engine = QueryEngine(path, QueryResultCache(directory=str(tmp_path)))
+        assert engine.rank_many(queries, 10) == expected
+    assert engine.cache.misses == 0 and engine.cache.disk_hits == len(set(expected))
+
+
+def test_the_sparse_engine_rejects_a_cache(build_index, tmp_path):
+    with pytest.raises(ValueError, match="--cache-size"):
+        SparseQueryEngine(build_index("index.json"), QueryResultCache(directory=str(tmp_path)))
@@ -0,0 +1,9 @@
+import query_server
+from sparse_engine import SparseQueryEngine
+
+
+def test_score_batch_keeps_the_order_of_the_requests(build_index, queries):
+    query_server.load_engine(SparseQueryEngine, build_index("index.json"))
+    requests = [(query, [None, 5, 10][i % 3]) for i, (_, query) in enumerate(queries[:30])]
+    assert query_server.score_batch(requests) == [query_server._engine.rank_scored_many([query], top_k)[0]
+                                                  for query, top_k in requests]
@@ -0,0 +1,52 @@
+import pytest
+from answer_query import QueryEngine
+from index_storage import ForwardIndex, forward_path, load_index
+from relevance_feedback import expand_query
+
+
+def test_forward_index_holds_the_normalized_weights_of_every_document(build_index):
+    path = build_index("forward.json", store_forward=True)
+    index = load_index(path)
+    forward_index = ForwardIndex(forward_path(path))
+    assert forward_index.index_version == index.index_version
+
+    vectors = {doc_id: dict() for doc_id in index.document_ids()}
+    for token in index.terms():
+        for doc_id, tf in zip(*index.postings(token)):
+            vectors[doc_id][token] = index.idf(token) * tf / index.document_length(doc_id)
+    for doc_id, vector in vectors.items():
+        term_ids, weights = forward_index.document_vector(doc_id)
+        assert [forward_index.term(term_id) for term_id in term_ids] == sorted(vector)
+        # the weights are stored as float32
+        assert list(weights) == pytest.approx([vector[token] for token in sorted(vector)], rel=1e-6)
+    forward_index.close()
+
+
+def test_expanded_query_keeps_the_query_tokens_first():
+    weights = [("calcium", 2.0, 1.0), ("mucu", 1.0, 2.0), ("calcium", 2.0, 1.0)]
+    vectors = [{"calcium": 0.5, "sweat": 0.4, "chlorid": 0.1}, {"sweat": 0.2, "gene": 0.8}]
+    expanded, query_length = expand_query(weights, 3.0, vectors, lambda token: 1.0, expansion_terms=2)
+    assert [token for token, _, _ in expanded] == ["calcium", "mucu", "gene", "sweat"]
+    assert query_length == pytest.approx(sum(weight ** 2 for _, weight, _ in expanded) ** 0.5)
+    assert expand_query(weights, 3.0, [], lambda token: 1.0) == (weights, 3.0)
+
+
+def test_feedback_expands_the_query(build_index, queries):
+    engine = QueryEngine(build_index("forward.json", store_forward=True))
+    baseline = {query_id: engine.rank(query, 10) for query_id, query in queries}
+
+    engine.feedback = 0
+    assert {query_id: engine.rank(query, 10) for query_id, query in queries} == baseline
+
+    engine.feedback = 3
+    expanded = {query_id: engine.rank(query, 10) for query_id, query in queries}
+    assert all(len(ranked) <= 10 for ranked in expanded.values())
+    assert expanded != baseline
+    engine.close()
+
+
+def test_feedback_needs_the_forward_index(build_index, queries):
+    engine = QueryEngine(build_index("index.json"))
+    engine.feedback = 3
+    with pytest.raises(ValueError, match="--forward"):
+        engine.rank(queries[0][1])
@@ -0,0 +1,79 @@
+import json
+import os
+import pytest
+import aux_methods
+import inverted_index
+from nltk.stem import PorterStemmer
+from aux_methods import Tokenizer, has_numbers, punctuation, remove_punctuation, stopwords_set
+from index_storage import stems_path
+from inverted_index import iter_records
+from conftest import CORPUS_DIRECTORY, CORPUS_FILENAMES, build_index_at
+
+TEXTS = ["What are the effects of CALCIUM on the physical properties of mucus from CF patients?",
+         "It's a 1970's trial: (n=12) patients; sweat-chloride > 60 mEq/l...",
+         "  \t  ", "!?.,", "Pseudomonas aeruginosa, P. aeruginosa and Pseudomonas."]
+
+
+def original_tokenize_and_preprocess(text):
+    """
+    :return: the tokens of text, as aux_methods.tokenize_and_preprocess computed them before Tokenizer.
+    """
+    text = remove_punctuation(text).lower()
+    list_words = text.split()
+    ps = PorterStemmer()
+    return [ps.stem(word) for word in list_words
+            if word not in stopwords_set and word != "" and not has_numbers(word)
+            and not word.isspace() and word not in punctuation]
+
+
+@pytest.fixture(scope="module")
+def corpus_texts():
+    return TEXTS + [text for filename in CORPUS_FILENAMES
+                    for _, list_of_text in iter_records(os.path.join(CORPUS_DIRECTORY, filename))
+                    for text in list_of_text]
+
+
+@pytest.mark.parametrize("cache_size", [65536, 64])
+def test_tokens_are_the_tokens_of_the_original_implementation(corpus_texts, cache_size):
+    tokenizer = Tokenizer(cache_size)
+    for text in corpus_texts:
+        assert tokenizer.tokenize(text) == original_tokenize_and_preprocess(text)
+    # a small cache evicts words, and tokenizes them again when they come back
+    assert (tokenizer.evictions > 0) == (cache_size == 64)
+    assert len(tokenizer.cache) <= cache_size and tokenizer.hits > 0
+
+
+def test_tokenize_many_tokenizes_every_text():
+    tokenizer = Tokenizer()
+    assert list(tokenizer.tokenize_many(TEXTS)) == [original_tokenize_and_preprocess(text) for text in TEXTS]
+    assert tokenizer.texts == len(TEXTS)
+
+
+def test_saved_stems_spare_the_stemmer(tmp_path, corpus_texts):
+    tokenizer = Tokenizer()
+    tokens = [tokenizer.tokenize(text) for text in corpus_texts]
+    path = str(tmp_path / "stems.json")
+    tokenizer.save_stems(path)
+
+    loaded = Tokenizer()
+    loaded.load_stems(path)
+    assert [loaded.tokenize(text) for text in corpus_texts] == tokens
+    assert loaded.stemmer is None
+    # a word that is not in the stems is stemmed
+    assert loaded.tokenize("fibrosises") == original_tokenize_and_preprocess("fibrosises")
+    assert loaded.stemmer is not None
+
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_a_build_saves_the_stems_of_the_corpus(tmp_path, monkeypatch, corpus_texts, workers):
+    # a fresh tokenizer, so that the stems only come from the build, in the workers with more than one
+    monkeypatch.setattr(aux_methods, "default_tokenizer", Tokenizer())
+    monkeypatch.setattr(inverted_index, "default_tokenizer", aux_methods.default_tokenizer)
+    path = build_index_at(tmp_path / "index.json", workers)
+
+    expected = Tokenizer()
+    for text in corpus_texts[len(TEXTS):]:
+        expected.tokenize(text)
+    with open(stems_path(path), "r") as stems_file:
+        assert json.load(stems_file) == expected.stem_table()
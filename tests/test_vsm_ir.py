@@ -0,0 +1,45 @@
+import json
+import os
+import pytest
+import vsm_ir
+from answer_query import QueryEngine, read_queries
+from conftest import CORPUS_DIRECTORY
+
+
+def run(monkeypatch, capsys, *args):
+    monkeypatch.setattr(vsm_ir.sys, "argv", ["vsm_ir.py", *args])
+    vsm_ir.parse_cmd_line()
+    return capsys.readouterr().out
+
+
+def test_top_k_must_be_positive(monkeypatch, capsys, build_index):
+    assert run(monkeypatch, capsys, "query", build_index("index.json"), "cystic fibrosis", "--top-k", "0") == \
+        "--top-k must be at least 1\n"
+
+
+def test_queries_print_the_missing_sidecar(monkeypatch, capsys, tmp_path, build_index):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "queries.txt").write_text("cystic fibrosis\n")
+    path = build_index("index.cbin")
+    assert "--weights" in run(monkeypatch, capsys, "query", path, "cystic fibrosis", "--engine", "dense")
+    assert "--positions" in run(monkeypatch, capsys, "query", path, '"cystic fibrosis"')
+    assert "--forward" in run(monkeypatch, capsys, "batch_query", path, "queries.txt", "--feedback", "3")
+    assert "--shards" in run(monkeypatch, capsys, "serve", path, "--engine", "sharded")
+    assert "--weights" in run(monkeypatch, capsys, "serve", path, "--engine", "dense", "--port", "0")
+
+
+@pytest.mark.parametrize("queries_filename", ["cfquery.xml", "queries.txt"])
+def test_batch_query_ranks_every_query(monkeypatch, capsys, tmp_path, build_index, queries_filename):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "queries.txt").write_text("\ncystic fibrosis\n\nsweat chloride test\n")
+    queries_path = os.path.join(CORPUS_DIRECTORY, "cfquery.xml") if queries_filename == "cfquery.xml" \
+        else "queries.txt"
+    path = build_index("index.json")
+    assert run(monkeypatch, capsys, "batch_query", path, queries_path, "--top-k", "10") == ""
+
+    with open(tmp_path / "ranked_batch_query_docs.json") as results_file:
+        results = json.load(results_file)
+    engine = QueryEngine(path)
+    assert results == engine.rank_many(read_queries(queries_path), 10)
+    assert len(results) == (99 if queries_filename == "cfquery.xml" else 2)
+    engine.close()
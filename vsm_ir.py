@@ -1,35 +1,200 @@
+import importlib
 import sys
-import inverted_index
-from answer_query import answer_query
+import profiling
+
+# the engines query, batch_query and serve can score with, as (module, class) names. Every action only imports the
+# modules it needs, since startup is a large part of the latency of a single query: numpy, scipy and nltk take more
+# than a second to import, while the exhaustive engine needs none of them until it stems the query.
+ENGINES = {"exhaustive": ("answer_query", "QueryEngine"), "sparse": ("sparse_engine", "SparseQueryEngine"),
+           "sharded": ("sharded_engine", "ShardedQueryEngine"), "dense": ("dense_engine", "DenseQueryEngine")}
+
+
+def pop_option(args, name, default=None, cast=str):
+    """
+    :param args: the command line arguments, the option and its value are removed from it
+    :param name: the option name, e.g. "--workers"
+    :param default: the value to return if the option is not given
+    :param cast: converts the value of the option
+    :return: the value of the option.
+    """
+    if name not in args:
+        return default
+    position = args.index(name)
+    if position + 1 >= len(args):
+        raise ValueError(f"Missing value for {name}")
+    value = args[position + 1]
+    del args[position:position + 2]
+    return cast(value)
+
+
+def pop_flag(args, name):
+    """
+    :param args: the command line arguments, the flag is removed from it
+    :param name: the flag name, e.g. "--compact"
+    :return: whether the flag was given.
+    """
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
+
+
+def engine_class(name):
+    """
+    :param name: a key of ENGINES
+    :return: the engine class, its module is imported on first use.
+    """
+    module_name, class_name = ENGINES[name]
+    return getattr(importlib.import_module(module_name), class_name)
 
 
 def parse_cmd_line():
-    if len(sys.argv) < 2:
+    args = list(sys.argv)
+    try:
+        workers = pop_option(args, "--workers", 1, int)
+        shards = pop_option(args, "--shards", 1, int)
+        memory_budget = pop_option(args, "--memory-budget", None, float)  # in megabytes
+        added_files = pop_option(args, "--add", [], lambda value: value.split(","))
+        deleted_documents = pop_option(args, "--delete", [], lambda value: value.split(","))
+        compact = pop_flag(args, "--compact")
+        store_weights = pop_flag(args, "--weights")  # dense postings for the dense engine
+        store_positions = pop_flag(args, "--positions")  # token positions for phrase and NEAR/k queries
+        store_forward = pop_flag(args, "--forward")  # document vectors for relevance feedback
+        feedback = pop_option(args, "--feedback", None, int)  # the number of documents that expand a query
+        top_k = pop_option(args, "--top-k", None, int)
+        engine = pop_option(args, "--engine", "exhaustive")
+        cache_size = pop_option(args, "--cache-size", None, int)  # the number of results kept in memory
+        cache_directory = pop_option(args, "--cache-dir")
+        cache_disk_size = pop_option(args, "--cache-disk-size", 65536, int)  # the number of results kept on disk
+        host = pop_option(args, "--host", "127.0.0.1")
+        port = pop_option(args, "--port", 8765, int)
+        batch_window = pop_option(args, "--batch-window", 2.0, float)  # in milliseconds
+    except ValueError as error:
+        print(error)
+        return
+
+    if len(args) < 2:
         print("Not enough arguments")
         return
 
-    action = sys.argv[1]
+    if top_k is not None and top_k < 1:
+        print("--top-k must be at least 1")
+        return
+
+    cache = None
+    if cache_size is not None or cache_directory is not None:
+        from query_cache import QueryResultCache
+        cache = QueryResultCache(1024 if cache_size is None else cache_size, cache_directory, cache_disk_size)
+
+    if engine not in ENGINES:
+        print(f"Unknown engine {engine}, expected one of {', '.join(ENGINES)}")
+        return
+
+    action = args[1]
     if action == "create_index":
-        if len(sys.argv) < 3:
+        if len(args) < 3:
             print("Not enough arguments")
             return
-        corpus_directory = sys.argv[2]
+        corpus_directory = args[2]
+        # the extension of the index path selects the format: .json (default) or .bin
+        index_path = args[3] if len(args) > 3 else "vsm_inverted_index.json"
         filenames = [f"cf{num}.xml" for num in range(74, 80)]
-        index = inverted_index.InvertedIndex(corpus_directory, filenames, "vsm_inverted_index.json")
-        index.build_inverted_index()
+        import index_storage
+        if store_weights and index_storage.index_format(index_path) == "json":
+            print("--weights needs a binary index (.bin or .cbin)")
+            return
+        if memory_budget is not None:
+            if workers > 1 or shards > 1 or store_positions or store_forward:
+                print("--workers, --shards, --positions and --forward cannot be combined with --memory-budget")
+                return
+            import streaming_index
+            index = streaming_index.StreamingInvertedIndex(corpus_directory, filenames, index_path,
+                                                           int(memory_budget * 2 ** 20), store_weights=store_weights)
+            index.build_inverted_index()
+        else:
+            import inverted_index
+            index = inverted_index.InvertedIndex(corpus_directory, filenames, index_path, shards, store_weights,
+                                                 store_positions, store_forward)
+            index.build_inverted_index(workers=workers)
 
     elif action == "query":
-        if len(sys.argv) < 4:
+        if len(args) < 4:
+            print("Not enough arguments")
+            return
+        index_path = args[2]
+        question = args[3]
+        from answer_query import answer_query
+        try:
+            answer_query(index_path,
+                         question,
+                         "ranked_query_docs.txt",
+                         top_k,
+                         cache,
+                         engine_class(engine),
+                         feedback)
+        except ValueError as error:  # e.g. an index without the sidecar that the engine or the query needs
+            print(error)
+
+    elif action == "batch_query":
+        if len(args) < 4:
+            print("Not enough arguments")
+            return
+        index_path = args[2]
+        queries_path = args[3]  # cfquery.xml or a text file with one query per line
+        from answer_query import answer_queries
+        try:
+            answer_queries(index_path,
+                           queries_path,
+                           "ranked_batch_query_docs.json",
+                           top_k,
+                           engine_class(engine),
+                           cache,
+                           feedback)
+        except ValueError as error:
+            print(error)
+            return
+        if cache is not None:
+            print("Query cache: " + ", ".join(f"{name} {value}" for name, value in cache.stats().items()))
+
+    elif action == "serve":
+        if len(args) < 3:
+            print("Not enough arguments")
+            return
+        index_path = args[2]
+        import query_server
+        try:
+            query_server.serve(index_path, host, port, engine_class(engine), workers, batch_window / 1000)
+        except ValueError as error:
+            print(error)
+
+    elif action == "update_index":
+        if len(args) < 3:
             print("Not enough arguments")
             return
-        index_path = sys.argv[2]
-        question = sys.argv[3]
-        answer_query(index_path,
-                     question,
-                     "ranked_query_docs.txt")
+        index_path = args[2]
+        import incremental_index
+        index = incremental_index.IncrementalIndex(index_path)
+        try:
+            if len(added_files) > 0:
+                index.add_files(added_files)
+            if len(deleted_documents) > 0:
+                index.delete_documents(deleted_documents)
+            if compact or len(index.segment_paths()) > incremental_index.MAX_SEGMENTS:
+                index.compact()
+        except ValueError as error:  # e.g. a sharded index or an index built without max_occurrences
+            print(error)
     else:
         print("Illegal action")
 
 
 if __name__ == "__main__":
-    parse_cmd_line()
+    # --profile traces the whole command, prints a summary and saves a Chrome trace to --profile-out
+    profile = pop_flag(sys.argv, "--profile")
+    profile_path = pop_option(sys.argv, "--profile-out", "vsm_profile.json")
+    if profile:
+        profiling.enable()
+    with profiling.span("vsm_ir"):
+        parse_cmd_line()
+    if profile:
+        print(profiling.profiler.summary_table())
+        profiling.profiler.save(profile_path)